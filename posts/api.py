@@ -0,0 +1,440 @@
+import logging
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.http import (Http404, HttpRequest, HttpResponse,
+                         HttpResponseNotModified, QueryDict,
+                         StreamingHttpResponse)
+from django.shortcuts import get_object_or_404
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from yatube.settings import (API_BATCH_LIMIT, API_MAX_LIMIT, COMMENTS_ON_PAGE,
+                             POSTS_ON_PAGE)
+
+from . import counters, msgpack
+from .models import (ArchivedComment, ArchivedPost, ChangeLog, Comment,
+                     Follow, Group, Post, User)
+from .pagination import decode_cursor, encode_cursor
+from .serializers import (COMMENT_FIELDS, JSON, MSGPACK, POST_FIELDS,
+                          FieldsetError, PageStream, Raw, StreamedArray,
+                          StreamedMap, get_codec, parse_fields,
+                          prepare_queryset, serialize)
+from .shards import ShardedFeed, find_on_shards, sharded
+from .views import FEED_ORDERING, feed_posts, following_queryset
+
+logger = logging.getLogger(__name__)
+
+# в API ветки комментариев идут в порядке обхода дерева
+COMMENTS_API_ORDERING = ("path",)
+
+
+def api_response(request, data, status=200):
+    """Ответ в формате, который клиент запросил через Accept или ?format=."""
+    codec = get_codec(request)
+    response = HttpResponse(codec.encode(data), status=status,
+                            content_type=codec.content_type)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def api_stream(request, value):
+    codec = get_codec(request)
+    response = StreamingHttpResponse(codec.stream(value),
+                                     content_type=codec.content_type)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def error_response(request, detail, status):
+    return api_response(request, {'detail': detail}, status)
+
+
+def get_cached(request, model, **lookup):
+    """get_object_or_404 с учётом карты идентичности пакетного запроса.
+
+    Внутри batch все подзапросы делят request.identity_map, поэтому один и
+    тот же автор или группа читается из базы один раз на весь пакет.
+    """
+    identity_map = getattr(request, 'identity_map', None)
+    if identity_map is None:
+        return get_object_or_404(model, **lookup)
+    key = (model, tuple(sorted(lookup.items())))
+    if key not in identity_map:
+        identity_map[key] = model.objects.filter(**lookup).first()
+    if identity_map[key] is None:
+        raise Http404
+    return identity_map[key]
+
+
+def get_limit(request, default):
+    try:
+        limit = int(request.GET.get('limit', default))
+    except ValueError:
+        return default
+    return min(max(limit, 1), API_MAX_LIMIT)
+
+
+def stream_posts(request, queryset, aliases=None):
+    """Лента постов с курсором, выборкой полей и потоковой сериализацией.
+
+    Посты читаются со всех шардов или с aliases. Вместо одной выборки
+    можно передать список выборок с уже выбранной базой (рабочие и
+    архивные посты автора) - они сливаются по FEED_ORDERING.
+    """
+    try:
+        names = parse_fields(POST_FIELDS, request.GET.get('fields'))
+    except FieldsetError as error:
+        return error_response(request, str(error), 400)
+    if isinstance(queryset, list):
+        queryset = ShardedFeed([
+            prepare_queryset(part, POST_FIELDS, names, FEED_ORDERING)
+            for part in queryset
+        ], FEED_ORDERING)
+    else:
+        queryset = sharded(
+            prepare_queryset(queryset, POST_FIELDS, names, FEED_ORDERING),
+            FEED_ORDERING, aliases
+        )
+    page = PageStream(queryset, FEED_ORDERING, request.GET.get('cursor'),
+                      get_limit(request, POSTS_ON_PAGE), POST_FIELDS, names)
+    return api_stream(request, page.as_map())
+
+
+def archived_posts():
+    return ArchivedPost.objects.select_related('author', 'group')
+
+
+def comments_queryset(request, post):
+    """Комментарии поста с его шарда, для архивного поста - из архива."""
+    names = parse_fields(COMMENT_FIELDS, request.GET.get('comment_fields'))
+    model = ArchivedComment if post.archived else Comment
+    queryset = prepare_queryset(
+        model.objects.using(post._state.db).filter(post_id=post.id),
+        COMMENT_FIELDS, names, COMMENTS_API_ORDERING
+    )
+    return queryset, names
+
+
+def get_post(post_id, prepare):
+    """Пост по id с любого шарда, рабочий или архивный, или 404.
+
+    prepare(queryset) сужает выборку до нужных полей.
+    """
+    for queryset in (feed_posts(), archived_posts()):
+        post = find_on_shards(prepare(queryset), id=post_id)
+        if post is not None:
+            return post
+    raise Http404
+
+
+@require_GET
+def posts_list(request):
+    """Общая лента; ids=1,2,3 оставляет в ней только указанные посты."""
+    posts = feed_posts()
+    ids = request.GET.get('ids')
+    if ids:
+        posts = posts.filter(id__in=[pk for pk in ids.split(',')
+                                     if pk.isdigit()])
+    return stream_posts(request, posts)
+
+
+@require_GET
+def group_posts_list(request, slug):
+    group = get_cached(request, Group, slug=slug)
+    return stream_posts(request, feed_posts().filter(group=group))
+
+
+@require_GET
+def profile_posts_list(request, username):
+    author = get_cached(request, User, username=username)
+    # рабочие и архивные посты автора лежат на одном шарде
+    return stream_posts(request, [
+        queryset.on_shard_of(author.id).filter(author=author)
+        for queryset in (feed_posts(), archived_posts())
+    ])
+
+
+@require_GET
+def profile_detail(request, username):
+    """Счётчики профиля автора."""
+    author = get_cached(request, User, username=username)
+    following = (request.user.is_authenticated
+                 and Follow.objects.filter(user=request.user,
+                                           author=author).exists())
+    return api_response(request, {
+        'username': author.username,
+        'full_name': author.get_full_name(),
+        'posts': author.posts.count() + author.archived_posts.count(),
+        'followers': author.following.count(),
+        'followings': author.follower.count(),
+        'following': following,
+    })
+
+
+@require_GET
+def follow_posts_list(request):
+    if not request.user.is_authenticated:
+        return error_response(request, 'Требуется авторизация', 401)
+    return stream_posts(request, *following_queryset(request.user))
+
+
+@require_GET
+def post_detail(request, post_id):
+    """Пост и первая порция его комментариев.
+
+    Следующие порции отдаёт post_comments_list по comments.next_cursor.
+    """
+    try:
+        names = parse_fields(POST_FIELDS, request.GET.get('fields'))
+        parse_fields(COMMENT_FIELDS, request.GET.get('comment_fields'))
+    except FieldsetError as error:
+        return error_response(request, str(error), 400)
+    post = get_post(post_id, lambda queryset: prepare_queryset(
+        queryset, POST_FIELDS, names
+    ))
+    comments, comment_names = comments_queryset(request, post)
+    page = PageStream(comments, COMMENTS_API_ORDERING, None,
+                      get_limit(request, COMMENTS_ON_PAGE),
+                      COMMENT_FIELDS, comment_names)
+    return api_stream(request, StreamedMap([
+        ('post', serialize(post, POST_FIELDS, names)),
+        ('comments', page.as_map()),
+    ]))
+
+
+@require_GET
+def post_comments_list(request, post_id):
+    post = get_post(post_id, lambda queryset: queryset.select_related(None)
+                    .only('id'))
+    try:
+        comments, names = comments_queryset(request, post)
+    except FieldsetError as error:
+        return error_response(request, str(error), 400)
+    page = PageStream(comments, COMMENTS_API_ORDERING,
+                      request.GET.get('cursor'),
+                      get_limit(request, COMMENTS_ON_PAGE),
+                      COMMENT_FIELDS, names)
+    return api_stream(request, page.as_map())
+
+
+def new_posts_response(request, feeds):
+    """Сколько постов появилось в лентах feeds после версии since.
+
+    Если новых постов нет (since или If-None-Match совпадают с текущей
+    версией), ответ - пустой 304.
+    """
+    version = counters.feeds_version(feeds)
+    etag = f'"{version}"'
+    since = request.GET.get('since', '')
+    if (request.META.get('HTTP_IF_NONE_MATCH') == etag
+            or since == str(version)):
+        response = HttpResponseNotModified()
+    else:
+        new = (counters.new_posts(feeds, int(since), version)
+               if since.isdigit() else 0)
+        response = api_response(request, {'new': new, 'version': version})
+    response['ETag'] = etag
+    return response
+
+
+@require_GET
+def posts_new(request):
+    return new_posts_response(request, [counters.INDEX_FEED])
+
+
+@require_GET
+def group_posts_new(request, slug):
+    group = get_cached(request, Group, slug=slug)
+    return new_posts_response(request, [counters.group_feed(group.id)])
+
+
+@require_GET
+def profile_posts_new(request, username):
+    author = get_cached(request, User, username=username)
+    return new_posts_response(request, [counters.author_feed(author.id)])
+
+
+@require_GET
+def follow_posts_new(request):
+    if not request.user.is_authenticated:
+        return error_response(request, 'Требуется авторизация', 401)
+    authors = Follow.objects.filter(user=request.user).values_list(
+        'author_id', flat=True
+    )
+    return new_posts_response(request, counters.follow_feeds(
+        request.user.id, authors
+    ))
+
+
+def collapse_changes(rows):
+    """Сводит записи журнала к последнему состоянию каждого поста и автора.
+
+    Возвращает ({id поста: изменение}, {id автора: подписка/отписка}).
+    Изменение числа комментариев после правки поста правку не отменяет.
+    """
+    posts, authors = {}, {}
+    for kind, post_id, author_id in rows:
+        if kind in (ChangeLog.FOLLOW, ChangeLog.UNFOLLOW):
+            authors[author_id] = kind
+        elif not (kind == ChangeLog.COMMENTS
+                  and posts.get(post_id) == ChangeLog.POST):
+            posts[post_id] = kind
+    return posts, authors
+
+
+def changes_response(request, changes):
+    """Изменения ленты после токена: только то, что поменялось.
+
+    Токен - непрозрачная строка с номером последней записи журнала. Без
+    токена, с битым токеном или при слишком большом числе изменений
+    приходит reset: клиенту дешевле перечитать ленту целиком.
+    """
+    latest = ChangeLog.objects.order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+    since = decode_cursor(request.GET.get('token'), 1)
+    rows = []
+    if since is not None:
+        rows = list(changes.filter(id__gt=since[0]).order_by('id')
+                    .values_list('id', 'kind', 'post_id', 'author_id')
+                    [:settings.SYNC_MAX_CHANGES + 1])
+    token = encode_cursor([max([latest] + [row[0] for row in rows])])
+    if since is None or len(rows) > settings.SYNC_MAX_CHANGES:
+        return api_response(request, {'reset': True, 'token': token})
+    posts, authors = collapse_changes(row[1:] for row in rows)
+    followed = [pk for pk, kind in authors.items()
+                if kind == ChangeLog.FOLLOW]
+    upserts = {pk for pk, kind in posts.items() if kind == ChangeLog.POST}
+    for author_id in followed:
+        upserts.update(Post.objects.on_shard_of(author_id)
+                       .filter(author_id=author_id)
+                       .order_by(*FEED_ORDERING)
+                       .values_list('id', flat=True)[:POSTS_ON_PAGE])
+    counted = {pk for pk, kind in posts.items()
+               if kind == ChangeLog.COMMENTS} - upserts
+    names = list(POST_FIELDS)
+    found = list(sharded(prepare_queryset(feed_posts(), POST_FIELDS, names)
+                         .filter(id__in=upserts).order_by(*FEED_ORDERING),
+                         FEED_ORDERING))
+    counts = list(sharded(Post.objects.filter(id__in=counted)
+                          .annotate(comments_count=Count('comments'))
+                          .order_by('id').values('id', 'comments_count'),
+                          ('id',)))
+    alive = {post.id for post in found} | {row['id'] for row in counts}
+    usernames = dict(User.objects.filter(id__in=authors)
+                     .values_list('id', 'username'))
+    return api_response(request, {
+        'reset': False,
+        'token': token,
+        'posts': [serialize(post, POST_FIELDS, names) for post in found],
+        'comment_counts': counts,
+        'deleted': sorted(pk for pk in posts if pk not in alive),
+        'followed': [usernames[pk] for pk in followed if pk in usernames],
+        'unfollowed': [usernames[pk] for pk, kind in authors.items()
+                       if kind == ChangeLog.UNFOLLOW and pk in usernames],
+    })
+
+
+@require_GET
+def follow_changes(request):
+    """Изменения избранной ленты: посты авторов, на которых подписан
+    пользователь, и его собственные подписки и отписки."""
+    if not request.user.is_authenticated:
+        return error_response(request, 'Требуется авторизация', 401)
+    authors = Follow.objects.filter(user=request.user).values('author_id')
+    return changes_response(request, ChangeLog.objects.filter(
+        Q(kind__in=ChangeLog.POST_KINDS, author_id__in=authors)
+        | Q(kind__in=(ChangeLog.FOLLOW, ChangeLog.UNFOLLOW),
+            user_id=request.user.id)
+    ))
+
+
+@require_GET
+def group_changes(request, slug):
+    group = get_cached(request, Group, slug=slug)
+    return changes_response(request, ChangeLog.objects.filter(
+        group_id=group.id, kind__in=ChangeLog.POST_KINDS
+    ))
+
+
+def run_subrequest(request, url, codec):
+    """Выполняет GET-запрос к API внутри пакета без повторного прохода
+    через middleware: пользователь, сессия и карта идентичности общие.
+    Ответ подзапроса запрашивается сразу в формате codec.
+    """
+    path, _, query = url.partition('?')
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return 404, codec.encode({'detail': 'Не найдено'})
+    if match.func.__module__ != __name__ or match.func is batch:
+        return 400, codec.encode({'detail': 'Допустимы только запросы к API'})
+    subrequest = HttpRequest()
+    subrequest.method = 'GET'
+    subrequest.path = subrequest.path_info = path
+    subrequest.GET = QueryDict(query)
+    subrequest.META = dict(request.META, REQUEST_METHOD='GET',
+                           PATH_INFO=path, QUERY_STRING=query,
+                           HTTP_ACCEPT=codec.content_type)
+    subrequest.COOKIES = request.COOKIES
+    subrequest.user = request.user
+    subrequest.session = request.session
+    subrequest.identity_map = request.identity_map
+    try:
+        response = match.func(subrequest, *match.args, **match.kwargs)
+        if response.streaming:
+            # потоковое тело собирается здесь же: ошибка посреди него
+            # станет ответом 500 этого подзапроса, а не обрывом всего пакета
+            return response.status_code, b''.join(response.streaming_content)
+        return response.status_code, response.content
+    except Http404:
+        return 404, codec.encode({'detail': 'Не найдено'})
+    except Exception:
+        logger.exception('Ошибка подзапроса пакета: %s', url)
+        return 500, codec.encode({'detail': 'Ошибка сервера'})
+
+
+@csrf_exempt
+@require_POST
+def batch(request):
+    """Несколько GET-запросов к API за один HTTP-запрос.
+
+    Тело: {"requests": [{"id": "feed", "url": "/api/v1/follow/posts/"}]}
+    в JSON или MessagePack. Одинаковые url выполняются один раз, ответы
+    подзапросов вставляются в общий ответ как есть, без повторного
+    разбора. POST здесь только ради тела: подзапросы - чтения API, ничего
+    не меняют, поэтому CSRF-токен не нужен и клиенты без сессии
+    обращаются к пакету, как к остальному API.
+    """
+    body_codec = (MSGPACK if request.content_type in msgpack.CONTENT_TYPES
+                  else JSON)
+    try:
+        items = body_codec.decode(request.body)['requests']
+        urls = [item['url'] for item in items]
+        if not all(isinstance(url, str) for url in urls):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return error_response(
+            request, 'Ожидается {"requests": [{"id": ..., "url": ...}]}', 400
+        )
+    if len(urls) > API_BATCH_LIMIT:
+        return error_response(
+            request, f'Не больше {API_BATCH_LIMIT} запросов в пакете', 400
+        )
+    request.identity_map = {}
+    codec = get_codec(request)
+    results = {}
+
+    def responses():
+        for item, url in zip(items, urls):
+            if url not in results:
+                results[url] = run_subrequest(request, url, codec)
+            status, body = results[url]
+            yield StreamedMap([('id', item.get('id')), ('status', status),
+                               ('body', Raw(body))])
+    return api_stream(request, StreamedMap([
+        ('responses', StreamedArray(responses(), len(items))),
+    ]))
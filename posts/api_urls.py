@@ -0,0 +1,27 @@
+from django.urls import path
+
+from . import api
+
+urlpatterns = [
+    path('posts/', api.posts_list, name='api_posts'),
+    path('posts/new/', api.posts_new, name='api_posts_new'),
+    path('posts/<int:post_id>/', api.post_detail, name='api_post'),
+    path('posts/<int:post_id>/comments/', api.post_comments_list,
+         name='api_post_comments'),
+    path('groups/<slug:slug>/posts/', api.group_posts_list,
+         name='api_group_posts'),
+    path('groups/<slug:slug>/posts/new/', api.group_posts_new,
+         name='api_group_posts_new'),
+    path('groups/<slug:slug>/changes/', api.group_changes,
+         name='api_group_changes'),
+    path('users/<str:username>/', api.profile_detail, name='api_profile'),
+    path('users/<str:username>/posts/', api.profile_posts_list,
+         name='api_profile_posts'),
+    path('users/<str:username>/posts/new/', api.profile_posts_new,
+         name='api_profile_posts_new'),
+    path('follow/posts/', api.follow_posts_list, name='api_follow_posts'),
+    path('follow/posts/new/', api.follow_posts_new,
+         name='api_follow_posts_new'),
+    path('follow/changes/', api.follow_changes, name='api_follow_changes'),
+    path('batch/', api.batch, name='api_batch'),
+]
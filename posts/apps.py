@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Посты'
+
+    def ready(self):
+        from yatube import sqlite  # noqa: F401
+
+        from . import shards, signals  # noqa: F401
@@ -0,0 +1,159 @@
+"""Пачечное заполнение новых столбцов больших таблиц.
+
+Один UPDATE на миллионы строк держит блокировку записи SQLite, пока не
+закончится. backfill() проходит таблицу по первичному ключу пачками по
+BACKFILL_BATCH_SIZE строк: каждая пачка - отдельная короткая транзакция
+под блокировкой писателя из posts.writes (с повтором при SQLITE_BUSY), а
+между пачками - пауза BACKFILL_PAUSE, в которую проходят записи сайта.
+
+Прогресс хранится в таблице PROGRESS_TABLE той же базы и обновляется в
+транзакции пачки, поэтому прерванное заполнение продолжается со следующей
+пачки. Законченное заполнение повторно не запускается. Ход работы пишется
+в лог posts.backfill и виден в manage.py backfill_status.
+
+В миграции заполнение подключается операцией RunBackfill; миграция должна
+быть с atomic = False, иначе все пачки оказались бы в одной транзакции.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections, migrations
+from django.db.transaction import TransactionManagementError
+
+from .writes import run_batch
+
+PROGRESS_TABLE = 'backfill_progress'
+COLUMNS = ('name', 'last_pk', 'done', 'total', 'started', 'updated',
+           'finished')
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_progress_table(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} ('
+            f'name TEXT PRIMARY KEY, last_pk INTEGER, '
+            f'done INTEGER NOT NULL, total INTEGER NOT NULL, '
+            f'started REAL NOT NULL, updated REAL NOT NULL, finished REAL)'
+        )
+
+
+def progress(alias, name=None):
+    """Записи прогресса базы alias: все или одна с именем name."""
+    ensure_progress_table(alias)
+    query = f'SELECT {", ".join(COLUMNS)} FROM {PROGRESS_TABLE}'
+    params = []
+    if name is not None:
+        query += ' WHERE name = %s'
+        params.append(name)
+    with connections[alias].cursor() as cursor:
+        cursor.execute(query + ' ORDER BY started', params)
+        return [dict(zip(COLUMNS, row)) for row in cursor.fetchall()]
+
+
+def save_progress(alias, state):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f'INSERT OR REPLACE INTO {PROGRESS_TABLE} '
+            f'({", ".join(COLUMNS)}) VALUES ({", ".join(["%s"] * 7)})',
+            [state[column] for column in COLUMNS]
+        )
+
+
+def run_chunk(alias, update, chunk, state):
+    """update(chunk) и прогресс одной транзакцией."""
+    update(chunk)
+    save_progress(alias, state)
+
+
+def backfill(name, queryset, update, batch_size=None, pause=None):
+    """Вызывает update(пачка) для всех строк queryset по порядку pk.
+
+    Пачка - QuerySet строк queryset с pk в полуинтервале (предыдущая
+    граница, граница]; update может обновить её одним UPDATE или обойти
+    и сохранить через bulk_update. Строки, добавленные во время заполнения
+    за последней границей, тоже попадут в пачки. Возвращает число строк,
+    пройденных этим запуском.
+    """
+    alias = queryset.db
+    if connections[alias].in_atomic_block:
+        raise TransactionManagementError(
+            f'Заполнение {name} внутри транзакции: все пачки попали бы в '
+            f'неё. Поставьте миграции atomic = False.'
+        )
+    batch_size = batch_size or settings.BACKFILL_BATCH_SIZE
+    pause = settings.BACKFILL_PAUSE if pause is None else pause
+    queryset = queryset.order_by('pk')
+    found = progress(alias, name)
+    if found and found[0]['finished'] is not None:
+        return 0
+    state = found[0] if found else {
+        'name': name, 'last_pk': None, 'done': 0, 'total': queryset.count(),
+        'started': time.time(), 'updated': time.time(), 'finished': None,
+    }
+    processed = 0
+    while True:
+        remaining = queryset
+        if state['last_pk'] is not None:
+            remaining = remaining.filter(pk__gt=state['last_pk'])
+        bounds = list(remaining.values_list('pk', flat=True)[:batch_size])
+        if not bounds:
+            break
+        chunk = remaining.filter(pk__lte=bounds[-1])
+        state = dict(state, last_pk=bounds[-1],
+                     done=state['done'] + len(bounds), updated=time.time(),
+                     total=max(state['total'], state['done'] + len(bounds)))
+        [(ok, result)] = run_batch([(run_chunk,
+                                     (alias, update, chunk, state), {})],
+                                   aliases=[alias])
+        if not ok:
+            raise result
+        processed += len(bounds)
+        elapsed = max(state['updated'] - state['started'], 0.001)
+        logger.info('%s: %s из %s строк, %.0f строк/с', name, state['done'],
+                    state['total'], state['done'] / elapsed)
+        if len(bounds) < batch_size:
+            break
+        time.sleep(pause)
+    state = dict(state, finished=time.time())
+    run_batch([(save_progress, (alias, state), {})], aliases=[alias])
+    return processed
+
+
+class RunBackfill(migrations.RunPython):
+    """Операция миграции: backfill() по всем строкам модели.
+
+    update получает пачку строк исторической модели, как обычный код
+    RunPython. Откат ничего не делает: столбец удалит обратная операция
+    его добавления.
+    """
+
+    def __init__(self, name, model, update, batch_size=None, pause=None):
+        self.backfill_name = name
+        self.model = model
+        self.update = update
+        self.batch_size = batch_size
+        self.pause = pause
+        super().__init__(self.forward, migrations.RunPython.noop)
+
+    def deconstruct(self):
+        # аргументы RunPython (forward и noop) строятся в __init__ заново,
+        # в миграцию пишутся только собственные аргументы операции
+        kwargs = {'name': self.backfill_name, 'model': self.model,
+                  'update': self.update}
+        if self.batch_size is not None:
+            kwargs['batch_size'] = self.batch_size
+        if self.pause is not None:
+            kwargs['pause'] = self.pause
+        return self.__class__.__name__, [], kwargs
+
+    def forward(self, apps, schema_editor):
+        model = apps.get_model(self.model)
+        backfill(self.backfill_name,
+                 model._default_manager.using(schema_editor.connection.alias),
+                 self.update, self.batch_size, self.pause)
+
+    def describe(self):
+        return f'Пачечное заполнение {self.backfill_name}'
@@ -0,0 +1,179 @@
+"""Версии лент для опроса новых постов и ревизии для кэша лент.
+
+Версия ленты - номер последней записи журнала ChangeLog, которая
+добавила в ленту пост: новый пост, а в ленте группы - и пост, перенесённый
+в неё. Журнал только дописывается, поэтому версия не убывает ни при
+удалении и архивации постов, ни при промахе кэша, когда её перечитывают из
+базы. Число новых постов после версии клиента считается по журналу:
+посты из записей после неё, которых не было в ленте до неё.
+
+Ревизия ленты - номер последней записи журнала, которая меняет то, что
+лента показывает: любое изменение её постов, включая правки, удаления и
+перенос в архив, а для лент групп и авторов - ещё и правку самой группы
+или имени автора. По ревизии кэшируется уже отрисованное содержимое ленты
+и считается её ETag.
+
+Версии и ревизии берутся из общего для всех процессов журнала, поэтому
+совпадают во всех процессах. LocMemCache у каждого процесса свой, а сразу
+обновляет их только записавший процесс, поэтому остальные хранят их не
+дольше FEED_VERSION_TIMEOUT секунд.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import ChangeLog
+
+INDEX_FEED = 'index'
+
+
+def version_key(feed):
+    return f'feed-version:{feed}'
+
+
+def group_feed(group_id):
+    return f'group:{group_id}'
+
+
+def author_feed(author_id):
+    return f'author:{author_id}'
+
+
+def follows_feed(user_id):
+    """Подписки и отписки пользователя: меняют состав его избранной
+    ленты."""
+    return f'follows:{user_id}'
+
+
+def post_feeds(post):
+    """Ленты, в которых появляется пост."""
+    feeds = [INDEX_FEED, author_feed(post.author_id)]
+    if post.group_id:
+        feeds.append(group_feed(post.group_id))
+    return feeds
+
+
+def feed_changes(feed):
+    """Условие на записи журнала, которые меняют версию ленты feed."""
+    kind, _, key = feed.partition(':')
+    if feed == INDEX_FEED:
+        return Q(kind=ChangeLog.POST)
+    if kind == 'author':
+        return Q(kind=ChangeLog.POST, author_id=key)
+    if kind == 'group':
+        return Q(kind=ChangeLog.POST, group_id=key)
+    return Q(kind__in=(ChangeLog.FOLLOW, ChangeLog.UNFOLLOW), user_id=key)
+
+
+def bump_changes(keys, change_id):
+    """Поднимает закэшированные номера записей журнала keys до
+    change_id."""
+    for key in keys:
+        if change_id > cache.get(key, 0):
+            cache.set(key, change_id, settings.FEED_VERSION_TIMEOUT)
+
+
+def latest_change(key, changes):
+    """Номер последней записи журнала из changes, закэшированный под
+    key."""
+    change_id = cache.get(key)
+    if change_id is None:
+        # по индексу ленты в журнале с конца до первой подходящей записи
+        change_id = (ChangeLog.objects.filter(changes).order_by('-id')
+                     .values_list('id', flat=True).first() or 0)
+        cache.set(key, change_id, settings.FEED_VERSION_TIMEOUT)
+    return change_id
+
+
+def bump_versions(feeds, change_id):
+    """Поднимает версии лент feeds до записи журнала change_id."""
+    bump_changes([version_key(feed) for feed in feeds], change_id)
+
+
+def feed_version(feed):
+    """Версия ленты feed, при промахе кэша - из журнала."""
+    return latest_change(version_key(feed), feed_changes(feed))
+
+
+def index_version():
+    return feed_version(INDEX_FEED)
+
+
+def follow_feeds(user_id, author_ids):
+    """Ленты, из которых складывается избранная лента пользователя."""
+    return ([follows_feed(user_id)]
+            + [author_feed(author_id) for author_id in author_ids])
+
+
+def feeds_version(feeds):
+    """Общая версия нескольких лент одним чтением кэша."""
+    keys = {version_key(feed): feed for feed in feeds}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        versions[key] = feed_version(keys[key])
+    return max(versions.values(), default=0)
+
+
+def new_posts(feeds, since, version):
+    """Сколько постов появилось в лентах feeds между версиями since и
+    version, но не больше SYNC_MAX_CHANGES.
+
+    Правки и повторные записи о постах, которые уже были в ленте до since,
+    не считаются. Итог кэшируется: клиенты, открывшие ленту в одно время,
+    спрашивают об одной и той же паре версий.
+    """
+    if since >= version:
+        return 0
+    digest = hashlib.md5(','.join(sorted(feeds)).encode()).hexdigest()
+    key = f'new-posts:{digest}:{since}:{version}'
+    count = cache.get(key)
+    if count is not None:
+        return count
+    changes = Q()
+    for feed in feeds:
+        changes |= feed_changes(feed)
+    # посты автора, на которого подписались после since, новые только
+    # после подписки: прежние пришли в ленту вместе с ней
+    followed = dict(ChangeLog.objects.filter(changes, kind=ChangeLog.FOLLOW,
+                                             id__gt=since)
+                    .order_by('id').values_list('author_id', 'id'))
+    changes = ChangeLog.objects.filter(changes, kind=ChangeLog.POST)
+    rows = (changes.filter(id__gt=since, id__lte=version)
+            .values_list('id', 'post_id', 'author_id')
+            [:settings.SYNC_MAX_CHANGES])
+    added = {post_id for change_id, post_id, author_id in rows
+             if change_id > followed.get(author_id, 0)}
+    known = set(changes.filter(id__lte=since, post_id__in=added)
+                .values_list('post_id', flat=True))
+    count = len(added - known)
+    cache.set(key, count, settings.FEED_CACHE_TIMEOUT)
+    return count
+
+
+def revision_key(feed):
+    return f'feed-revision:{feed}'
+
+
+def revision_changes(feed):
+    """Условие на записи журнала, которые меняют содержимое ленты feed."""
+    kind, _, key = feed.partition(':')
+    posts = (ChangeLog.POST, ChangeLog.POST_DELETED)
+    if kind == 'author':
+        return Q(kind__in=posts + (ChangeLog.USER,), author_id=key)
+    if kind == 'group':
+        return Q(kind__in=posts + (ChangeLog.GROUP,), group_id=key)
+    return Q(kind__in=posts)
+
+
+def bump_revisions(feeds, change_id):
+    """Поднимает ревизии лент feeds до записи журнала change_id."""
+    bump_changes([revision_key(feed) for feed in feeds], change_id)
+
+
+def feed_revision(feed, changes=None):
+    """Ревизия ленты feed, при промахе кэша - из журнала по условию
+    changes (по умолчанию revision_changes)."""
+    return latest_change(revision_key(feed),
+                         changes or revision_changes(feed))
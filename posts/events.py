@@ -0,0 +1,288 @@
+"""Живые обновления лент через Server-Sent Events.
+
+Сервер событий - отдельный asyncio-процесс (manage.py runsse): ожидающие
+соединения держит один поток, а не воркеры WSGI. Источник событий -
+журнал ChangeLog: один опрос базы на процесс раздаёт новые записи
+подписчикам через Broker. Номер записи журнала служит id события, поэтому
+после переподключения с Last-Event-ID пропущенное дочитывается из журнала.
+"""
+import asyncio
+import logging
+import re
+from collections import defaultdict
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db.models import Q
+
+from .counters import INDEX_FEED, author_feed, group_feed
+from .models import ChangeLog, Follow, Group, Post, User
+from .serializers import POST_FIELDS, dumps, prepare_queryset, serialize
+from .shards import on_shards
+
+EVENTS_ROUTE = re.compile(r'^/events/(?:(?P<kind>group|author)/'
+                          r'(?P<key>[^/]+)/|(?P<follow>follow/))?$')
+logger = logging.getLogger(__name__)
+
+# сколько событий за раз читается из журнала
+EVENTS_BATCH = 500
+
+RESPONSE_HEADERS = (b'HTTP/1.1 200 OK\r\n'
+                    b'Content-Type: text/event-stream; charset=utf-8\r\n'
+                    b'Cache-Control: no-cache\r\n'
+                    b'X-Accel-Buffering: no\r\n'
+                    b'Connection: keep-alive\r\n\r\n'
+                    b'retry: 3000\n\n')
+NOT_FOUND = (b'HTTP/1.1 404 Not Found\r\n'
+             b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+HEARTBEAT = b': ping\n\n'
+
+
+class Subscriber:
+    """Очередь событий одного соединения ограниченного размера."""
+
+    def __init__(self, channels, size):
+        self.channels = channels
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def offer(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # клиент не успевает читать: очередь сбрасывается, соединение
+            # закрывается, а пропущенное клиент дочитает по Last-Event-ID
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Broker:
+    """Подписки соединений на каналы лент внутри процесса."""
+
+    def __init__(self):
+        self.channels = defaultdict(set)
+
+    def subscribe(self, channels, size):
+        subscriber = Subscriber(channels, size)
+        for channel in channels:
+            self.channels[channel].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        for channel in subscriber.channels:
+            self.channels[channel].discard(subscriber)
+            if not self.channels[channel]:
+                del self.channels[channel]
+
+    def publish(self, channels, event):
+        subscribers = set()
+        for channel in channels:
+            subscribers.update(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            subscriber.offer(event)
+
+
+def format_event(event):
+    event_id, name, data = event
+    return f'id: {event_id}\nevent: {name}\ndata: {data}\n\n'.encode()
+
+
+def channel_filter(channels):
+    """Условие на записи журнала, попадающие в каналы."""
+    if INDEX_FEED in channels:
+        return Q()
+    authors = [channel.split(':')[1] for channel in channels
+               if channel.startswith('author:')]
+    groups = [channel.split(':')[1] for channel in channels
+              if channel.startswith('group:')]
+    return Q(author_id__in=authors) | Q(group_id__in=groups)
+
+
+def latest_event_id():
+    return ChangeLog.objects.order_by('-id').values_list(
+        'id', flat=True
+    ).first() or 0
+
+
+def load_events(after, channels=None):
+    """События журнала после after: список пар (каналы, событие).
+
+    Событие - (id, имя, данные в JSON). Пост, убранный из группы, но не
+    удалённый, удаляется только из ленты этой группы.
+    """
+    changes = ChangeLog.objects.filter(
+        id__gt=after, kind__in=(ChangeLog.POST, ChangeLog.POST_DELETED)
+    )
+    if channels is not None:
+        changes = changes.filter(channel_filter(channels))
+    rows = list(changes.order_by('id').values_list(
+        'id', 'kind', 'post_id', 'author_id', 'group_id'
+    )[:EVENTS_BATCH])
+    names = list(POST_FIELDS)
+    found = prepare_queryset(Post.objects.all(), POST_FIELDS, names).filter(
+        id__in=[row[2] for row in rows]
+    )
+    posts = {post.id: serialize(post, POST_FIELDS, names)
+             for queryset in on_shards(found) for post in queryset}
+    events = []
+    for event_id, kind, post_id, author_id, group_id in rows:
+        channels = [INDEX_FEED, author_feed(author_id)]
+        if group_id:
+            channels.append(group_feed(group_id))
+        if kind == ChangeLog.POST and post_id in posts:
+            event = (event_id, 'post', dumps(posts[post_id]))
+        else:
+            if post_id in posts:
+                channels = [group_feed(group_id)]
+            event = (event_id, 'post_deleted', dumps({'id': post_id}))
+        events.append((channels, event))
+    return events
+
+
+def resolve_channels(path, session_key):
+    """Каналы ленты по адресу запроса; None - такой ленты нет."""
+    match = EVENTS_ROUTE.match(path)
+    if match is None:
+        return None
+    if match['kind'] == 'group':
+        group = Group.objects.filter(slug=match['key']).first()
+        return group and [group_feed(group.id)]
+    if match['kind'] == 'author':
+        author = User.objects.filter(username=match['key']).first()
+        return author and [author_feed(author.id)]
+    if match['follow']:
+        engine = import_module(settings.SESSION_ENGINE)
+        user_id = engine.SessionStore(session_key).get(SESSION_KEY)
+        if user_id is None:
+            return None
+        return [author_feed(author_id) for author_id in
+                Follow.objects.filter(user_id=user_id)
+                .values_list('author_id', flat=True)]
+    return [INDEX_FEED]
+
+
+async def read_request(reader):
+    """Строка запроса и заголовки (имена в нижнем регистре)."""
+    request_line = (await reader.readline()).decode('latin-1').split()
+    if len(request_line) != 3:
+        raise ValueError('Неверная строка запроса')
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1').strip()
+        if not line:
+            break
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return request_line, headers
+
+
+async def send_events(subscriber, writer, last_id):
+    """Пишет события подписчика, а в паузах - heartbeat-комментарии.
+
+    Медленный клиент отключается, если не принял данные за интервал
+    heartbeat или переполнил свою очередь.
+    """
+    while True:
+        try:
+            event = await asyncio.wait_for(subscriber.queue.get(),
+                                           settings.SSE_HEARTBEAT)
+        except asyncio.TimeoutError:
+            writer.write(HEARTBEAT)
+        else:
+            if event is None:
+                return
+            if event[0] <= last_id:
+                continue
+            writer.write(format_event(event))
+        await asyncio.wait_for(writer.drain(), settings.SSE_HEARTBEAT)
+
+
+async def replay(writer, channels, last_id):
+    """Дописывает пропущенное после Last-Event-ID; вернёт номер последнего
+    отправленного события."""
+    loop = asyncio.get_running_loop()
+    events = await loop.run_in_executor(None, load_events, last_id,
+                                        channels)
+    for _, event in events:
+        writer.write(format_event(event))
+        last_id = event[0]
+    if len(events) == EVENTS_BATCH:
+        # отстал слишком сильно: пусть клиент перечитает ленту целиком
+        writer.write(b'event: reset\ndata: {}\n\n')
+    return last_id
+
+
+async def handle(reader, writer, broker):
+    loop = asyncio.get_running_loop()
+    subscriber = None
+    try:
+        (_, target, _), headers = await read_request(reader)
+        cookies = SimpleCookie(headers.get('cookie', ''))
+        session = cookies.get(settings.SESSION_COOKIE_NAME)
+        channels = await loop.run_in_executor(
+            None, resolve_channels, urlsplit(target).path,
+            session.value if session else None
+        )
+        if channels is None:
+            writer.write(NOT_FOUND)
+            await writer.drain()
+            return
+        # подписка раньше чтения журнала, чтобы не потерять события между
+        # ними; повторы отсекаются по номеру
+        subscriber = broker.subscribe(channels, settings.SSE_QUEUE_SIZE)
+        writer.write(RESPONSE_HEADERS)
+        last_id = headers.get('last-event-id', '')
+        last_id = int(last_id) if last_id.isdigit() else None
+        if last_id is None:
+            last_id = await loop.run_in_executor(None, latest_event_id)
+        else:
+            last_id = await replay(writer, channels, last_id)
+        await send_events(subscriber, writer, last_id)
+    except (ValueError, ConnectionError, asyncio.TimeoutError):
+        pass
+    except Exception:
+        logger.exception('Ошибка соединения с сервером событий')
+    finally:
+        if subscriber is not None:
+            broker.unsubscribe(subscriber)
+        writer.close()
+
+
+async def poll(broker):
+    """Раз в SSE_POLL_INTERVAL переносит новые записи журнала в Broker."""
+    loop = asyncio.get_running_loop()
+    last_id = None
+    while True:
+        # ошибка чтения (например, база занята) не останавливает опрос:
+        # следующий проход продолжит с последнего разосланного события
+        try:
+            if last_id is None:
+                last_id = await loop.run_in_executor(None, latest_event_id)
+            else:
+                events = await loop.run_in_executor(None, load_events,
+                                                    last_id)
+                for channels, event in events:
+                    broker.publish(channels, event)
+                    last_id = event[0]
+        except Exception:
+            logger.exception('Не удалось прочитать журнал изменений')
+        await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+
+
+async def serve(host, port):
+    broker = Broker()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle(reader, writer, broker), host, port
+    )
+    poller = asyncio.ensure_future(poll(broker))
+    try:
+        await server.serve_forever()
+    finally:
+        poller.cancel()
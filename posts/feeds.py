@@ -0,0 +1,140 @@
+from django.conf import settings
+from django.contrib.syndication.views import Feed
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import parse_http_date_safe
+
+from . import counters
+from .models import Group, Post, User
+from .shards import sharded, shards_of
+
+# длина заголовка записи в ленте, полный текст - в описании
+ITEM_TITLE_LENGTH = 60
+
+
+class PostsFeed(Feed):
+    """Общая часть RSS-лент постов: последние FEED_ITEMS записей со всех
+    шардов или с шардов из shards()."""
+
+    def shards(self, obj):
+        return None
+
+    def items(self, obj):
+        posts = self.posts(obj).select_related('author').order_by('-id')
+        return sharded(posts, ('-id',),
+                       self.shards(obj))[:settings.FEED_ITEMS]
+
+    def item_title(self, item):
+        return item.text[:ITEM_TITLE_LENGTH]
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('post', args=[item.author.username, item.id])
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+
+class GroupPostsFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def posts(self, obj):
+        return Post.objects.filter(group=obj)
+
+    def title(self, obj):
+        return f'Записи сообщества {obj.title}'
+
+    def link(self, obj):
+        return reverse('group_posts', args=[obj.slug])
+
+    def description(self, obj):
+        return obj.description
+
+
+class ProfilePostsFeed(PostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def posts(self, obj):
+        return Post.objects.filter(author=obj)
+
+    def shards(self, obj):
+        return shards_of([obj.id])
+
+    def title(self, obj):
+        return f'Записи пользователя {obj.get_full_name() or obj.username}'
+
+    def link(self, obj):
+        return reverse('profile', args=[obj.username])
+
+    def description(self, obj):
+        return self.title(obj)
+
+
+class GroupPostsAtomFeed(GroupPostsFeed):
+    feed_type = Atom1Feed
+    subtitle = GroupPostsFeed.description
+
+
+class ProfilePostsAtomFeed(ProfilePostsFeed):
+    feed_type = Atom1Feed
+    subtitle = ProfilePostsFeed.description
+
+
+def cached_feed(feed, channel):
+    """Отдаёт ленту из кэша по ревизии канала channel(**kwargs).
+
+    Ревизия меняется при любом изменении постов ленты, поэтому отрисованный
+    XML лежит в кэше, пока лента не изменится. ETag - ревизия,
+    Last-Modified - дата последней записи; совпадение If-None-Match или
+    If-Modified-Since даёт пустой 304.
+    """
+    def view(request, **kwargs):
+        name = channel(**kwargs)
+        revision = counters.feed_revision(name)
+        key = f'syndication:{type(feed).__name__}:{name}:{revision}'
+        cached = cache.get(key)
+        if cached is None:
+            response = feed(request, **kwargs)
+            cached = (response.content, response['Content-Type'],
+                      response.get('Last-Modified'))
+            cache.set(key, cached, settings.FEED_CACHE_TIMEOUT)
+        content, content_type, last_modified = cached
+        etag = quote_etag(str(revision))
+        response = get_conditional_response(
+            request, etag=etag,
+            last_modified=parse_http_date_safe(last_modified or '')
+        )
+        if response is None:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = last_modified
+        return response
+    return view
+
+
+def group_channel(slug):
+    group = get_object_or_404(Group.objects.only('id'), slug=slug)
+    return counters.group_feed(group.id)
+
+
+def profile_channel(username):
+    author = get_object_or_404(User.objects.only('id'), username=username)
+    return counters.author_feed(author.id)
+
+
+group_rss = cached_feed(GroupPostsFeed(), group_channel)
+group_atom = cached_feed(GroupPostsAtomFeed(), group_channel)
+profile_rss = cached_feed(ProfilePostsFeed(), profile_channel)
+profile_atom = cached_feed(ProfilePostsAtomFeed(), profile_channel)
@@ -0,0 +1,126 @@
+"""Идентификаторы постов и комментариев, растущие со временем.
+
+id = миллисекунды от ID_EPOCH << 12 | узел << 7 | номер в миллисекунде.
+41 бит времени хватает до 2089 года, 5 бит узла - на 32 писателя, 7 бит
+номера - на 128 id в миллисекунду на узел. Всего 53 бита: id помещается в
+BIGINT и точно читается числом в JavaScript. Порядок id совпадает с
+порядком создания, поэтому ленты листаются по первичному ключу без даты.
+
+У каждого процесса, который пишет в базу, свой узел: процесс берёт в
+аренду первый свободный номер - файловую блокировку в ID_LOCK_DIR, которая
+держится до его завершения. Номер из ID_NODE арендуется так же, и второй
+процесс с тем же номером не запустится. Блокировки видны только на одной
+машине: писателям на разных машинах нужны разные ID_NODE.
+"""
+import datetime as dt
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - нет на Windows
+    fcntl = None
+
+ID_EPOCH = dt.datetime(2020, 1, 1, tzinfo=dt.timezone.utc)
+NODE_BITS = 5
+SEQUENCE_BITS = 7
+TIME_SHIFT = NODE_BITS + SEQUENCE_BITS
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+_EPOCH_MS = int(ID_EPOCH.timestamp() * 1000)
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def id_at(moment):
+    """Наименьший id, выданный не раньше moment."""
+    return max(int(moment.timestamp() * 1000) - _EPOCH_MS, 0) << TIME_SHIFT
+
+
+def id_time(pk):
+    """Когда выдан id (для старых автоинкрементных id - ID_EPOCH)."""
+    return ID_EPOCH + dt.timedelta(milliseconds=pk >> TIME_SHIFT)
+
+
+class IdGenerator:
+    """Потокобезопасный генератор id одного узла.
+
+    Если часы отстали, генератор продолжает с последней миллисекунды, а
+    исчерпав номера в ней, ждёт следующую.
+    """
+
+    def __init__(self, node, clock=now_ms):
+        if not 0 <= node <= MAX_NODE:
+            raise ValueError(f'Номер узла должен быть от 0 до {MAX_NODE}')
+        self.node = node
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last_ms = 0
+        self.sequence = 0
+
+    def __call__(self):
+        with self.lock:
+            current = max(self.clock(), self.last_ms)
+            if current == self.last_ms:
+                self.sequence = (self.sequence + 1) & MAX_SEQUENCE
+                if self.sequence == 0:
+                    while current <= self.last_ms:
+                        time.sleep(0.0001)
+                        current = self.clock()
+            else:
+                self.sequence = 0
+            self.last_ms = current
+            return ((current - _EPOCH_MS) << TIME_SHIFT
+                    | self.node << SEQUENCE_BITS | self.sequence)
+
+
+def lease_node(directory, node=None):
+    """Арендует номер узла: node или первый свободный.
+
+    Возвращает (номер, открытый файл блокировки); аренда действует, пока
+    файл открыт.
+    """
+    nodes = range(MAX_NODE + 1) if node is None else [node]
+    for candidate in nodes:
+        path = os.path.join(directory, f'yatube-id-node-{candidate}.lock')
+        lock = open(path, 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            continue
+        return candidate, lock
+    if node is None:
+        raise ImproperlyConfigured(
+            f'Все {MAX_NODE + 1} номеров узлов для id заняты'
+        )
+    raise ImproperlyConfigured(
+        f'Номер узла ID_NODE={node} уже занят другим процессом'
+    )
+
+
+_generator = None
+_generator_pid = None
+_node_lock = None
+
+
+def next_id():
+    """Очередной id узла этого процесса."""
+    global _generator, _generator_pid, _node_lock
+    # после fork у дочернего процесса свой узел и свой генератор
+    if _generator is None or _generator_pid != os.getpid():
+        if fcntl is None:
+            node = settings.ID_NODE or 0
+        else:
+            node, _node_lock = lease_node(settings.ID_LOCK_DIR,
+                                          settings.ID_NODE)
+        _generator = IdGenerator(node)
+        _generator_pid = os.getpid()
+    return _generator()
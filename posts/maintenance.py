@@ -0,0 +1,180 @@
+"""Обслуживание баз SQLite в окно низкой нагрузки.
+
+manage.py sqlite_maintenance для каждой базы из SHARD_DATABASES:
+
+* быстро проверяет целостность (PRAGMA quick_check);
+* обновляет статистику планировщика (PRAGMA optimize, ANALYZE не дольше
+  SQLITE_ANALYSIS_LIMIT строк на индекс);
+* возвращает свободные страницы в файл маленькими шагами incremental_vacuum
+  по SQLITE_VACUUM_STEP_PAGES, не дольше SQLITE_VACUUM_SECONDS; каждый шаг -
+  отдельная короткая транзакция под блокировкой писателя из posts.writes;
+* переносит WAL в базу и обрезает его (wal_checkpoint(TRUNCATE)).
+
+Шаговый vacuum работает только в базе с auto_vacuum = incremental. Новые
+базы создаются такими (SQLITE_PRAGMAS), существующую переводит одно полное
+VACUUM (--enable-incremental), которое блокирует базу на всё время
+перезаписи.
+"""
+import datetime as dt
+import os
+import time
+
+from django.db import DatabaseError, connections
+
+from .writes import writer_lock
+
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def pragma(alias, statement):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'PRAGMA {statement}')
+        return cursor.fetchall()
+
+
+def pragma_value(alias, name):
+    return pragma(alias, name)[0][0]
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def stats(alias):
+    """Размеры, доля свободных страниц и сколько базы покрывает кэш."""
+    page_size = pragma_value(alias, 'page_size')
+    page_count = pragma_value(alias, 'page_count')
+    free_pages = pragma_value(alias, 'freelist_count')
+    cache_size = pragma_value(alias, 'cache_size')
+    # отрицательный cache_size - в КиБ, положительный - в страницах
+    cache_pages = (-cache_size * 1024 // page_size if cache_size < 0
+                   else cache_size)
+    mmap_size = pragma(alias, 'mmap_size')
+    path = connections[alias].settings_dict['NAME']
+    return {
+        'size': page_size * page_count,
+        'pages': page_count,
+        'free_pages': free_pages,
+        'free_ratio': free_pages / page_count if page_count else 0,
+        'auto_vacuum': AUTO_VACUUM_MODES.get(
+            pragma_value(alias, 'auto_vacuum')
+        ),
+        'wal_size': file_size(f'{path}-wal'),
+        'cache_ratio': min(cache_pages / page_count, 1) if page_count else 1,
+        'mmap_ratio': (min(mmap_size[0][0] / (page_size * page_count), 1)
+                       if mmap_size and page_count else 0),
+    }
+
+
+def table_stats(alias):
+    """Для каждой таблицы и индекса: (имя, страниц, доля пустого места,
+    доля страниц не по порядку). Пустой список, если SQLite собран без
+    dbstat."""
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT name, pageno, pgsize, unused FROM dbstat '
+                           'ORDER BY name, path')
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return []
+    tables = {}
+    previous = {}
+    for name, pageno, size, unused in rows:
+        pages, total, empty, scattered = tables.get(name, (0, 0, 0, 0))
+        if name in previous and pageno != previous[name] + 1:
+            scattered += 1
+        previous[name] = pageno
+        tables[name] = (pages + 1, total + size, empty + unused, scattered)
+    return sorted(
+        ((name, pages, empty / total if total else 0,
+          scattered / pages if pages else 0)
+         for name, (pages, total, empty, scattered) in tables.items()),
+        key=lambda row: -row[1]
+    )
+
+
+def integrity_problems(alias, full=False):
+    """Ошибки quick_check (или integrity_check) и нарушенные внешние
+    ключи; пустой список, если база в порядке."""
+    check = 'integrity_check' if full else 'quick_check'
+    problems = [row[0] for row in pragma(alias, check) if row[0] != 'ok']
+    problems += [f'внешний ключ: {row[0]} rowid={row[1]} -> {row[2]}'
+                 for row in pragma(alias, 'foreign_key_check')]
+    return problems
+
+
+def optimize(alias, analysis_limit, full=False):
+    """Обновляет статистику планировщика: ANALYZE только там, где она
+    устарела, а с full - по всем таблицам."""
+    pragma(alias, f'analysis_limit = {analysis_limit}')
+    if full:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('ANALYZE')
+    else:
+        pragma(alias, 'optimize')
+
+
+def incremental_vacuum(alias, seconds, step_pages):
+    """Освобождает страницы шагами по step_pages, пока не выйдет время.
+
+    Возвращает число освобождённых страниц или None, если база не в
+    режиме auto_vacuum = incremental.
+    """
+    if pragma_value(alias, 'auto_vacuum') != 2:
+        return None
+    freed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        before = pragma_value(alias, 'freelist_count')
+        if not before:
+            break
+        with writer_lock():
+            pragma(alias, f'incremental_vacuum({step_pages})')
+        freed += before - pragma_value(alias, 'freelist_count')
+    return freed
+
+
+def enable_incremental(alias):
+    """Переводит базу в auto_vacuum = incremental полной перезаписью."""
+    pragma(alias, 'auto_vacuum = incremental')
+    with writer_lock(), connections[alias].cursor() as cursor:
+        cursor.execute('VACUUM')
+
+
+def checkpoint(alias, mode='TRUNCATE'):
+    """wal_checkpoint: (занято ли, страниц в WAL, перенесено страниц)."""
+    return tuple(pragma(alias, f'wal_checkpoint({mode})')[0])
+
+
+def parse_window(window):
+    """('03:00', '05:00') -> (time, time)."""
+    start, end = (dt.time.fromisoformat(moment) for moment in window)
+    return start, end
+
+
+def in_window(window, moment):
+    """Попадает ли местное время moment (без часового пояса) в окно
+    (начало, конец), в том числе окно через полночь."""
+    start, end = parse_window(window)
+    current = moment.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def window_bounds(window, moment):
+    """Начало и конец ближайшего окна: текущего или следующего."""
+    start, end = parse_window(window)
+    begin = dt.datetime.combine(moment.date(), start)
+    if in_window(window, moment) and moment < begin:
+        # окно через полночь, началось вчера
+        begin -= dt.timedelta(days=1)
+    elif moment >= begin and not in_window(window, moment):
+        begin += dt.timedelta(days=1)
+    finish = dt.datetime.combine(begin.date(), end)
+    if finish <= begin:
+        finish += dt.timedelta(days=1)
+    return begin, finish
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import migrations, models
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.test import Client, override_settings
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+
+from posts import plans
+
+
+def index_migration(suggestions):
+    """Миграция posts с AddIndex для предложенных индексов."""
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaf = loader.graph.leaf_nodes('posts')[0]
+    migration = migrations.Migration(
+        f'{int(leaf[1][:4]) + 1:04d}_advised_indexes', 'posts'
+    )
+    migration.dependencies = [leaf]
+    for model, fields in suggestions:
+        index = models.Index(fields=fields)
+        index.set_name_with_model(model)
+        migration.operations.append(migrations.AddIndex(
+            model_name=model._meta.model_name, index=index
+        ))
+    return MigrationWriter(migration)
+
+
+class Command(BaseCommand):
+    help = ('Открывает все адреса posts/urls.py на образце данных во '
+            'временной базе, снимает EXPLAIN QUERY PLAN каждого SELECT и '
+            'показывает полные проходы по таблицам и временные B-деревья. '
+            'Предлагает составные индексы (--write пишет их миграцию), '
+            'с --check завершается ошибкой, если появились находки, '
+            'которых нет в эталоне QUERY_PLAN_BASELINE, или у принятой '
+            'находки не записано обоснование.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20,
+                            help='Постов у каждого автора')
+        parser.add_argument('--check', action='store_true',
+                            help='Сравнить находки с эталоном')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Записать находки как новый эталон')
+        parser.add_argument('--write', action='store_true',
+                            help='Записать миграцию с предложенными '
+                                 'индексами')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            # записи сразу в этом потоке, кэш страниц не мешает запросам
+            with override_settings(WRITE_QUEUE_ENABLED=False,
+                                   EDGE_CACHE_SECONDS=0):
+                sample = plans.seed(options['users'], options['posts'])
+                client = Client()
+                client.force_login(sample['user'])
+                found = plans.collect(client, plans.sample_urls(sample))
+                suggestions = self.suggestions(found)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        keys = {plans.finding_key(finding) for finding in found}
+        for key in sorted(keys):
+            self.stdout.write(key)
+        for model, fields in suggestions:
+            self.stdout.write(f'Индекс {model.__name__}{tuple(fields)}')
+        if options['write'] and suggestions:
+            writer = index_migration(suggestions)
+            with open(writer.path, 'w') as migration:
+                migration.write(writer.as_string())
+            self.stdout.write(f'Миграция {writer.path}: перенесите индексы '
+                              f'в Meta.indexes моделей')
+        baseline = settings.QUERY_PLAN_BASELINE
+        if options['update_baseline']:
+            plans.save_baseline(baseline, keys)
+        if options['check']:
+            expected = plans.load_baseline(baseline)
+            for key in sorted(expected.keys() - keys):
+                self.stdout.write(f'Исправлено: {key}')
+            regressions = sorted(keys - expected.keys())
+            if regressions:
+                raise CommandError('Планы запросов ухудшились:\n'
+                                   + '\n'.join(regressions))
+            unexplained = plans.unexplained(expected)
+            if unexplained:
+                raise CommandError('Нет обоснования в эталоне:\n'
+                                   + '\n'.join(unexplained))
+
+    def suggestions(self, found):
+        """Уникальные предложения индексов по находкам."""
+        result = []
+        for finding in found:
+            suggestion = plans.suggest_index(finding)
+            if suggestion is not None and suggestion not in result:
+                result.append(suggestion)
+        return result
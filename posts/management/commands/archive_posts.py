@@ -0,0 +1,103 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from posts import ids
+from posts.counters import bump_revisions, post_feeds
+from posts.models import (ArchivedComment, ArchivedPost, ChangeLog, Comment,
+                          Post)
+from posts.purge import post_keys, purge
+from posts.shards import copy_rows
+from posts.writes import atomic
+
+
+def delete_rows(alias, post_ids):
+    """Удаляет посты и комментарии к ним без сигналов: для сайта они не
+    удалены, а переехали в архив."""
+    connection = connections[alias]
+    placeholders = ', '.join(['%s'] * len(post_ids))
+    with connection.cursor() as cursor:
+        for model, column in ((Comment, 'post_id'), (Post, 'id')):
+            table = connection.ops.quote_name(model._meta.db_table)
+            cursor.execute(f'DELETE FROM {table} WHERE {column} IN '
+                           f'({placeholders})', post_ids)
+
+
+def invalidate(feeds, change_id, keys):
+    bump_revisions(feeds, change_id)
+    purge(keys)
+
+
+def archive_batch(alias, cutoff, size):
+    """Переносит в архив шарда alias до size постов старше cutoff вместе
+    с комментариями; возвращает (постов, комментариев).
+
+    Для клиентов синхронизации и SSE пост ушёл из главной, групп и
+    избранного: в той же транзакции, что и перенос, в журнал пишется
+    POST_DELETED.
+    """
+    # журнал лежит в default, посты - на шарде автора
+    with atomic(dict.fromkeys([alias, 'default'])):
+        # id растут со временем: старые посты - в начале первичного ключа
+        posts = list(Post.objects.using(alias)
+                     .filter(id__lt=ids.id_at(cutoff), pub_date__lt=cutoff)
+                     .order_by('id')[:size])
+        if not posts:
+            return 0, 0
+        post_ids = [post.id for post in posts]
+        # предки раньше ответов
+        comments = list(Comment.objects.using(alias)
+                        .filter(post_id__in=post_ids).order_by('path'))
+        copy_rows(ArchivedPost, posts, alias)
+        copy_rows(ArchivedComment, comments, alias)
+        delete_rows(alias, post_ids)
+        ChangeLog.objects.bulk_create(
+            ChangeLog(kind=ChangeLog.POST_DELETED, post_id=post.id,
+                      author_id=post.author_id, group_id=post.group_id)
+            for post in posts
+        )
+        change_id = ChangeLog.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first()
+        # посты ушли из главной и групп; страницы постов и профили те же
+        feeds, keys = [], set()
+        for post in posts:
+            feeds += post_feeds(post)
+            keys |= post_keys(post)
+        # кэш и прокси сбрасываются, только когда перенос зафиксирован
+        transaction.on_commit(lambda: invalidate(feeds, change_id, keys),
+                              using=alias)
+    return len(posts), len(comments)
+
+
+class Command(BaseCommand):
+    help = ('Переносит посты старше ARCHIVE_AFTER_DAYS дней и комментарии к '
+            'ним в архивные таблицы своего шарда. Архивные посты видны на '
+            'своих страницах и в профиле автора, но не в главной ленте и '
+            'группах; комментировать и править их нельзя.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Возраст поста, после которого он уходит '
+                                 'в архив')
+        parser.add_argument('--batch', type=int,
+                            default=settings.ARCHIVE_BATCH_SIZE,
+                            help='Сколько постов переносить одной '
+                                 'транзакцией')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - dt.timedelta(days=options['days'])
+        for alias in settings.SHARD_DATABASES:
+            posts = comments = 0
+            while True:
+                moved = archive_batch(alias, cutoff, options['batch'])
+                if not moved[0]:
+                    break
+                posts += moved[0]
+                comments += moved[1]
+            self.stdout.write(f'{alias}: постов {posts}, комментариев '
+                              f'{comments}')
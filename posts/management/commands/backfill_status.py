@@ -0,0 +1,27 @@
+import datetime as dt
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.backfill import progress
+
+
+class Command(BaseCommand):
+    help = ('Показывает прогресс пачечных заполнений (posts.backfill) на '
+            'каждом шарде: пройдено строк, последний pk и состояние.')
+
+    def handle(self, *args, **options):
+        for alias in settings.SHARD_DATABASES:
+            for state in progress(alias):
+                percent = 100 * state['done'] / (state['total'] or 1)
+                if state['finished'] is not None:
+                    status = 'готово ' + dt.datetime.fromtimestamp(
+                        state['finished']
+                    ).isoformat(' ', 'seconds')
+                else:
+                    status = 'не закончено'
+                self.stdout.write(
+                    f"{alias:<10}{state['name']:<30}{state['done']:>10}/"
+                    f"{state['total']:<10}{percent:>6.1f}%  "
+                    f"pk>{state['last_pk']}  {status}"
+                )
@@ -0,0 +1,72 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from yatube import backups
+
+
+class Command(BaseCommand):
+    help = ('Снимает копии баз из SHARD_DATABASES на ходу (online backup '
+            'API SQLite, в режиме WAL - одной читающей транзакцией), не '
+            'останавливая запись, и оставляет '
+            'BACKUP_KEEP последних снимков каждой базы. С --list '
+            'показывает снимки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append',
+                            help='База из SHARD_DATABASES, по умолчанию '
+                                 'все')
+        parser.add_argument('--output', default=settings.BACKUP_DIR,
+                            help='Каталог снимков')
+        parser.add_argument('--keep', type=int, default=settings.BACKUP_KEEP,
+                            help='Сколько снимков хранить, 0 - все')
+        parser.add_argument('--compress', action='store_true',
+                            default=settings.BACKUP_COMPRESS,
+                            help='Сжимать снимки gzip')
+        parser.add_argument('--no-compress', action='store_false',
+                            dest='compress')
+        parser.add_argument('--list', action='store_true',
+                            help='Показать снимки и выйти')
+
+    def handle(self, *args, **options):
+        aliases = options['database'] or settings.SHARD_DATABASES
+        unknown = set(aliases) - set(settings.SHARD_DATABASES)
+        if unknown:
+            raise CommandError(f'Нет баз: {", ".join(sorted(unknown))}')
+        if options['list']:
+            for snapshot in backups.snapshots(options['output']):
+                if snapshot.alias in aliases:
+                    self.stdout.write(f'{snapshot.moment.isoformat()}  '
+                                      f'{snapshot.path}')
+            return
+        for alias in aliases:
+            connection = connections[alias]
+            connection.ensure_connection()
+            start = time.monotonic()
+            try:
+                snapshot = backups.take(
+                    connection.connection, alias, options['output'],
+                    settings.BACKUP_STEP_PAGES, settings.BACKUP_STEP_PAUSE,
+                    options['compress'], self.progress(alias)
+                )
+            except ValueError as error:
+                raise CommandError(error)
+            self.stdout.write(f'{alias}: {snapshot.path} за '
+                              f'{time.monotonic() - start:.1f} с')
+            for old in backups.rotate(options['output'], alias,
+                                      options['keep']):
+                self.stdout.write(f'{alias}: удалён {old.path}')
+
+    def progress(self, alias):
+        """Печатает ход копирования не чаще чем через 10%."""
+        shown = [-1]
+
+        def report(done, total):
+            percent = 100 * done // (total or 1)
+            if percent // 10 > shown[0]:
+                shown[0] = percent // 10
+                self.stdout.write(f'{alias}: {percent}% из {total} '
+                                  f'страниц')
+        return report
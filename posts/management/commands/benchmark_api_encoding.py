@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import Comment, Post, User
+from posts.serializers import (COMMENT_FIELDS, JSON, MSGPACK, POST_FIELDS,
+                               serialize)
+
+
+def synthetic_posts(count):
+    author = User(username='benchmark_author')
+    now = timezone.now()
+    return [Post(id=i + 1, text=f'Текст поста номер {i}. ' * 5,
+                 pub_date=now, author=author) for i in range(count)]
+
+
+def synthetic_comments(count):
+    author = User(username='benchmark_reader')
+    now = timezone.now()
+    return [Comment(id=i + 1, post_id=1, parent_id=i or None, depth=i % 3,
+                    text=f'Комментарий {i}', created=now, author=author)
+            for i in range(count)]
+
+
+def measure(function, repeat):
+    """Лучшее время из repeat запусков, в миллисекундах."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает размер и скорость кодирования списков постов и '
+            'комментариев в JSON и MessagePack. Записи создаются в памяти, '
+            'база не используется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000,
+                            help='Число записей в списке')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Число повторов каждого замера')
+
+    def handle(self, *args, **options):
+        count, repeat = options['count'], options['repeat']
+        lists = [
+            ('Post', synthetic_posts(count), POST_FIELDS),
+            ('Comment', synthetic_comments(count), COMMENT_FIELDS),
+        ]
+        self.stdout.write(f"{'список':<10}{'формат':<10}{'байт':>10}"
+                          f"{'encode, мс':>14}{'decode, мс':>14}")
+        for title, objects, schema in lists:
+            names = [name for name in schema if name != 'comments_count']
+            data = {'results': [serialize(obj, schema, names)
+                                for obj in objects]}
+            for codec_name, codec in (('json', JSON), ('msgpack', MSGPACK)):
+                payload = codec.encode(data)
+                encode = measure(lambda: codec.encode(data), repeat)
+                decode = measure(lambda: codec.decode(payload), repeat)
+                self.stdout.write(f'{title:<10}{codec_name:<10}'
+                                  f'{len(payload):>10}{encode:>14.2f}'
+                                  f'{decode:>14.2f}')
@@ -0,0 +1,105 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from yatube.sqlite import pragma_statements
+
+# без PRAGMA, кроме ожидания блокировки, чтобы сравнение было честным
+DEFAULT_PRAGMAS = {'busy_timeout': 5000}
+ROWS = 10000
+
+
+def connect(path, pragmas):
+    connection = sqlite3.connect(path, timeout=5, check_same_thread=False,
+                                 isolation_level=None)
+    for statement in pragma_statements(pragmas):
+        connection.execute(statement)
+    return connection
+
+
+def prepare(path):
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, '
+                       'author_id INTEGER, text TEXT)')
+    connection.executemany(
+        'INSERT INTO post (author_id, text) VALUES (?, ?)',
+        ((i % 100, f'Текст поста номер {i}') for i in range(ROWS))
+    )
+    connection.execute('CREATE INDEX post_author ON post (author_id, id)')
+    connection.commit()
+    connection.close()
+
+
+def reader(connection, stop, counts):
+    while not stop.is_set():
+        author = random.randrange(100)
+        connection.execute('SELECT id, text FROM post WHERE author_id = ? '
+                           'ORDER BY id DESC LIMIT 10', (author,)).fetchall()
+        counts['reads'] += 1
+
+
+def writer(connection, stop, counts):
+    while not stop.is_set():
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('INSERT INTO post (author_id, text) '
+                               'VALUES (?, ?)', (random.randrange(100), 'x'))
+            connection.execute('COMMIT')
+            counts['writes'] += 1
+        except sqlite3.OperationalError:
+            counts['locked'] += 1
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+
+
+def run(pragmas, readers, writers, seconds):
+    """Операций в секунду для набора PRAGMA: (чтения, записи, блокировки)."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.sqlite3')
+        prepare(path)
+        stop = threading.Event()
+        workers = []
+        for target, count in ((reader, readers), (writer, writers)):
+            for _ in range(count):
+                counts = {'reads': 0, 'writes': 0, 'locked': 0}
+                thread = threading.Thread(
+                    target=target, args=(connect(path, pragmas), stop, counts)
+                )
+                workers.append((thread, counts))
+        for thread, _ in workers:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread, _ in workers:
+            thread.join()
+        return [sum(counts[name] for _, counts in workers) / seconds
+                for name in ('reads', 'writes', 'locked')]
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite с настройками по '
+            'умолчанию и с SQLITE_PRAGMAS при параллельных чтениях и '
+            'записях во временной базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=3)
+
+    def handle(self, *args, **options):
+        profiles = (('default', DEFAULT_PRAGMAS),
+                    ('tuned', settings.SQLITE_PRAGMAS))
+        self.stdout.write(f"{'профиль':<10}{'чтений/с':>12}"
+                          f"{'записей/с':>12}{'блокировок/с':>15}")
+        for name, pragmas in profiles:
+            reads, writes, locked = run(pragmas, options['readers'],
+                                        options['writers'],
+                                        options['seconds'])
+            self.stdout.write(f'{name:<10}{reads:>12.0f}{writes:>12.0f}'
+                              f'{locked:>15.1f}')
@@ -0,0 +1,239 @@
+import json
+import os
+from itertools import chain
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from posts.models import ArchivedPost, ChangeLog, Group, Post, User
+from posts.shards import on_shards
+
+STATE_FILE = '.export-state.json'
+PAGE_FILE = 'index.html'
+
+
+def page_path(output, url):
+    return os.path.join(output, url.strip('/'), PAGE_FILE)
+
+
+def all_pages():
+    """Адреса всех страниц групп, профилей и постов, включая архивные."""
+    for slug in Group.objects.values_list('slug', flat=True).iterator():
+        yield reverse('group_posts', args=[slug])
+    for username in User.objects.values_list('username',
+                                             flat=True).iterator():
+        yield reverse('profile', args=[username])
+    for model in (Post, ArchivedPost):
+        for posts in on_shards(model.objects.order_by('id')
+                               .values_list('id', 'author__username')):
+            for pk, username in posts.iterator():
+                yield reverse('post', args=[username, pk])
+
+
+def author_posts(authors):
+    """Пары (id поста, id автора) всех постов авторов, включая архивные."""
+    for model in (Post, ArchivedPost):
+        for posts in on_shards(model.objects.filter(author_id__in=authors)
+                               .values_list('id', 'author_id')):
+            yield from posts.iterator()
+
+
+def changed_pages(since):
+    """Адреса страниц, которые затронули изменения журнала после since.
+
+    Пост и его комментарии меняют страницу поста, профиль автора и
+    страницу группы (в карточках лент есть число комментариев), подписка -
+    профили обеих сторон, переименование пользователя - адреса его профиля
+    и всех его постов.
+    """
+    posts, authors, groups, users = set(), set(), set(), set()
+    rows = ChangeLog.objects.filter(id__gt=since).values_list(
+        'kind', 'post_id', 'author_id', 'group_id', 'user_id'
+    )
+    for kind, post_id, author_id, group_id, user_id in rows.iterator():
+        if kind in ChangeLog.POST_KINDS:
+            posts.add((post_id, author_id))
+            authors.add(author_id)
+        if kind in (ChangeLog.FOLLOW, ChangeLog.UNFOLLOW):
+            authors.update((author_id, user_id))
+        if kind == ChangeLog.USER:
+            users.add(author_id)
+        if group_id:
+            groups.add(group_id)
+    posts.update(author_posts(users))
+    usernames = dict(User.objects.filter(
+        id__in=authors | users | {author_id for _, author_id in posts}
+    ).values_list('id', 'username'))
+    for slug in Group.objects.filter(id__in=groups).values_list('slug',
+                                                                flat=True):
+        yield reverse('group_posts', args=[slug])
+    for author_id in (authors | users) & set(usernames):
+        yield reverse('profile', args=[usernames[author_id]])
+    for post_id, author_id in posts:
+        if author_id in usernames:
+            yield reverse('post', args=[usernames[author_id], post_id])
+
+
+def current_names(groups=None, users=None):
+    """Адреса групп и профилей по ключам вида group:<id> и user:<id>.
+
+    Без аргументов - все группы и пользователи, иначе только с данными id.
+    """
+    names = {}
+    for prefix, model, field, ids in (('group', Group, 'slug', groups),
+                                      ('user', User, 'username', users)):
+        rows = model.objects.all()
+        if ids is not None:
+            rows = rows.filter(id__in=ids)
+        for pk, name in rows.values_list('id', field).iterator():
+            names[f'{prefix}:{pk}'] = name
+    return names
+
+
+def renamed_objects(since):
+    """id групп и пользователей, созданных, изменённых или удалённых
+    после since."""
+    groups, users = set(), set()
+    rows = ChangeLog.objects.filter(
+        id__gt=since, kind__in=(ChangeLog.GROUP, ChangeLog.USER)
+    ).values_list('kind', 'group_id', 'author_id')
+    for kind, group_id, author_id in rows.iterator():
+        if kind == ChangeLog.GROUP:
+            groups.add(group_id)
+        else:
+            users.add(author_id)
+    return groups, users
+
+
+class Command(BaseCommand):
+    help = ('Сохраняет страницы групп, профилей и постов в том виде, в '
+            'каком их видит гость, в статические HTML-файлы для раздачи '
+            'веб-сервером. С --incremental перестраиваются только страницы, '
+            'затронутые изменениями с прошлого запуска.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.STATIC_EXPORT_ROOT,
+                            help='Каталог для страниц')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Только изменившиеся страницы')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        state_path = os.path.join(output, STATE_FILE)
+        # номер читается до отрисовки: изменения во время выгрузки попадут
+        # в следующий инкрементальный запуск
+        latest = ChangeLog.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+        state = None
+        if options['incremental'] and os.path.exists(state_path):
+            with open(state_path) as state_file:
+                state = json.load(state_file)
+        if state is None:
+            names = current_names()
+            written, failed, removed = self.export(output, all_pages())
+            removed += self.remove_stale(output, written)
+        else:
+            since = state['last_change']
+            names = state.get('names', {})
+            removed = self.remove_renamed(output, names, since)
+            # страницы, не отрисованные в прошлый раз, пробуются снова
+            pages = chain(changed_pages(since), state.get('failed', []))
+            written, failed, removed_pages = self.export(output, pages)
+            removed += removed_pages
+        os.makedirs(output, exist_ok=True)
+        with open(state_path, 'w') as state_file:
+            json.dump({'last_change': latest, 'names': names,
+                       'failed': failed}, state_file)
+        self.stdout.write(f'Записано страниц: {len(written)}, '
+                          f'удалено: {removed}')
+        if failed:
+            self.stderr.write(f'Не удалось отрисовать: {len(failed)}')
+
+    def export(self, output, pages):
+        """Отрисовывает страницы; ошибка одной страницы не прерывает
+        выгрузку, её адрес возвращается в списке неудавшихся."""
+        # адрес не из INTERNAL_IPS: панель отладки в страницы не попадает
+        client = Client(REMOTE_ADDR='192.0.2.1')
+        written, failed, removed = set(), [], 0
+        for url in pages:
+            path = page_path(output, url)
+            if path in written or url in failed:
+                continue
+            try:
+                response = client.get(url)
+                if response.streaming:
+                    content = b''.join(response.streaming_content)
+                else:
+                    content = response.content
+            except Exception as error:
+                self.stderr.write(f'{url}: ошибка {error!r}')
+                failed.append(url)
+                continue
+            if response.status_code == 404:
+                removed += self.remove_page(path)
+                continue
+            if response.status_code != 200:
+                self.stderr.write(f'{url}: ответ {response.status_code}')
+                failed.append(url)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as page:
+                page.write(content)
+            os.replace(path + '.tmp', path)
+            written.add(path)
+        return written, failed, removed
+
+    def remove_page(self, path):
+        if not os.path.exists(path):
+            return 0
+        os.remove(path)
+        try:
+            # пустые каталоги вверх до первого непустого
+            os.removedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        return 1
+
+    def remove_renamed(self, output, names, since):
+        """Удаляет страницы по прежним адресам групп и пользователей,
+        которые с прошлого запуска удалены или переименованы, и обновляет
+        names."""
+        groups, users = renamed_objects(since)
+        current = current_names(groups, users)
+        removed = 0
+        for key in [f'group:{pk}' for pk in groups]:
+            old = names.pop(key, None)
+            if old is not None and old != current.get(key):
+                removed += self.remove_page(
+                    page_path(output, reverse('group_posts', args=[old]))
+                )
+        for key in [f'user:{pk}' for pk in users]:
+            old = names.pop(key, None)
+            if old is None or old == current.get(key):
+                continue
+            # профиль и страницы постов /<username>/<id>/
+            directory = os.path.dirname(
+                page_path(output, reverse('profile', args=[old]))
+            )
+            if os.path.isdir(directory):
+                for entry in os.listdir(directory):
+                    if entry.isdigit():
+                        removed += self.remove_page(
+                            os.path.join(directory, entry, PAGE_FILE)
+                        )
+            removed += self.remove_page(os.path.join(directory, PAGE_FILE))
+        names.update(current)
+        return removed
+
+    def remove_stale(self, output, written):
+        """Удаляет страницы прошлых выгрузок, которых больше нет на сайте."""
+        removed = 0
+        for directory, _, files in os.walk(output):
+            path = os.path.join(directory, PAGE_FILE)
+            if PAGE_FILE in files and path not in written:
+                os.remove(path)
+                removed += 1
+        return removed
@@ -0,0 +1,147 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from posts.models import (ArchivedComment, ArchivedPost, AuthorShard,
+                          Comment, Post, User)
+from posts.purge import author_key, post_keys, purge
+from posts.shards import (copy_rows, ensure_references, shard_for,
+                          sharding_enabled)
+from posts.signals import log_user_changed
+
+
+# посты и комментарии к ним: рабочие и архивные
+TABLES = ((Post, Comment), (ArchivedPost, ArchivedComment))
+
+
+def delete_author_rows(alias, author_id):
+    """Удаляет посты автора и комментарии к ним без сигналов: для сайта
+    они не удалены, а переехали."""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for post_model, comment_model in TABLES:
+            posts = connection.ops.quote_name(post_model._meta.db_table)
+            comments = connection.ops.quote_name(
+                comment_model._meta.db_table
+            )
+            cursor.execute(f'DELETE FROM {comments} WHERE post_id IN '
+                           f'(SELECT id FROM {posts} WHERE author_id = %s)',
+                           [author_id])
+            cursor.execute(f'DELETE FROM {posts} WHERE author_id = %s',
+                           [author_id])
+
+
+def author_rows(alias, author):
+    """[(модель постов, посты, модель комментариев, комментарии)] автора
+    на шарде alias."""
+    rows = []
+    for post_model, comment_model in TABLES:
+        posts = list(post_model.objects.using(alias).filter(author=author))
+        # предки раньше ответов
+        comments = list(comment_model.objects.using(alias)
+                        .filter(post__author=author).order_by('path'))
+        rows.append((post_model, posts, comment_model, comments))
+    return rows
+
+
+def missing(model, objects, alias):
+    """Объекты, которых ещё нет на шарде alias."""
+    present = set(model.objects.using(alias)
+                  .filter(pk__in=[obj.pk for obj in objects])
+                  .values_list('pk', flat=True))
+    return [obj for obj in objects if obj.pk not in present]
+
+
+def leftover_sources(author, target):
+    """Шарды, кроме target, где ещё лежат посты автора: перенос прервался
+    после переключения AuthorShard."""
+    return [alias for alias in settings.SHARD_DATABASES
+            if alias != target and any(
+                post_model.objects.using(alias).filter(author=author)
+                .exists() for post_model, _ in TABLES
+            )]
+
+
+class Command(BaseCommand):
+    help = ('Переносит посты автора и комментарии к ним на другой шард и '
+            'записывает новый шард в AuthorShard. На время переноса запись '
+            'от имени автора и комментарии к его постам надо остановить. '
+            'Прерванный перенос продолжается повторным запуском: '
+            'скопированное не копируется заново, исходные строки '
+            'удаляются, только когда их копии есть на новом шарде.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('alias', help='Шард из SHARD_DATABASES')
+
+    def handle(self, *args, **options):
+        target = options['alias']
+        if not sharding_enabled():
+            raise CommandError('Шарды не настроены (DB_SHARDS)')
+        if target not in settings.SHARD_DATABASES:
+            raise CommandError(f'Нет шарда {target}')
+        author = User.objects.filter(username=options['username']).first()
+        if author is None:
+            raise CommandError(f'Нет пользователя {options["username"]}')
+        source = shard_for(author.id)
+        sources = [source] if source != target else leftover_sources(
+            author, target
+        )
+        if not sources:
+            self.stdout.write(f'{author.username} уже на шарде {target}')
+            return
+        for alias in sources:
+            rows = author_rows(alias, author)
+            self.copy(rows, target)
+            self.verify(rows, target)
+            if alias == source:
+                self.switch(author, target)
+            with transaction.atomic(using=alias):
+                delete_author_rows(alias, author.id)
+            # после удаления на сайте видны только строки target
+            purge({author_key(author.id)}.union(
+                *(post_keys(post) for row in rows for post in row[1])
+            ))
+            self.stdout.write(
+                f'{author.username}: {alias} -> {target}, постов '
+                f'{sum(len(row[1]) for row in rows)}, комментариев '
+                f'{sum(len(row[3]) for row in rows)}'
+            )
+
+    def copy(self, rows, target):
+        """Копирует на target строки, которых там ещё нет."""
+        with transaction.atomic(using=target):
+            for post_model, posts, comment_model, comments in rows:
+                posts = missing(post_model, posts, target)
+                comments = missing(comment_model, comments, target)
+                ensure_references(
+                    target,
+                    {post.author_id for post in posts}
+                    | {comment.author_id for comment in comments},
+                    {post.group_id for post in posts}
+                )
+                copy_rows(post_model, posts, target)
+                copy_rows(comment_model, comments, target)
+
+    def verify(self, rows, target):
+        """CommandError, если какой-то строки нет на target: исходные тогда
+        не удаляются."""
+        for post_model, posts, comment_model, comments in rows:
+            for model, objects in ((post_model, posts),
+                                   (comment_model, comments)):
+                lost = missing(model, objects, target)
+                if lost:
+                    raise CommandError(
+                        f'На {target} нет {len(lost)} строк '
+                        f'{model._meta.db_table}, исходные не удалены'
+                    )
+
+    def switch(self, author, target):
+        """Переключает автора на target; запись USER в журнале сдвигает
+        ревизии его лент, чтобы кэш и клиенты перечитали их с нового
+        шарда."""
+        with transaction.atomic(using='default'):
+            AuthorShard.objects.update_or_create(
+                author=author, defaults={'alias': target}
+            )
+            log_user_changed(author, 'default')
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.replicas import replicate
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу в реплики из REPLICA_DATABASES. С '
+            '--interval повторяет копирование каждые N секунд.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Копировать непрерывно с этой паузой')
+
+    def handle(self, *args, **options):
+        if not settings.REPLICA_DATABASES:
+            raise CommandError('Реплики не настроены (DB_REPLICA)')
+        source = settings.DATABASES['default']['NAME']
+        while True:
+            for alias in settings.REPLICA_DATABASES:
+                start = time.monotonic()
+                replicate(source, settings.DATABASES[alias]['NAME'])
+                self.stdout.write(f'{alias}: скопировано за '
+                                  f'{time.monotonic() - start:.2f} с')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
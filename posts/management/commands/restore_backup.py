@@ -0,0 +1,106 @@
+import datetime as dt
+import sqlite3
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from posts.models import ChangeLog
+from posts.purge import ALL_KEY, purge
+from posts.writes import writer_lock
+from yatube import backups
+
+
+class Command(BaseCommand):
+    help = ('Проверяет снимок базы и заливает его в рабочую базу на ходу. '
+            'Снимок - путь к файлу или последний снимок базы (не позже '
+            '--at). С --verify только проверяет снимок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', nargs='?',
+                            help='Файл снимка, по умолчанию последний')
+        parser.add_argument('--database', default='default',
+                            help='База, в которую восстанавливать')
+        parser.add_argument('--input', default=settings.BACKUP_DIR,
+                            help='Каталог снимков')
+        parser.add_argument('--at', type=dt.datetime.fromisoformat,
+                            help='Последний снимок не позже этого момента '
+                                 '(ISO 8601, без пояса - UTC)')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только проверить снимок')
+        parser.add_argument('--noinput', '--no-input', action='store_false',
+                            dest='interactive',
+                            help='Не спрашивать подтверждения')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        if alias not in settings.SHARD_DATABASES:
+            raise CommandError(f'Нет базы {alias}')
+        snapshot = self.find(options)
+        try:
+            problems, counts = backups.verify(snapshot)
+        except (sqlite3.DatabaseError, OSError) as error:
+            raise CommandError(f'Снимок {snapshot.path} не читается: {error}')
+        self.stdout.write(f'Снимок {snapshot.path} '
+                          f'({snapshot.moment.isoformat()})')
+        for table, count in counts.items():
+            self.stdout.write(f'  {table:<40}{count:>10}')
+        if problems:
+            raise CommandError('Снимок повреждён:\n' + '\n'.join(problems))
+        if options['verify']:
+            return
+        if options['interactive'] and input(
+                f'Содержимое базы {alias} будет заменено снимком. '
+                f'Продолжить? (yes/no): ') != 'yes':
+            raise CommandError('Восстановление отменено')
+        connection = connections[alias]
+        connection.ensure_connection()
+        latest = self.latest_change(alias)
+        # очередь записи ждёт, пока база заменяется
+        with writer_lock():
+            backups.restore(snapshot, connection.connection,
+                            settings.BACKUP_STEP_PAGES,
+                            settings.BACKUP_STEP_PAUSE)
+            self.keep_change_ids(connection, latest)
+            # версии и ревизии лент, закэшированные страницы описывают
+            # содержимое, которого в базе больше нет: новое поколение
+            # кэша прячет их от всех процессов
+            backups.write_generation(connection.connection)
+        cache.clear()
+        purge({ALL_KEY}, using=alias)
+        self.stdout.write(f'{alias}: восстановлено из {snapshot.path}')
+
+    def latest_change(self, alias):
+        if ChangeLog._meta.db_table not in connections[
+                alias].introspection.table_names():
+            return None
+        return ChangeLog.objects.using(alias).order_by('-id').values_list(
+            'id', flat=True
+        ).first()
+
+    def keep_change_ids(self, connection, latest):
+        """Номера записей журнала продолжаются после прежних: версии и
+        ревизии лент (ETag) не повторяют выданные до восстановления."""
+        if latest is None:
+            return
+        connection.connection.execute(
+            'UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?',
+            (latest, ChangeLog._meta.db_table, latest)
+        )
+        connection.connection.commit()
+
+    def find(self, options):
+        if options['snapshot']:
+            snapshot = backups.Snapshot.from_path(options['snapshot'])
+            if snapshot is None:
+                raise CommandError(f'{options["snapshot"]} - не снимок')
+            return snapshot
+        moment = options['at']
+        if moment is not None and moment.tzinfo is None:
+            moment = moment.replace(tzinfo=dt.timezone.utc)
+        snapshot = backups.snapshot_at(options['input'],
+                                       options['database'], moment)
+        if snapshot is None:
+            raise CommandError('Подходящего снимка нет')
+        return snapshot
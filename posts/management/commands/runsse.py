@@ -0,0 +1,22 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from posts.events import serve
+
+
+class Command(BaseCommand):
+    help = ('Запускает сервер живых обновлений лент (Server-Sent Events). '
+            'Ставится за тем же прокси, что и сайт, по адресу SSE_URL.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Сервер событий: http://{options['host']}:"
+                          f"{options['port']}/events/")
+        try:
+            asyncio.run(serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,117 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from posts import maintenance
+
+
+def local_now():
+    return timezone.localtime().replace(tzinfo=None)
+
+
+class Command(BaseCommand):
+    help = ('Обслуживает базы SQLite из SHARD_DATABASES в окно '
+            'SQLITE_MAINTENANCE_WINDOW: проверка целостности, статистика '
+            'планировщика, шаговый vacuum, сброс WAL и отчёт о '
+            'фрагментации и покрытии кэшем. Вне окна ничего не делает, '
+            'с --loop ждёт окна каждый день.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true',
+                            help='Не ждать окна обслуживания')
+        parser.add_argument('--loop', action='store_true',
+                            help='Обслуживать в каждое окно, не выходя')
+        parser.add_argument('--report', action='store_true',
+                            help='Только отчёт, без изменений')
+        parser.add_argument('--tables', action='store_true',
+                            help='Отчёт по таблицам и индексам (dbstat)')
+        parser.add_argument('--full', action='store_true',
+                            help='Полные integrity_check и ANALYZE')
+        parser.add_argument('--enable-incremental', action='store_true',
+                            help='Перевести базы в auto_vacuum = '
+                                 'incremental полным VACUUM')
+        parser.add_argument('--vacuum-seconds', type=float,
+                            default=settings.SQLITE_VACUUM_SECONDS)
+
+    def handle(self, *args, **options):
+        window = settings.SQLITE_MAINTENANCE_WINDOW
+        # --now и --report - один проход сразу, дальше с --loop по окнам
+        force = options['now'] or options['report']
+        while True:
+            now = local_now()
+            if not force and not maintenance.in_window(window, now):
+                if not options['loop']:
+                    self.stdout.write(f'Вне окна обслуживания '
+                                      f'{"-".join(window)}')
+                    return
+                begin = maintenance.window_bounds(window, now)[0]
+                self.stdout.write(f'Ждём окна обслуживания до {begin}')
+                time.sleep((begin - now).total_seconds())
+                continue
+            finish = None
+            if not force:
+                finish = maintenance.window_bounds(window, now)[1]
+            problems = []
+            for alias in settings.SHARD_DATABASES:
+                problems += self.maintain(alias, finish, options)
+            if problems:
+                raise CommandError('Нарушена целостность:\n'
+                                   + '\n'.join(problems))
+            if not options['loop']:
+                return
+            force = False
+            if finish is not None:
+                # следующее окно - не раньше конца текущего
+                time.sleep(max((finish - local_now()).total_seconds(), 0))
+
+    def maintain(self, alias, finish, options):
+        """Обслуживает базу alias до времени finish; возвращает ошибки
+        целостности."""
+        self.report(alias, options['tables'])
+        if options['report']:
+            return []
+        problems = [f'{alias}: {problem}' for problem in
+                    maintenance.integrity_problems(alias, options['full'])]
+        if problems:
+            # повреждённую базу не трогаем
+            return problems
+        if options['enable_incremental']:
+            maintenance.enable_incremental(alias)
+            self.stdout.write(f'{alias}: auto_vacuum = incremental')
+        maintenance.optimize(alias, settings.SQLITE_ANALYSIS_LIMIT,
+                             options['full'])
+        seconds = options['vacuum_seconds']
+        if finish is not None:
+            seconds = min(seconds, (finish - local_now()).total_seconds())
+        freed = maintenance.incremental_vacuum(
+            alias, seconds, settings.SQLITE_VACUUM_STEP_PAGES
+        )
+        if freed is None:
+            self.stdout.write(f'{alias}: шаговый vacuum недоступен, нужен '
+                              f'--enable-incremental')
+        else:
+            self.stdout.write(f'{alias}: освобождено страниц {freed}')
+        busy, wal_pages, moved = maintenance.checkpoint(alias)
+        self.stdout.write(f'{alias}: WAL {wal_pages} страниц, перенесено '
+                          f'{moved}{", база занята" if busy else ""}')
+        self.report(alias, False)
+        return []
+
+    def report(self, alias, tables):
+        stats = maintenance.stats(alias)
+        self.stdout.write(
+            f"{alias}: {stats['size'] / 2 ** 20:.1f} МиБ, страниц "
+            f"{stats['pages']}, свободных {stats['free_pages']} "
+            f"({stats['free_ratio']:.1%}), auto_vacuum "
+            f"{stats['auto_vacuum']}, WAL {stats['wal_size'] / 2 ** 20:.1f} "
+            f"МиБ, в кэше страниц {stats['cache_ratio']:.0%}, в mmap "
+            f"{stats['mmap_ratio']:.0%}"
+        )
+        if not tables:
+            return
+        for name, pages, empty, scattered in maintenance.table_stats(alias):
+            self.stdout.write(f'  {name:<45}{pages:>8} стр.  пусто '
+                              f'{empty:>5.1%}  не по порядку '
+                              f'{scattered:>5.1%}')
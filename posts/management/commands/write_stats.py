@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.writes import metrics
+
+
+class Command(BaseCommand):
+    help = ('Показывает метрики очереди записи: число пачек и записей, '
+            'повторы из-за занятой базы, суммарное и наибольшее ожидание '
+            'блокировки писателя.')
+
+    def handle(self, *args, **options):
+        stats = metrics()
+        for name, value in stats.items():
+            self.stdout.write(f'{name:<18}{value:>12}')
+        if stats['batches']:
+            self.stdout.write(f"{'writes_per_batch':<18}"
+                              f"{stats['writes'] / stats['batches']:>12.1f}")
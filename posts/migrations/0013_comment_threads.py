@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# копия posts.models.path_segment на момент миграции: миграция не должна
+# зависеть от того, как функция изменится потом
+PATH_SEGMENT_LENGTH = 13
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def path_segment(pk):
+    digits = ""
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        digits = BASE36_DIGITS[remainder] + digits
+    return digits.rjust(PATH_SEGMENT_LENGTH, "0") + "/"
+
+
+def fill_paths(apps, schema_editor):
+    # до этой миграции все комментарии были корневыми
+    Comment = apps.get_model('posts', 'Comment')
+    for pk in Comment.objects.values_list('pk', flat=True).iterator():
+        Comment.objects.filter(pk=pk).update(path=path_segment(pk))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_comment_post_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.Comment', verbose_name='Ответ на'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+    ]
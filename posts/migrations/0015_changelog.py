@@ -0,0 +1,42 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_post_pub_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Пост создан или изменён'), ('post_deleted', 'Пост удалён из ленты'), ('comments', 'Изменилось число комментариев'), ('follow', 'Подписка'), ('unfollow', 'Отписка')], max_length=12, verbose_name='Изменение')),
+                ('post_id', models.IntegerField(blank=True, null=True)),
+                ('author_id', models.IntegerField(blank=True, null=True)),
+                ('group_id', models.IntegerField(blank=True, null=True)),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Журнал изменений',
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['author_id', 'id'], name='changelog_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['group_id', 'id'], name='changelog_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['user_id', 'id'], name='changelog_user_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 00:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_changelog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changelog',
+            name='kind',
+            field=models.CharField(choices=[('post', 'Пост создан или изменён'), ('post_deleted', 'Пост удалён из ленты'), ('comments', 'Изменилось число комментариев'), ('follow', 'Подписка'), ('unfollow', 'Отписка'), ('group', 'Группа создана, изменена или удалена')], max_length=12, verbose_name='Изменение'),
+        ),
+    ]
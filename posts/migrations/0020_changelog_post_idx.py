@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['post_id', 'id'], name='changelog_post_idx'),
+        ),
+    ]
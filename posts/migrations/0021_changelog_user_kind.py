@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_changelog_post_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changelog',
+            name='kind',
+            field=models.CharField(choices=[('post', 'Пост создан или изменён'), ('post_deleted', 'Пост удалён из ленты'), ('comments', 'Изменилось число комментариев'), ('follow', 'Подписка'), ('unfollow', 'Отписка'), ('group', 'Группа создана, изменена или удалена'), ('user', 'Пользователь создан, переименован или удалён')], max_length=12, verbose_name='Изменение'),
+        ),
+    ]
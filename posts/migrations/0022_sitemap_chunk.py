@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_changelog_user_kind'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SitemapChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('section', models.CharField(max_length=20, verbose_name='Раздел')),
+                ('number', models.IntegerField(verbose_name='Номер')),
+                ('start', models.BigIntegerField(verbose_name='Первый ключ')),
+            ],
+            options={
+                'verbose_name': 'Порция карты сайта',
+                'verbose_name_plural': 'Порции карты сайта',
+                'unique_together': {('section', 'number')},
+            },
+        ),
+    ]
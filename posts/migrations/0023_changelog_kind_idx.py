@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_sitemap_chunk'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['kind', 'id'], name='changelog_kind_idx'),
+        ),
+    ]
@@ -1,8 +1,34 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Count
+from django.db.models.functions import Substr
+
+from .ids import next_id
 
 User = get_user_model()
 
+# Путь комментария - цепочка id предков в base36 фиксированной ширины,
+# 13 знаков хватает для любого 64-битного id. Разделитель "/" меньше любой
+# цифры base36, поэтому всё поддерево лежит в диапазоне [path, path[:-1]+"0")
+PATH_SEGMENT_LENGTH = 13
+PATH_SEPARATOR = "/"
+# глубже ответы прикрепляются к предку на последнем допустимом уровне
+MAX_COMMENT_DEPTH = 16
+BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def path_segment(pk):
+    digits = ""
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        digits = BASE36_DIGITS[remainder] + digits
+    return digits.rjust(PATH_SEGMENT_LENGTH, "0") + PATH_SEPARATOR
+
+
+def path_upper_bound(path):
+    """Первая строка после всех путей поддерева path."""
+    return path[:-1] + chr(ord(PATH_SEPARATOR) + 1)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200, verbose_name="Заголовок")
@@ -18,7 +44,54 @@ class Group(models.Model):
         verbose_name_plural = "Группы"
 
 
-class Post(models.Model):
+class SnowflakeModel(models.Model):
+    """Модель с id из posts.ids вместо автоинкремента базы."""
+    id = models.BigAutoField(primary_key=True)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            self.pk = next_id()
+            # объект новый: без force_insert Django сначала пробует UPDATE
+            kwargs.setdefault("force_insert", not args)
+        super().save(*args, **kwargs)
+
+
+class PostQuerySet(models.QuerySet):
+    def on_shard_of(self, author_id):
+        """Посты на шарде автора author_id (без шардов - без изменений)."""
+        from .shards import shard_for
+        alias = shard_for(author_id)
+        return self if alias is None else self.using(alias)
+
+    def for_username(self, username):
+        """Посты автора username, выбранные с его шарда."""
+        from .shards import shard_for, sharding_enabled
+        if not sharding_enabled():
+            return self.filter(author__username=username)
+        author_id = (User.objects.filter(username=username)
+                     .values_list("id", flat=True).first())
+        return self.using(shard_for(author_id)).filter(author_id=author_id)
+
+    def create(self, **kwargs):
+        # без явной базы шард выбирает роутер по автору нового поста
+        if self._db is not None:
+            return super().create(**kwargs)
+        post = self.model(**kwargs)
+        post.save(force_insert=True)
+        return post
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            if obj.pk is None:
+                obj.pk = next_id()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class Post(SnowflakeModel):
 
     text = models.TextField(
         verbose_name="Текст",
@@ -43,6 +116,11 @@ class Post(models.Model):
     # Аргумент upload_to указывает куда загружаться пользовательским файлам
     image = models.ImageField(upload_to='posts/', blank=True, null=True)
 
+    objects = PostQuerySet.as_manager()
+
+    # архивные посты (ArchivedPost) только читаются
+    archived = False
+
     def __str__(self):
         return (f"автор: {self.author.username}, группа: {self.group}, "
                 f"дата: {self.pub_date}, текст:{self.text[:15]}.")
@@ -50,10 +128,72 @@ class Post(models.Model):
     class Meta:
         verbose_name = "Пост"
         verbose_name_plural = "Посты"
-        ordering = ("-pub_date",)
+        # id растёт со временем: новые посты - с большими id
+        ordering = ("-id",)
+
+
+class CommentManager(models.Manager):
+    def roots(self):
+        return self.filter(depth=0)
+
+    def for_username(self, username):
+        """Комментарии к постам автора username с шарда этих постов."""
+        posts = Post.objects.for_username(username)
+        return self.using(posts.db).filter(post__author__username=username)
+
+    def create(self, **kwargs):
+        # без явной базы комментарий попадает на шард своего поста
+        if self._db is not None:
+            return super().create(**kwargs)
+        comment = self.model(**kwargs)
+        comment.save(force_insert=True)
+        return comment
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # родитель из той же пачки должен идти в ней раньше ответа
+        objs = list(objs)
+        for obj in objs:
+            parent = self.model.parent.field.get_cached_value(obj, None)
+            if parent is not None and obj.parent_id is None:
+                # id родителю выдан уже после присваивания obj.parent
+                obj.parent = parent
+            if not obj.path:
+                obj.place()
+        return super().bulk_create(objs, *args, **kwargs)
 
+    def subtree(self, path, max_depth=None):
+        """Комментарий с путём path и все ответы на него одним диапазоном."""
+        queryset = self.filter(path__gte=path,
+                               path__lt=path_upper_bound(path))
+        if max_depth is not None:
+            queryset = queryset.filter(depth__lte=max_depth)
+        return queryset.order_by("path")
 
-class Comment(models.Model):
+    def reply_counts(self, paths):
+        """Количество ответов в ветках с корнями paths: {путь: число}.
+
+        Ветки выбираются одним диапазоном от первого до последнего корня
+        и группируются по префиксу пути.
+        """
+        if not paths:
+            return {}
+        # число сегментов в пути корня, ответы лежат глубже него
+        level = min(path.count(PATH_SEPARATOR) for path in paths)
+        prefix_length = level * (PATH_SEGMENT_LENGTH + 1)
+        rows = (
+            self.filter(path__gte=min(paths),
+                        path__lt=path_upper_bound(max(paths)),
+                        depth__gte=level)
+            .annotate(thread=Substr("path", 1, prefix_length))
+            .order_by()
+            .values("thread")
+            .annotate(replies=Count("id"))
+        )
+        counts = {row["thread"]: row["replies"] for row in rows}
+        return {path: counts.get(path, 0) for path in paths}
+
+
+class Comment(SnowflakeModel):
     post = models.ForeignKey(
         Post, blank=False, null=False,
         on_delete=models.CASCADE,
@@ -73,6 +213,52 @@ class Comment(models.Model):
         auto_now_add=True,
         verbose_name="Дата комментария"
     )
+    parent = models.ForeignKey(
+        "self", blank=True, null=True,
+        on_delete=models.CASCADE,
+        related_name="replies",
+        verbose_name="Ответ на"
+    )
+    path = models.CharField(max_length=255, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+
+    objects = CommentManager()
+
+    class Meta:
+        # id - первичный ключ и rowid SQLite, он входит в индекс по post,
+        # поэтому курсорная пагинация по id идёт по этому индексу
+        ordering = ("id",)
+        indexes = [
+            models.Index(fields=["post", "path"],
+                         name="comment_post_path_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.path:
+            if self.pk is None:
+                kwargs.setdefault("force_insert", not args)
+            self.place()
+        super().save(*args, **kwargs)
+
+    def place(self):
+        """Проставляет новому комментарию id, глубину и путь."""
+        self._place_in_thread()
+        if self.pk is None:
+            # id нужен для пути до вставки
+            self.pk = next_id()
+        parent_path = self.parent.path if self.parent_id else ""
+        self.path = parent_path + path_segment(self.pk)
+
+    def _place_in_thread(self):
+        """Проставляет глубину, не давая ветке уйти глубже предела."""
+        if self.parent_id is None:
+            self.depth = 0
+            return
+        parent = self.parent
+        while parent.depth >= MAX_COMMENT_DEPTH - 1:
+            parent = parent.parent
+        self.parent = parent
+        self.depth = parent.depth + 1
 
 
 class Follow(models.Model):
@@ -90,3 +276,169 @@ class Follow(models.Model):
             models.UniqueConstraint(fields=['user', 'author'],
                                     name='unique_follow'),
         ]
+
+
+class ChangeLog(models.Model):
+    """Журнал изменений для синхронизации клиентов, только на дописывание.
+
+    Записи пишут сигналы из posts.signals. Связи хранятся простыми id без
+    внешних ключей: запись об удалении переживает сам пост.
+    """
+    POST = "post"
+    POST_DELETED = "post_deleted"
+    COMMENTS = "comments"
+    FOLLOW = "follow"
+    UNFOLLOW = "unfollow"
+    GROUP = "group"
+    USER = "user"
+    KINDS = (
+        (POST, "Пост создан или изменён"),
+        (POST_DELETED, "Пост удалён из ленты"),
+        (COMMENTS, "Изменилось число комментариев"),
+        (FOLLOW, "Подписка"),
+        (UNFOLLOW, "Отписка"),
+        (GROUP, "Группа создана, изменена или удалена"),
+        (USER, "Пользователь создан, переименован или удалён"),
+    )
+    POST_KINDS = (POST, POST_DELETED, COMMENTS)
+
+    kind = models.CharField(max_length=12, choices=KINDS,
+                            verbose_name="Изменение")
+    post_id = models.BigIntegerField(null=True, blank=True)
+    # автор поста, для подписок - автор, на которого подписываются, для
+    # записей о пользователях - сам пользователь
+    author_id = models.IntegerField(null=True, blank=True)
+    group_id = models.IntegerField(null=True, blank=True)
+    # подписчик, только для подписок
+    user_id = models.IntegerField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Изменение"
+        verbose_name_plural = "Журнал изменений"
+        ordering = ("id",)
+        # выборка «после токена» для ленты - диапазон по второму полю
+        indexes = [
+            models.Index(fields=["author_id", "id"],
+                         name="changelog_author_idx"),
+            models.Index(fields=["group_id", "id"],
+                         name="changelog_group_idx"),
+            models.Index(fields=["user_id", "id"],
+                         name="changelog_user_idx"),
+            # записи об одном посте: учтён ли он уже в ленте
+            models.Index(fields=["post_id", "id"],
+                         name="changelog_post_idx"),
+            # последняя запись нужных видов: ревизии лент и карты сайта
+            models.Index(fields=["kind", "id"],
+                         name="changelog_kind_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.kind} {self.post_id or self.author_id}"
+
+
+class AuthorShard(models.Model):
+    """Шард автора, перенесённого manage.py move_author.
+
+    Остальные авторы распределены по шардам по остатку от деления id.
+    """
+    author = models.OneToOneField(User, on_delete=models.CASCADE,
+                                  primary_key=True, related_name="shard")
+    alias = models.CharField(max_length=100, verbose_name="Шард")
+
+    class Meta:
+        verbose_name = "Шард автора"
+        verbose_name_plural = "Шарды авторов"
+
+    def __str__(self):
+        return f"{self.author_id}: {self.alias}"
+
+
+class SitemapChunk(models.Model):
+    """Начало порции карты сайта (posts.sitemaps).
+
+    Порция number раздела section - объекты с ключом от start до start
+    следующей порции. Границы только дописываются: новая порция
+    открывается, когда в последней набирается SITEMAP_CHUNK_SIZE
+    объектов, поэтому адрес и состав старых порций не меняются.
+    """
+    section = models.CharField(max_length=20, verbose_name="Раздел")
+    number = models.IntegerField(verbose_name="Номер")
+    start = models.BigIntegerField(verbose_name="Первый ключ")
+
+    class Meta:
+        verbose_name = "Порция карты сайта"
+        verbose_name_plural = "Порции карты сайта"
+        unique_together = ("section", "number")
+
+    def __str__(self):
+        return f"{self.section} {self.number}: {self.start}"
+
+
+class ArchivedPost(models.Model):
+    """Старый пост, перенесённый командой archive_posts из Post.
+
+    id и поля те же, что у поста; страница поста и профиль автора читают
+    архив наравне с рабочей таблицей, ленты - нет. Архивный пост нельзя
+    править и комментировать.
+    """
+    id = models.BigAutoField(primary_key=True)
+    text = models.TextField(verbose_name="Текст")
+    pub_date = models.DateTimeField(verbose_name="Дата публикации")
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name="archived_posts",
+        verbose_name="Автор"
+    )
+    group = models.ForeignKey(
+        Group, blank=True, null=True,
+        on_delete=models.SET_NULL,
+        related_name="archived_posts",
+        verbose_name="Группа"
+    )
+    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+
+    objects = PostQuerySet.as_manager()
+
+    archived = True
+
+    class Meta:
+        verbose_name = "Архивный пост"
+        verbose_name_plural = "Архив постов"
+        ordering = ("-id",)
+
+    def __str__(self):
+        return f"архив: {self.author_id}, {self.pub_date}, {self.text[:15]}"
+
+
+class ArchivedComment(models.Model):
+    """Комментарий к архивному посту, поля те же, что у Comment."""
+    id = models.BigAutoField(primary_key=True)
+    post = models.ForeignKey(
+        ArchivedPost, on_delete=models.CASCADE,
+        related_name="comments",
+    )
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE,
+        related_name="archived_comments",
+    )
+    text = models.TextField(verbose_name="Текст")
+    created = models.DateTimeField(verbose_name="Дата комментария")
+    parent = models.ForeignKey(
+        "self", blank=True, null=True,
+        on_delete=models.CASCADE,
+        related_name="replies",
+    )
+    path = models.CharField(max_length=255, editable=False, default="")
+    depth = models.PositiveSmallIntegerField(editable=False, default=0)
+
+    objects = CommentManager()
+
+    class Meta:
+        verbose_name = "Архивный комментарий"
+        verbose_name_plural = "Архив комментариев"
+        ordering = ("id",)
+        indexes = [
+            models.Index(fields=["post", "path"],
+                         name="archived_comment_path_idx"),
+        ]
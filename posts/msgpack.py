@@ -0,0 +1,165 @@
+"""Кодирование MessagePack для API без сторонних зависимостей.
+
+Поддерживаются типы, которые встречаются в ответах API: None, bool, int,
+float, str, bytes, list/tuple и dict. Формат описан на
+https://github.com/msgpack/msgpack/blob/master/spec.md
+"""
+import struct
+
+CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def array_header(length):
+    if length < 16:
+        return bytes((0x90 | length,))
+    if length < 0x10000:
+        return b'\xdc' + struct.pack('>H', length)
+    return b'\xdd' + struct.pack('>I', length)
+
+
+def map_header(length):
+    if length < 16:
+        return bytes((0x80 | length,))
+    if length < 0x10000:
+        return b'\xde' + struct.pack('>H', length)
+    return b'\xdf' + struct.pack('>I', length)
+
+
+def _pack_int(value):
+    if 0 <= value < 0x80:
+        return bytes((value,))
+    if -32 <= value < 0:
+        return struct.pack('b', value)
+    if value >= 0:
+        for code, fmt, limit in ((b'\xcc', '>B', 0xff),
+                                 (b'\xcd', '>H', 0xffff),
+                                 (b'\xce', '>I', 0xffffffff),
+                                 (b'\xcf', '>Q', 0xffffffffffffffff)):
+            if value <= limit:
+                return code + struct.pack(fmt, value)
+    else:
+        for code, fmt, limit in ((b'\xd0', '>b', 0x80),
+                                 (b'\xd1', '>h', 0x8000),
+                                 (b'\xd2', '>i', 0x80000000),
+                                 (b'\xd3', '>q', 0x8000000000000000)):
+            if -value <= limit:
+                return code + struct.pack(fmt, value)
+    raise OverflowError(f'{value} не помещается в 64 бита')
+
+
+def _pack_str(value):
+    data = value.encode('utf-8')
+    length = len(data)
+    if length < 32:
+        return bytes((0xa0 | length,)) + data
+    if length < 0x100:
+        return b'\xd9' + bytes((length,)) + data
+    if length < 0x10000:
+        return b'\xda' + struct.pack('>H', length) + data
+    return b'\xdb' + struct.pack('>I', length) + data
+
+
+def _pack_bin(value):
+    length = len(value)
+    if length < 0x100:
+        return b'\xc4' + bytes((length,)) + value
+    if length < 0x10000:
+        return b'\xc5' + struct.pack('>H', length) + value
+    return b'\xc6' + struct.pack('>I', length) + value
+
+
+def packb(value):
+    """Кодирует значение в байты MessagePack."""
+    if value is None:
+        return b'\xc0'
+    if value is True:
+        return b'\xc3'
+    if value is False:
+        return b'\xc2'
+    if isinstance(value, int):
+        return _pack_int(value)
+    if isinstance(value, float):
+        return b'\xcb' + struct.pack('>d', value)
+    if isinstance(value, str):
+        return _pack_str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return _pack_bin(bytes(value))
+    if isinstance(value, (list, tuple)):
+        return array_header(len(value)) + b''.join(map(packb, value))
+    if isinstance(value, dict):
+        return map_header(len(value)) + b''.join(
+            packb(key) + packb(item) for key, item in value.items()
+        )
+    raise TypeError(f'Тип {type(value).__name__} не поддерживается')
+
+
+_CONSTANTS = {0xc0: None, 0xc2: False, 0xc3: True}
+_NUMBERS = {0xca: ('>f', 4), 0xcb: ('>d', 8),
+            0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4),
+            0xcf: ('>Q', 8), 0xd0: ('>b', 1), 0xd1: ('>h', 2),
+            0xd2: ('>i', 4), 0xd3: ('>q', 8)}
+# коды значений, за которыми следует длина: формат длины и тип значения
+_SIZED = {0xc4: ('>B', 1, 'bin'), 0xc5: ('>H', 2, 'bin'),
+          0xc6: ('>I', 4, 'bin'), 0xd9: ('>B', 1, 'str'),
+          0xda: ('>H', 2, 'str'), 0xdb: ('>I', 4, 'str'),
+          0xdc: ('>H', 2, 'array'), 0xdd: ('>I', 4, 'array'),
+          0xde: ('>H', 2, 'map'), 0xdf: ('>I', 4, 'map')}
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError('Данные MessagePack оборваны')
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt, size):
+        return struct.unpack(fmt, self.take(size))[0]
+
+    def read(self):
+        code = self.take(1)[0]
+        if code < 0x80:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if code <= 0x8f:
+            return self.read_sized('map', code & 0x0f)
+        if code <= 0x9f:
+            return self.read_sized('array', code & 0x0f)
+        if code <= 0xbf:
+            return self.read_sized('str', code & 0x1f)
+        if code in _CONSTANTS:
+            return _CONSTANTS[code]
+        if code in _NUMBERS:
+            return self.unpack(*_NUMBERS[code])
+        if code in _SIZED:
+            fmt, size, kind = _SIZED[code]
+            return self.read_sized(kind, self.unpack(fmt, size))
+        raise ValueError(f'Неподдерживаемый код MessagePack: {code:#x}')
+
+    def read_sized(self, kind, length):
+        if kind == 'bin':
+            return bytes(self.take(length))
+        if kind == 'str':
+            return str(self.take(length), 'utf-8')
+        if kind == 'array':
+            return [self.read() for _ in range(length)]
+        result = {}
+        for _ in range(length):
+            key = self.read()
+            result[key] = self.read()
+        return result
+
+
+def unpackb(data):
+    """Декодирует одно значение MessagePack."""
+    reader = _Reader(data)
+    value = reader.read()
+    if reader.offset != len(reader.data):
+        raise ValueError('Лишние данные после значения MessagePack')
+    return value
@@ -0,0 +1,140 @@
+import base64
+import binascii
+import datetime as dt
+import json
+
+from django.db.models import IntegerField, Q, Value
+
+
+def encode_cursor(values):
+    """Упаковывает значения ключа последней записи в непрозрачную строку."""
+    raw = json.dumps([value.isoformat() if isinstance(value, dt.datetime)
+                      else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Распаковывает курсор. Для пустого или битого курсора вернёт None."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return values
+
+
+def _after(fields, values):
+    """Условие «строго после» для составного ключа сортировки.
+
+    Для ключа (a, b) это a > x OR (a = x AND b > y) - такое условие
+    SQLite разворачивает в поиск по составному индексу, а не в OFFSET.
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(fields, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+class KeysetPage:
+    """Страница курсорной пагинации: записи и курсор следующей страницы.
+
+    object_list - уже вычисленный QuerySet, повторного запроса при обходе нет.
+    """
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def cursor_for(obj, ordering):
+    """Курсор, указывающий на запись obj."""
+    return encode_cursor([getattr(obj, field.lstrip('-'))
+                          for field in ordering])
+
+
+def keyset_filter(queryset, ordering, cursor):
+    """Упорядочивает queryset и оставляет записи после курсора."""
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values))
+    return queryset
+
+
+def keyset_page(queryset, ordering, cursor, per_page):
+    """Возвращает страницу queryset после записи, на которую указывает cursor.
+
+    ordering - поля ключа сортировки, например ('-id',) или
+    ('-pub_date', '-id'); последнее поле должно быть уникальным.
+    Вместо COUNT(*) и OFFSET выбираются per_page записей после курсора,
+    а наличие следующей страницы проверяется индексным EXISTS.
+    """
+    queryset = keyset_filter(queryset, ordering, cursor)
+    object_list = queryset[:per_page]
+    items = list(object_list)
+    next_cursor = None
+    if len(items) == per_page:
+        last = [getattr(items[-1], field.lstrip('-')) for field in ordering]
+        if queryset.filter(_after(ordering, last)).exists():
+            next_cursor = encode_cursor(last)
+    return KeysetPage(object_list, next_cursor)
+
+
+class UnionFeed:
+    """Лента из нескольких таблиц одной базы для Paginator (например,
+    рабочие и архивные посты автора).
+
+    Срез [a:b] - один запрос UNION ALL по ключам с LIMIT/OFFSET в базе и
+    по запросу на таблицу за записями страницы, count() - сумма
+    счётчиков. ordering - одно уникальное поле, общее для всех таблиц.
+    """
+
+    def __init__(self, querysets, ordering):
+        self.querysets = querysets
+        self.field = ordering[0].lstrip('-')
+        self.ordering = ordering
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        keys = [queryset.order_by()
+                .annotate(source=Value(number, IntegerField()))
+                .values_list(self.field, 'source')
+                for number, queryset in enumerate(self.querysets)]
+        rows = list(keys[0].union(*keys[1:], all=True)
+                    .order_by(*self.ordering)[index])
+        found = {}
+        for number, queryset in enumerate(self.querysets):
+            wanted = [key for key, source in rows if source == number]
+            if wanted:
+                found.update(
+                    ((getattr(obj, self.field), number), obj)
+                    for obj in queryset.filter(**{
+                        f'{self.field}__in': wanted
+                    })
+                )
+        return [found[row] for row in rows]
@@ -0,0 +1,266 @@
+"""Планы запросов страниц из posts/urls.py.
+
+seed() заполняет пустую базу образцом данных, collect() открывает каждый
+адрес из posts.urls вошедшим пользователем - действия из ACTIONS
+POST-запросом, как их отправляет сайт, - и для каждого выполненного
+SELECT, UPDATE и DELETE снимает EXPLAIN QUERY PLAN. Находки - полный
+проход по таблице (SCAN) и временное B-дерево для сортировки или
+группировки (USE TEMP B-TREE). По условиям равенства и сортировке такого
+запроса suggest_index() предлагает составной индекс, если подходящего ещё
+нет. Ключи находок сверяются с эталоном QUERY_PLAN_BASELINE, где у каждой
+принятой находки записано, почему она допустима: новая находка или
+находка без обоснования - регрессия плана (manage.py advise_indexes
+--check).
+"""
+import json
+import re
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+
+from . import urls
+from .models import Comment, Follow, Group, Post, User
+from .shards import ensure_references
+
+# адреса-действия: (данные POST-запроса, открываются ли для другого
+# автора - подписка на себя ничего не пишет); отписка идёт после подписки
+# и удаляет её
+ACTIONS = {
+    'add_comment': ({'text': 'Комментарий образца'}, False),
+    'profile_follow': ({}, True),
+    'profile_unfollow': ({}, True),
+}
+# запросы, план которых снимается
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE')
+
+Finding = namedtuple('Finding', 'name url alias sql table detail')
+
+SCAN = re.compile(r'SCAN (?:TABLE )?"?(\w+)"?')
+TABLES = re.compile(r'(?:FROM|JOIN) "(\w+)"(?: (?:AS )?"?(\w+)"?)?')
+CONVERTER = re.compile(r'<(?:\w+:)?(\w+)>')
+# части запроса, после которых условия WHERE заканчиваются
+CLAUSE_END = re.compile(r' (?:GROUP BY|ORDER BY|LIMIT) ')
+# отличия строк плана между версиями SQLite и сгенерированными именами:
+# "SCAN TABLE x" в старых версиях, псевдоним таблицы, имя индекса
+PLAN_NOISE = (
+    (re.compile(r'^SCAN TABLE '), 'SCAN '),
+    (re.compile(r' AS \w+'), ''),
+    (re.compile(r'(USING (?:COVERING )?INDEX) \w+'), r'\1'),
+    (re.compile(r'\(.*\)'), ''),
+)
+
+
+def seed(users=20, posts=20, comments=4, follows=5):
+    """Образец данных: users авторов по posts постов, у каждого пятого
+    поста comments комментариев с ответами, у каждого автора follows
+    подписок. Возвращает значения для параметров адресов."""
+    groups = [Group.objects.create(title=f'Группа {number}',
+                                   slug=f'group{number}',
+                                   description='Образец')
+              for number in range(3)]
+    authors = [User.objects.create_user(username=f'sample{number}')
+               for number in range(users)]
+    for number, author in enumerate(authors):
+        queryset = Post.objects.on_shard_of(author.id)
+        ensure_references(queryset.db, [author.id],
+                          [group.id for group in groups])
+        queryset.bulk_create(
+            Post(text=f'Пост {index} автора {number}', author=author,
+                 group=groups[index % len(groups)] if index % 2 else None)
+            for index in range(posts)
+        )
+        for offset in range(1, follows + 1):
+            Follow.objects.create(user=author,
+                                  author=authors[(number + offset) % users])
+    author = authors[0]
+    post = Post.objects.on_shard_of(author.id).filter(author=author).first()
+    comment = None
+    for index, target in enumerate(Post.objects.on_shard_of(author.id)):
+        if index % 5:
+            continue
+        for number in range(comments):
+            parent = comment if number % 2 else None
+            comment = Comment.objects.create(post=target, parent=parent,
+                                             author=authors[number % users],
+                                             text=f'Комментарий {number}')
+    root = post.comments.roots().first()
+    # автор, на которого первый ещё не подписан
+    return {'user': author, 'username': author.username, 'post_id': post.id,
+            'author': authors[-1].username, 'slug': groups[1].slug,
+            'comment_id': root.id if root else 0}
+
+
+def sample_urls(sample):
+    """(имя, адрес) для каждого шаблона posts.urls со значениями sample.
+
+    Служебные адреса без имени (404/, 500/) к базе не обращаются.
+    """
+    for pattern in urls.urlpatterns:
+        if not pattern.name:
+            continue
+        values = sample
+        if ACTIONS.get(pattern.name, (None, False))[1]:
+            values = dict(sample, username=sample['author'])
+        route = str(pattern.pattern)
+        yield pattern.name, '/' + CONVERTER.sub(
+            lambda match: str(values[match.group(1)]), route
+        )
+
+
+def explain(alias, sql):
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def table_names(sql):
+    """{имя или псевдоним в запросе: таблица}."""
+    names = {}
+    for table, alias in TABLES.findall(sql):
+        names[table] = table
+        if alias and alias not in ('ON', 'WHERE'):
+            names[alias] = table
+    return names
+
+
+def findings(name, url, alias, sql, plan):
+    names = table_names(sql)
+    main_table = next(iter(names.values()), None)
+    for detail in plan:
+        scan = SCAN.match(detail)
+        if scan and scan.group(1) in names:
+            table = names[scan.group(1)]
+            yield Finding(name, url, alias, sql, table,
+                          detail.replace(scan.group(1), table, 1))
+        elif 'USE TEMP B-TREE' in detail:
+            yield Finding(name, url, alias, sql, main_table, detail)
+
+
+def finding_key(finding):
+    """Ключ находки для эталона: от данных образца, версии SQLite и имён
+    индексов он не зависит."""
+    detail = finding.detail
+    for pattern, replacement in PLAN_NOISE:
+        detail = pattern.sub(replacement, detail)
+    detail = detail.strip()
+    return f'{finding.name}: {finding.table}: {detail}'
+
+
+def open_url(client, name, url):
+    """Открывает адрес, как сайт: действия из ACTIONS - POST-запросом."""
+    if name in ACTIONS:
+        return client.post(url, ACTIONS[name][0])
+    response = client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def collect(client, urls_list):
+    """Открывает адреса клиентом и возвращает находки в их SELECT, UPDATE
+    и DELETE."""
+    result = []
+    for name, url in urls_list:
+        cache.clear()
+        contexts = {alias: CaptureQueriesContext(connections[alias])
+                    for alias in settings.SHARD_DATABASES}
+        for context in contexts.values():
+            context.__enter__()
+        try:
+            open_url(client, name, url)
+        finally:
+            for context in contexts.values():
+                context.__exit__(None, None, None)
+        for alias, context in contexts.items():
+            for query in context.captured_queries:
+                sql = query['sql']
+                if not sql.startswith(EXPLAINED):
+                    continue
+                result.extend(findings(name, url, alias, sql,
+                                       explain(alias, sql)))
+    return result
+
+
+def model_for(table):
+    for model in apps.get_app_config('posts').get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def existing_indexes(alias, table):
+    """Списки столбцов индексов таблицы, как они есть в базе."""
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [info['columns'] for info in constraints.values()
+            if info['index'] or info['unique'] or info['primary_key']]
+
+
+def index_columns(sql, table):
+    """Столбцы table из условий равенства, затем из сортировки запроса."""
+    names = [name for name, found in table_names(sql).items()
+             if found == table]
+    qualifier = '(?:{})'.format('|'.join(
+        re.escape(f'"{name}"') + '|' + re.escape(name) for name in names
+    ))
+    order = where = ''
+    if ' ORDER BY ' in sql:
+        sql, order = sql.rsplit(' ORDER BY ', 1)
+    if ' WHERE ' in sql:
+        where = CLAUSE_END.split(sql.split(' WHERE ', 1)[1])[0]
+    columns = re.findall(qualifier + r'\."(\w+)" (?:= (?!"|\w+\.")|IN \()',
+                         where)
+    columns += re.findall(qualifier + r'\."(\w+)" (?:ASC|DESC)', order)
+    return list(dict.fromkeys(columns))
+
+
+def suggest_index(finding):
+    """(модель, поля) составного индекса для находки или None.
+
+    Сначала столбцы из условий равенства, затем столбцы сортировки.
+    Первичный ключ в конце не нужен: в SQLite он и так входит в любой
+    индекс как rowid. Группировку по выражению индекс по столбцам не
+    ускорит, для неё ничего не предлагается.
+    """
+    model = model_for(finding.table)
+    if model is None or 'GROUP BY' in finding.detail:
+        return None
+    columns = index_columns(finding.sql, finding.table)
+    while columns and columns[-1] == model._meta.pk.column:
+        columns.pop()
+    if not columns or any(
+            index[:len(columns)] == columns
+            for index in existing_indexes(finding.alias, finding.table)):
+        return None
+    fields = {field.column: field.name
+              for field in model._meta.concrete_fields}
+    return model, [fields[column] for column in columns]
+
+
+def load_baseline(path):
+    """{ключ принятой находки: почему она допустима}."""
+    try:
+        with open(path) as baseline:
+            return json.load(baseline)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(path, keys):
+    """Записывает ключи эталоном; обоснования оставшихся находок
+    сохраняются, у новых - пустые, их нужно вписать."""
+    reasons = load_baseline(path)
+    with open(path, 'w') as baseline:
+        json.dump({key: reasons.get(key, '') for key in sorted(keys)},
+                  baseline, ensure_ascii=False, indent=2)
+        baseline.write('\n')
+
+
+def unexplained(baseline):
+    """Принятые находки без обоснования."""
+    return sorted(key for key, reason in baseline.items() if not reason)
@@ -0,0 +1,127 @@
+"""Заголовки для кэширующего прокси и точечный сброс его кэша.
+
+Вьюхи помечают ответ ключами (Surrogate-Key): пост, автор, группа, общая
+лента. EdgeCacheMiddleware разрешает прокси кэшировать такие ответы для
+гостей, а сигналы моделей после фиксации транзакции передают ключи
+изменившихся страниц бэкенду PURGE_BACKEND.
+"""
+import logging
+from collections import deque
+from functools import lru_cache
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = 'index'
+# общий ключ всех помеченных ответов: сбросить кэш прокси целиком
+ALL_KEY = 'all'
+
+
+def post_key(pk):
+    return f'post-{pk}'
+
+
+def author_key(pk):
+    return f'author-{pk}'
+
+
+def group_key(pk):
+    return f'group-{pk}'
+
+
+def post_keys(post, *group_ids):
+    """Ключи страниц, на которых виден пост: его страница и ленты."""
+    keys = {post_key(post.pk), author_key(post.author_id), INDEX_KEY}
+    keys.update(group_key(pk) for pk in (post.group_id,) + group_ids if pk)
+    return keys
+
+
+def tag(response, *keys):
+    """Помечает ответ ключами для прокси."""
+    response.surrogate_keys = keys
+    return response
+
+
+class EdgeCacheMiddleware:
+    """Заголовки кэширования для ответов, помеченных tag().
+
+    Прокси кэширует их на EDGE_CACHE_SECONDS, только если это GET гостя
+    без новых cookie (например, CSRF), браузер каждый раз переспрашивает.
+    Остальным помеченным ответам кэширование запрещено. Стоит первой в
+    MIDDLEWARE, чтобы видеть ответ целиком. Кроме ключей ответа в
+    Surrogate-Key всегда есть ALL_KEY.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        keys = getattr(response, 'surrogate_keys', None)
+        if keys is None:
+            return response
+        user = getattr(request, 'user', None)
+        if (request.method in ('GET', 'HEAD')
+                and response.status_code == 200
+                and not (user and user.is_authenticated)
+                and not response.cookies):
+            patch_cache_control(response, public=True, max_age=0)
+            response['Surrogate-Control'] = (
+                f'max-age={settings.EDGE_CACHE_SECONDS}'
+            )
+            keys = sorted({ALL_KEY, *keys})
+            response['Surrogate-Key'] = ' '.join(keys)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class DummyPurgeBackend:
+    """Без прокси: сбрасывать нечего."""
+
+    def purge(self, keys):
+        pass
+
+
+class LocalPurgeBackend:
+    """Для тестов: запоминает последние сбросы в purged."""
+
+    def __init__(self, history=100):
+        self.purged = deque(maxlen=history)
+
+    def purge(self, keys):
+        self.purged.append(sorted(keys))
+
+
+class HttpPurgeBackend:
+    """Запрос PURGE к прокси с ключами в заголовке Surrogate-Key
+    (Varnish с xkey, Fastly и т.п.)."""
+
+    def purge(self, keys):
+        request = Request(settings.PURGE_URL, method='PURGE',
+                          headers={'Surrogate-Key': ' '.join(sorted(keys))})
+        try:
+            urlopen(request, timeout=settings.PURGE_TIMEOUT).close()
+        except (URLError, OSError) as error:
+            # страницы доживут до истечения EDGE_CACHE_SECONDS
+            logger.warning('Не удалось сбросить кэш прокси: %s', error)
+
+
+@lru_cache(maxsize=None)
+def get_backend(path):
+    """Один экземпляр бэкенда на процесс."""
+    return import_string(path)()
+
+
+def purge(keys, using=None):
+    """Сбрасывает ключи после фиксации текущей транзакции базы using."""
+    keys = set(keys)
+    if keys:
+        backend = get_backend(settings.PURGE_BACKEND)
+        transaction.on_commit(lambda: backend.purge(keys), using=using)
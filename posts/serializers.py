@@ -0,0 +1,230 @@
+import json
+from collections import namedtuple
+
+from django.db.models import Count
+
+from . import msgpack
+from .pagination import cursor_for, keyset_filter
+from .shards import ShardedFeed
+
+# getter - значение поля в ответе API, columns - нужные ему столбцы для
+# only(), related - связи для select_related(), annotations - пары
+# (имя, выражение) для annotate(). Порядок полей в схеме задаёт порядок
+# ключей в ответе независимо от запроса клиента.
+ApiField = namedtuple('ApiField', 'getter columns related annotations',
+                      defaults=((),))
+
+POST_FIELDS = {
+    'id': ApiField(lambda post: post.id, ('id',), ()),
+    'text': ApiField(lambda post: post.text, ('text',), ()),
+    'pub_date': ApiField(lambda post: post.pub_date.isoformat(),
+                         ('pub_date',), ()),
+    'author': ApiField(lambda post: post.author.username,
+                       ('author__username',), ('author',)),
+    'group': ApiField(lambda post: post.group.slug if post.group else None,
+                      ('group__slug',), ('group',)),
+    'image': ApiField(lambda post: post.image.url if post.image else None,
+                      ('image',), ()),
+    'comments_count': ApiField(lambda post: post.comments_count, (), (),
+                               (('comments_count', Count('comments')),)),
+}
+
+COMMENT_FIELDS = {
+    'id': ApiField(lambda comment: comment.id, ('id',), ()),
+    'post': ApiField(lambda comment: comment.post_id, ('post',), ()),
+    'parent': ApiField(lambda comment: comment.parent_id, ('parent',), ()),
+    'depth': ApiField(lambda comment: comment.depth, ('depth',), ()),
+    'author': ApiField(lambda comment: comment.author.username,
+                       ('author__username',), ('author',)),
+    'text': ApiField(lambda comment: comment.text, ('text',), ()),
+    'created': ApiField(lambda comment: comment.created.isoformat(),
+                        ('created',), ()),
+}
+
+
+class FieldsetError(ValueError):
+    pass
+
+
+def parse_fields(schema, value):
+    """Разбирает параметр fields=a,b в список полей в порядке схемы."""
+    if not value:
+        return list(schema)
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = requested - set(schema)
+    if unknown:
+        raise FieldsetError(
+            f"Неизвестные поля: {', '.join(sorted(unknown))}"
+        )
+    return [name for name in schema if name in requested]
+
+
+def prepare_queryset(queryset, schema, names, ordering=()):
+    """Выбирает из базы только столбцы и связи запрошенных полей."""
+    columns, related, annotations = set(), set(), {}
+    for name in names:
+        columns.update(schema[name].columns)
+        related.update(schema[name].related)
+        annotations.update(schema[name].annotations)
+    columns.update(field.lstrip('-') for field in ordering)
+    return (queryset.select_related(None).select_related(*related)
+            .only(*columns).annotate(**annotations))
+
+
+def serialize(obj, schema, names):
+    return {name: schema[name].getter(obj) for name in names}
+
+
+def dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class Raw(bytes):
+    """Значение, уже закодированное в формате ответа."""
+
+
+class StreamedMap:
+    """Словарь, значения которого кодируются по мере вывода."""
+
+    def __init__(self, pairs):
+        self.pairs = pairs
+
+
+class StreamedArray:
+    """Массив известной длины из значений, кодируемых по мере вывода."""
+
+    def __init__(self, items, length):
+        self.items = items
+        self.length = length
+
+
+class PageStream:
+    """Записи страницы после курсора, сериализуемые по одной.
+
+    Записи читаются через iterator(), так что страница целиком не
+    собирается в памяти в виде моделей; лента со всех шардов (ShardedFeed)
+    сливается в список при обходе. Лишняя (limit + 1)-я запись только
+    сообщает, что есть следующая страница; её курсор доступен в
+    next_cursor после обхода.
+    """
+
+    def __init__(self, queryset, ordering, cursor, limit, schema, names,
+                 chunk_size=100):
+        self.queryset = queryset
+        self.cursor = cursor
+        self.ordering = ordering
+        self.limit = limit
+        self.schema = schema
+        self.names = names
+        self.chunk_size = chunk_size
+        self.next_cursor = None
+
+    def rows(self):
+        if isinstance(self.queryset, ShardedFeed):
+            return iter(self.queryset.keyset_rows(self.cursor,
+                                                  self.limit + 1))
+        return keyset_filter(self.queryset, self.ordering, self.cursor)[
+            :self.limit + 1
+        ].iterator(chunk_size=self.chunk_size)
+
+    def __iter__(self):
+        last = None
+        rows = self.rows()
+        try:
+            for index, obj in enumerate(rows):
+                if index == self.limit:
+                    self.next_cursor = cursor_for(last, self.ordering)
+                    return
+                yield serialize(obj, self.schema, self.names)
+                last = obj
+        finally:
+            # курсор базы закрывается и при ошибке посреди страницы
+            if hasattr(rows, 'close'):
+                rows.close()
+
+    def as_map(self):
+        """{"results": [...], "next_cursor": ...}"""
+        return StreamedMap([('results', self),
+                            ('next_cursor', lambda: self.next_cursor)])
+
+
+class JsonCodec:
+    content_type = 'application/json'
+
+    def encode(self, data):
+        return dumps(data).encode()
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def stream(self, value):
+        """Кодирует value кусками: Raw как есть, StreamedMap, StreamedArray
+        и PageStream по элементам, вызываемые объекты - в момент вывода."""
+        if isinstance(value, Raw):
+            yield bytes(value)
+        elif isinstance(value, StreamedMap):
+            yield b'{'
+            for index, (key, item) in enumerate(value.pairs):
+                yield (b',' if index else b'') + self.encode(key) + b':'
+                yield from self.stream(item)
+            yield b'}'
+        elif isinstance(value, StreamedArray):
+            yield b'['
+            for index, item in enumerate(value.items):
+                yield b',' if index else b''
+                yield from self.stream(item)
+            yield b']'
+        elif isinstance(value, PageStream):
+            yield b'['
+            for index, item in enumerate(value):
+                yield (b',' if index else b'') + self.encode(item)
+            yield b']'
+        elif callable(value):
+            yield self.encode(value())
+        else:
+            yield self.encode(value)
+
+
+class MsgpackCodec(JsonCodec):
+    """MessagePack: ключи в порядке схемы, как и в JSON.
+
+    Массив в MessagePack начинается с длины, поэтому записи страницы
+    сначала кодируются в байты и только потом выводятся одним куском.
+    """
+    content_type = msgpack.CONTENT_TYPES[0]
+
+    def encode(self, data):
+        return msgpack.packb(data)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+    def stream(self, value):
+        if isinstance(value, StreamedMap):
+            yield msgpack.map_header(len(value.pairs))
+            for key, item in value.pairs:
+                yield self.encode(key)
+                yield from self.stream(item)
+        elif isinstance(value, StreamedArray):
+            yield msgpack.array_header(value.length)
+            for item in value.items:
+                yield from self.stream(item)
+        elif isinstance(value, PageStream):
+            items = [self.encode(item) for item in value]
+            yield msgpack.array_header(len(items)) + b''.join(items)
+        else:
+            yield from super().stream(value)
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+
+
+def get_codec(request):
+    """Формат ответа по ?format= или заголовку Accept."""
+    accept = request.META.get('HTTP_ACCEPT', '')
+    if (request.GET.get('format') == 'msgpack'
+            or any(content_type in accept
+                   for content_type in msgpack.CONTENT_TYPES)):
+        return MSGPACK
+    return JSON
@@ -0,0 +1,289 @@
+"""Шардирование постов и комментариев по автору.
+
+Базы из SHARD_DATABASES - шарды; первый из них default, он же хранит
+всё, кроме постов и комментариев. Посты автора лежат на шарде
+SHARD_DATABASES[author_id % число шардов], если автор не перенесён
+командой move_author (тогда шард записан в AuthorShard). Комментарии
+лежат на шарде своего поста. Пользователи и группы - справочные таблицы:
+на шард копируются те строки, на которые ссылаются его посты и
+комментарии, и дальше обновляются вместе с оригиналом.
+
+Ленты из постов разных авторов (главная, группа, подписки) читаются со
+всех шардов параллельно и сливаются по ключу сортировки. id постов и
+комментариев выдаёт приложение (posts.ids), они не пересекаются между
+шардами и не меняются при переносе автора.
+"""
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import (ArchivedComment, ArchivedPost, AuthorShard, Comment,
+                     Group, Post, User)
+from .pagination import KeysetPage, encode_cursor, keyset_filter
+
+SHARDED_MODELS = (Post, Comment, ArchivedPost, ArchivedComment)
+# поля справочных таблиц, которые на шарды не копируются
+PRIVATE_FIELDS = {User: {'password'}}
+
+_executor = None
+
+
+def sharding_enabled():
+    return len(settings.SHARD_DATABASES) > 1
+
+
+def shard_for(author_id):
+    """Шард автора; None, если шардирование выключено."""
+    if not sharding_enabled():
+        return None
+    moved = (AuthorShard.objects.using('default')
+             .filter(author_id=author_id)
+             .values_list('alias', flat=True).first())
+    if moved in settings.SHARD_DATABASES:
+        return moved
+    return settings.SHARD_DATABASES[author_id % len(settings.SHARD_DATABASES)]
+
+
+def shards_of(author_ids):
+    """Шарды, на которых лежат посты авторов author_ids."""
+    author_ids = set(author_ids)
+    moved = dict(AuthorShard.objects.using('default')
+                 .filter(author_id__in=author_ids)
+                 .values_list('author_id', 'alias'))
+    count = len(settings.SHARD_DATABASES)
+    return {moved.get(pk) or settings.SHARD_DATABASES[pk % count]
+            for pk in author_ids}
+
+
+class ShardRouter:
+    """Записи постов и комментариев - на шард автора поста, чтения - на
+    шард объекта, через который к ним обращаются."""
+
+    def db_for_read(self, model, **hints):
+        if not sharding_enabled() or model not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, SHARDED_MODELS):
+            return instance._state.db
+        if isinstance(instance, User):
+            # author.posts, author.comments
+            return shard_for(instance.pk)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if not sharding_enabled() or model not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if not isinstance(instance, SHARDED_MODELS):
+            return None
+        # у нового объекта _state.db проставляет присваивание связи
+        # (post.author = user), а не шард
+        if not instance._state.adding:
+            return instance._state.db
+        if isinstance(instance, Post):
+            return shard_for(instance.author_id)
+        if Comment.post.is_cached(instance):
+            return instance.post._state.db
+        return instance._state.db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if sharding_enabled():
+            return True
+        return None
+
+
+def executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.SHARD_WORKERS,
+            thread_name_prefix='shards'
+        )
+    return _executor
+
+
+def fan_out(function, querysets):
+    """function(queryset) для каждого шарда параллельно.
+
+    Внутри открытой транзакции (тесты, ATOMIC_REQUESTS) запросы идут
+    последовательно: другим потокам её данные не видны.
+    """
+    if len(querysets) < 2 or any(connections[queryset.db].in_atomic_block
+                                 for queryset in querysets):
+        return [function(queryset) for queryset in querysets]
+    return list(executor().map(function, querysets))
+
+
+def sort_key(ordering):
+    """Ключ сортировки объектов или словарей из values() для слияния,
+    ordering как у order_by."""
+    def key(obj):
+        if isinstance(obj, dict):
+            return tuple(obj[field.lstrip('-')] for field in ordering)
+        return tuple(getattr(obj, field.lstrip('-')) for field in ordering)
+    return key
+
+
+def merge(lists, ordering):
+    return heapq.merge(*lists, key=sort_key(ordering),
+                       reverse=ordering[0].startswith('-'))
+
+
+class ShardedFeed:
+    """Лента из нескольких шардов для Paginator.
+
+    Срез [a:b] выбирает с каждого шарда первые b записей и сливает их,
+    count() - сумма счётчиков шардов. Направление сортировки у всех полей
+    ordering должно быть одно.
+    """
+
+    def __init__(self, querysets, ordering):
+        self.querysets = [queryset.order_by(*ordering)
+                          for queryset in querysets]
+        self.ordering = ordering
+
+    def count(self):
+        return sum(fan_out(lambda queryset: queryset.count(),
+                           self.querysets))
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        stop = index.stop
+        lists = fan_out(lambda queryset: list(queryset[:stop]),
+                        self.querysets)
+        return list(merge(lists, self.ordering))[index.start:stop]
+
+    def __iter__(self):
+        """Все записи со всех шардов в порядке ordering."""
+        return merge(fan_out(list, self.querysets), self.ordering)
+
+    def keyset_rows(self, cursor, limit):
+        """Первые limit записей после курсора."""
+        lists = fan_out(
+            lambda queryset: list(keyset_filter(queryset, self.ordering,
+                                                cursor)[:limit]),
+            self.querysets
+        )
+        return list(merge(lists, self.ordering))[:limit]
+
+    def keyset_page(self, cursor, per_page):
+        """Страница после курсора, как pagination.keyset_page."""
+        items = self.keyset_rows(cursor, per_page + 1)
+        next_cursor = None
+        if len(items) > per_page:
+            items = items[:per_page]
+            next_cursor = encode_cursor(sort_key(self.ordering)(items[-1]))
+        return KeysetPage(items, next_cursor)
+
+
+def on_shards(queryset, aliases=None):
+    """queryset на каждом шарде (или на aliases) для выборок, которые
+    собираются по шардам без общего порядка. Без шардирования и для
+    справочных таблиц - [queryset].
+    """
+    if not sharding_enabled() or queryset.model not in SHARDED_MODELS:
+        return [queryset]
+    aliases = settings.SHARD_DATABASES if aliases is None else aliases
+    return [queryset.using(alias) for alias in sorted(aliases)]
+
+
+def sharded(queryset, ordering, aliases=None):
+    """Лента queryset со всех шардов (или с aliases).
+
+    Без шардирования возвращает queryset как есть.
+    """
+    if not sharding_enabled():
+        return queryset
+    return ShardedFeed(on_shards(queryset, aliases), ordering)
+
+
+def find_on_shards(queryset, **lookup):
+    """Объект по lookup с того шарда, где он есть, или None.
+
+    Нужен, когда известен только id поста: шард по нему не вычислить.
+    """
+    found = fan_out(lambda queryset: queryset.filter(**lookup).first(),
+                    on_shards(queryset))
+    return next((obj for obj in found if obj is not None), None)
+
+
+def copy_rows(model, objects, alias):
+    """Вставляет объекты в шард alias как есть, с теми же id и датами.
+
+    save() и bulk_create() перезаписали бы поля auto_now_add. Поля из
+    PRIVATE_FIELDS копируются пустыми.
+    """
+    objects = list(objects)
+    if not objects:
+        return
+    connection = connections[alias]
+    fields = model._meta.concrete_fields
+    columns = ', '.join(connection.ops.quote_name(field.column)
+                        for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    private = PRIVATE_FIELDS.get(model, ())
+    rows = [[field.get_db_prep_save(
+        '' if field.name in private else getattr(obj, field.attname),
+        connection
+    ) for field in fields] for obj in objects]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} '
+            f'({columns}) VALUES ({placeholders})', rows
+        )
+
+
+def ensure_references(alias, user_ids=(), group_ids=()):
+    """Копирует на шард недостающих пользователей и группы."""
+    if alias == 'default':
+        return
+    for model, ids in ((User, set(user_ids)), (Group, set(group_ids))):
+        ids.discard(None)
+        present = set(model.objects.using(alias).filter(pk__in=ids)
+                      .values_list('pk', flat=True))
+        copy_rows(model, model.objects.using('default')
+                  .filter(pk__in=ids - present), alias)
+
+
+@receiver(pre_save, sender=Post)
+def post_references(sender, instance, using, raw=False, **kwargs):
+    if sharding_enabled() and not raw:
+        ensure_references(using, [instance.author_id], [instance.group_id])
+
+
+@receiver(pre_save, sender=Comment)
+def comment_references(sender, instance, using, raw=False, **kwargs):
+    if sharding_enabled() and not raw:
+        ensure_references(using, [instance.author_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def update_references(sender, instance, using, raw=False, **kwargs):
+    """Переносит изменения пользователя или группы в их копии."""
+    if not sharding_enabled() or using != 'default' or raw:
+        return
+    values = {field.attname: getattr(instance, field.attname)
+              for field in sender._meta.concrete_fields
+              if not field.primary_key
+              and field.name not in PRIVATE_FIELDS.get(sender, ())}
+    for alias in settings.SHARD_DATABASES[1:]:
+        sender.objects.using(alias).filter(pk=instance.pk).update(**values)
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Group)
+def delete_references(sender, instance, using, **kwargs):
+    """Удаляет копии: посты и комментарии на шардах удаляются каскадом."""
+    if not sharding_enabled() or using != 'default':
+        return
+    for alias in settings.SHARD_DATABASES[1:]:
+        sender.objects.using(alias).filter(pk=instance.pk).delete()
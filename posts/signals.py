@@ -0,0 +1,178 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .counters import (author_feed, bump_revisions, bump_versions,
+                       follows_feed, group_feed, post_feeds)
+from .models import ChangeLog, Comment, Follow, Group, Post, User
+from .purge import author_key, group_key, post_key, post_keys, purge
+from .sitemaps import SITEMAP_CHANNEL, chunk_channel, chunk_of, post_chunks
+
+# посты, которые сейчас удаляются вместе с комментариями
+_deleting = threading.local()
+
+
+def after_commit(using, func, *args):
+    """Меняет кэш только после фиксации транзакции: повтор пачки очередью
+    записи (posts.writes) и откат записи не оставляют в кэше версий от
+    неслучившихся изменений."""
+    transaction.on_commit(lambda: func(*args), using=using)
+
+
+@receiver(pre_save, sender=Post)
+def remember_group(sender, instance, using, **kwargs):
+    """Запоминает прежнюю группу редактируемого поста."""
+    instance._previous_group_id = None
+    # id нового поста выдан до вставки (posts.ids)
+    if not instance._state.adding:
+        instance._previous_group_id = (
+            Post.objects.using(using).filter(pk=instance.pk)
+            .values_list("group_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def log_post_saved(sender, instance, created, using, **kwargs):
+    previous = getattr(instance, "_previous_group_id", None)
+    feeds = post_feeds(instance)
+    if previous is not None and previous != instance.group_id:
+        feeds.append(group_feed(previous))
+        # пост ушёл из прежней группы: для её ленты он удалён
+        ChangeLog.objects.create(kind=ChangeLog.POST_DELETED,
+                                 post_id=instance.pk,
+                                 author_id=instance.author_id,
+                                 group_id=previous)
+    change = ChangeLog.objects.create(kind=ChangeLog.POST,
+                                      post_id=instance.pk,
+                                      author_id=instance.author_id,
+                                      group_id=instance.group_id)
+    # новый пост или пост, перенесённый в группу, поднимает версии лент
+    after_commit(using, bump_versions, post_feeds(instance), change.id)
+    after_commit(using, bump_revisions,
+                 feeds + post_chunks(instance, previous), change.id)
+    purge(post_keys(instance, previous), using)
+
+
+@receiver(pre_delete, sender=Post)
+def mark_deleting(sender, instance, **kwargs):
+    if not hasattr(_deleting, "posts"):
+        _deleting.posts = set()
+    _deleting.posts.add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def log_post_deleted(sender, instance, using, **kwargs):
+    _deleting.posts.discard(instance.pk)
+    change = ChangeLog.objects.create(kind=ChangeLog.POST_DELETED,
+                                      post_id=instance.pk,
+                                      author_id=instance.author_id,
+                                      group_id=instance.group_id)
+    after_commit(using, bump_revisions,
+                 post_feeds(instance) + post_chunks(instance), change.id)
+    purge(post_keys(instance), using)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def log_comments_changed(sender, instance, using, **kwargs):
+    # удаление поста вместе с комментариями запишется одной записью
+    if instance.post_id in getattr(_deleting, "posts", ()):
+        return
+    if kwargs.get("created") is False:
+        # правка текста: число комментариев прежнее, меняется только
+        # страница поста
+        purge([post_key(instance.post_id)], using)
+        return
+    if Comment.post.is_cached(instance):
+        post = instance.post
+    else:
+        post = Post.objects.using(using).only("author_id", "group_id").get(
+            pk=instance.post_id
+        )
+    ChangeLog.objects.create(kind=ChangeLog.COMMENTS,
+                             post_id=instance.post_id,
+                             author_id=post.author_id,
+                             group_id=post.group_id)
+    # число комментариев видно и в карточках лент
+    purge(post_keys(post), using)
+
+
+@receiver(post_save, sender=Follow)
+def log_follow(sender, instance, created, using, **kwargs):
+    if created:
+        change = ChangeLog.objects.create(kind=ChangeLog.FOLLOW,
+                                          user_id=instance.user_id,
+                                          author_id=instance.author_id)
+        after_commit(using, bump_versions, [follows_feed(instance.user_id)],
+                     change.id)
+        purge([author_key(instance.author_id), author_key(instance.user_id)],
+              using)
+
+
+@receiver(post_delete, sender=Follow)
+def log_unfollow(sender, instance, using, **kwargs):
+    change = ChangeLog.objects.create(kind=ChangeLog.UNFOLLOW,
+                                      user_id=instance.user_id,
+                                      author_id=instance.author_id)
+    after_commit(using, bump_versions, [follows_feed(instance.user_id)],
+                 change.id)
+    purge([author_key(instance.author_id), author_key(instance.user_id)],
+          using)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, using, **kwargs):
+    change = ChangeLog.objects.create(kind=ChangeLog.GROUP,
+                                      group_id=instance.pk)
+    # название и описание группы есть в её RSS и Atom
+    after_commit(using, bump_revisions,
+                 [group_feed(instance.pk), SITEMAP_CHANNEL,
+                  chunk_channel("groups", chunk_of("groups", instance.pk))],
+                 change.id)
+    purge([group_key(instance.pk)], using)
+
+
+# имя пользователя в адресах его страниц, полное имя - в его лентах
+USER_NAME_FIELDS = ("username", "first_name", "last_name")
+
+
+def log_user_changed(instance, using):
+    change = ChangeLog.objects.create(kind=ChangeLog.USER,
+                                      author_id=instance.pk)
+    after_commit(using, bump_revisions,
+                 [author_feed(instance.pk), SITEMAP_CHANNEL,
+                  chunk_channel("profiles", chunk_of("profiles",
+                                                     instance.pk))],
+                 change.id)
+
+
+@receiver(pre_save, sender=User)
+def remember_names(sender, instance, using, update_fields=None, **kwargs):
+    """Запоминает прежние имена: вход пользователя сохраняет только
+    last_login и журнал не трогает."""
+    instance._previous_names = None
+    if instance._state.adding or (
+            update_fields is not None
+            and not set(USER_NAME_FIELDS) & set(update_fields)):
+        return
+    instance._previous_names = (
+        User.objects.using(using).filter(pk=instance.pk)
+        .values_list(*USER_NAME_FIELDS).first()
+    )
+
+
+@receiver(post_save, sender=User)
+def log_user_saved(sender, instance, created, using, **kwargs):
+    previous = getattr(instance, "_previous_names", None)
+    names = tuple(getattr(instance, field) for field in USER_NAME_FIELDS)
+    if created or (previous is not None and previous != names):
+        log_user_changed(instance, using)
+
+
+@receiver(post_delete, sender=User)
+def log_user_deleted(sender, instance, using, **kwargs):
+    log_user_changed(instance, using)
@@ -0,0 +1,303 @@
+"""Карта сайта: индекс и порции не больше SITEMAP_CHUNK_SIZE адресов.
+
+Порция раздела - диапазон ключей (id поста, id пользователя, id группы)
+от начала порции до начала следующей; начала хранятся в SitemapChunk и
+только дописываются. Когда в последней порции набирается больше
+SITEMAP_CHUNK_SIZE объектов, с (SITEMAP_CHUNK_SIZE + 1)-го открывается
+новая: границы - ключи строк, а не дни или шаги id, поэтому ни старые id
+постов до posts.ids, ни загруженный день не переполняют порцию. Удаления
+порции только уменьшают, так что изменение поста по-прежнему затрагивает
+ровно одну порцию постов, одну порцию профилей и одну порцию групп -
+сигналы сдвигают только их ревизии, и заново строятся только они.
+Порция читается одним диапазоном по первичному ключу через iterator(),
+без COUNT и OFFSET.
+
+Индекс перечисляет только непустые порции и кэшируется под ревизией
+карты сайта (SITEMAP_CHANNEL): пока посты, пользователи и группы не
+менялись, запрос индекса в базу не ходит. Архивные посты (ArchivedPost)
+остаются в карте под теми же адресами.
+"""
+import heapq
+from bisect import bisect_right
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.html import escape
+
+from . import counters
+from .models import ArchivedPost, ChangeLog, Group, Post, SitemapChunk, User
+from .shards import on_shards
+
+CONTENT_TYPE = 'application/xml; charset=utf-8'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+SITEMAP_CHANNEL = 'sitemap'
+
+
+def key_range(field, start, end):
+    """Условие filter() на ключи field из [start, end), end=None - без
+    верхней границы."""
+    lookup = {f'{field}__gte': start}
+    if end is not None:
+        lookup[f'{field}__lt'] = end
+    return lookup
+
+
+def stored_starts(section):
+    return [0] + list(SitemapChunk.objects.filter(section=section,
+                                                  number__gt=0)
+                      .order_by('number').values_list('start', flat=True))
+
+
+def cached_starts(section, fresh=False):
+    """Начала порций раздела из кэша; fresh=True - перечитать из базы.
+
+    Начала только дописываются, и кэш живёт FEED_VERSION_TIMEOUT, как и
+    ревизии, поэтому сигналы находят порцию поста без запросов.
+    """
+    key = f'sitemap-starts:{section}'
+    starts = None if fresh else cache.get(key)
+    if starts is None:
+        starts = stored_starts(section)
+        cache.set(key, starts, settings.FEED_VERSION_TIMEOUT)
+    return starts
+
+
+def chunk_of(section, pk):
+    """Номер порции раздела, в которую попадает ключ pk."""
+    return bisect_right(cached_starts(section), pk) - 1
+
+
+def chunk_bounds(section, number):
+    """(начало, конец) порции; конец последней порции - None.
+
+    Http404, если такой порции нет.
+    """
+    starts = cached_starts(section)
+    if number >= len(starts):
+        starts = cached_starts(section, fresh=True)
+    if number >= len(starts):
+        raise Http404
+    return starts[number], (starts[number + 1]
+                            if number + 1 < len(starts) else None)
+
+
+def keys_from(section, start, limit):
+    """Первые limit ключей раздела от start по возрастанию со всех
+    шардов."""
+    keys = [queryset.order_by(field)
+            .values_list(field, flat=True)[:limit].iterator()
+            for model, field in SECTIONS[section][0]
+            for queryset in on_shards(model.objects.filter(
+                **{f'{field}__gte': start}
+            ))]
+    return list(islice(heapq.merge(*keys), limit))
+
+
+def chunk_starts(section):
+    """Начала порций раздела; последняя порция, набравшая больше
+    SITEMAP_CHUNK_SIZE объектов, делится.
+
+    Первая порция начинается с 0 и в SitemapChunk не хранится. Читается
+    только хвост последней порции. Если границы одновременно дописал
+    другой процесс, остаются записанные первыми.
+    """
+    starts = cached_starts(section, fresh=True)
+    found = []
+    size = settings.SITEMAP_CHUNK_SIZE
+    while True:
+        keys = keys_from(section, starts[-1], size + 1)
+        if len(keys) <= size:
+            break
+        starts.append(keys[size])
+        found.append(SitemapChunk(section=section, number=len(starts) - 1,
+                                  start=keys[size]))
+    if not found:
+        return starts
+    SitemapChunk.objects.bulk_create(found, ignore_conflicts=True)
+    return cached_starts(section, fresh=True)
+
+
+def chunk_numbers(section):
+    """Номера непустых порций раздела по возрастанию.
+
+    Профили, например, берутся из авторов постов, чтобы не перечислять
+    порции пользователей без постов. Посты ищутся на всех шардах.
+    """
+    starts = chunk_starts(section)
+    numbers = []
+    for number, start in enumerate(starts):
+        end = starts[number + 1] if number + 1 < len(starts) else None
+        if any(queryset.exists()
+               for model, field in SECTIONS[section][1]
+               for queryset in on_shards(model.objects.filter(
+                   **key_range(field, start, end)
+               ))):
+            numbers.append(number)
+    return numbers
+
+
+def chunk_channel(section, number):
+    return f'sitemap:{section}:{number}'
+
+
+def chunk_changes(section, start, end):
+    """Записи журнала, которые меняют порцию: посты её диапазона, а для
+    профилей и групп - ещё переименования."""
+    posts = (ChangeLog.POST, ChangeLog.POST_DELETED)
+    field, kinds = {
+        'posts': ('post_id', posts),
+        'profiles': ('author_id', posts + (ChangeLog.USER,)),
+        'groups': ('group_id', posts + (ChangeLog.GROUP,)),
+    }[section]
+    return Q(kind__in=kinds, **key_range(field, start, end))
+
+
+def sitemap_changes():
+    """Записи журнала, которые могут изменить индекс."""
+    return Q(kind__in=(ChangeLog.POST, ChangeLog.POST_DELETED,
+                       ChangeLog.USER, ChangeLog.GROUP))
+
+
+def post_chunks(post, previous_group_id=None):
+    """Порции карты сайта, в которые попадает пост, и сам индекс."""
+    channels = [SITEMAP_CHANNEL,
+                chunk_channel('posts', chunk_of('posts', post.pk)),
+                chunk_channel('profiles', chunk_of('profiles',
+                                                   post.author_id))]
+    for group_id in {post.group_id, previous_group_id} - {None}:
+        channels.append(chunk_channel('groups', chunk_of('groups',
+                                                         group_id)))
+    return channels
+
+
+def post_rows(start, end):
+    """(адрес, lastmod) постов порции.
+
+    lastmod - последняя запись о посте в журнале изменений (правки), а
+    если её нет - дата публикации.
+    """
+    edited = dict(
+        ChangeLog.objects.filter(kind=ChangeLog.POST,
+                                 **key_range('post_id', start, end))
+        .order_by().values_list('post_id').annotate(Max('created'))
+    )
+    posts = [queryset.order_by('id')
+             .values_list('id', 'author__username', 'pub_date').iterator()
+             for model in (Post, ArchivedPost)
+             for queryset in on_shards(model.objects.filter(
+                 **key_range('id', start, end)
+             ))]
+    for pk, username, pub_date in heapq.merge(*posts):
+        yield (reverse('post', args=[username, pk]),
+               max(pub_date, edited.get(pk, pub_date)))
+
+
+def latest_posts(field, start, end):
+    """{значение field: дата последнего поста} для значений из [start,
+    end), по горячим и архивным постам всех шардов."""
+    lastmods = {}
+    for model in (Post, ArchivedPost):
+        querysets = on_shards(model.objects.filter(
+            **key_range(field, start, end)
+        ))
+        for queryset in querysets:
+            for key, lastmod in (queryset.order_by().values_list(field)
+                                 .annotate(Max('pub_date'))):
+                lastmods[key] = max(lastmod, lastmods.get(key, lastmod))
+    return lastmods
+
+
+def profile_rows(start, end):
+    """Профили авторов порции; lastmod - их последний пост, в том числе
+    архивный."""
+    lastmods = latest_posts('author_id', start, end)
+    usernames = dict(User.objects.filter(id__in=lastmods)
+                     .values_list('id', 'username'))
+    for author_id in sorted(lastmods):
+        yield (reverse('profile', args=[usernames[author_id]]),
+               lastmods[author_id])
+
+
+def group_rows(start, end):
+    """Группы порции; lastmod - их последний пост, None - постов нет."""
+    lastmods = latest_posts('group_id', start, end)
+    groups = (Group.objects.filter(**key_range('id', start, end))
+              .order_by('id').values_list('id', 'slug'))
+    for pk, slug in groups.iterator():
+        yield reverse('group_posts', args=[slug]), lastmods.get(pk)
+
+
+# раздел: (чем ограничен размер порции, откуда её адреса, строки порции)
+SECTIONS = {
+    'posts': (((Post, 'id'), (ArchivedPost, 'id')),
+              ((Post, 'id'), (ArchivedPost, 'id')), post_rows),
+    'profiles': (((User, 'id'),),
+                 ((Post, 'author_id'), (ArchivedPost, 'author_id')),
+                 profile_rows),
+    'groups': (((Group, 'id'),), ((Group, 'id'),), group_rows),
+}
+
+
+def url_entry(tag, location, lastmod):
+    entry = f'<{tag}><loc>{escape(location)}</loc>'
+    if lastmod:
+        entry += f'<lastmod>{lastmod.isoformat()}</lastmod>'
+    return f'{entry}</{tag}>\n'
+
+
+def sitemap_index(request):
+    """Индекс: по одной ссылке на каждую непустую порцию каждого раздела,
+    из кэша, пока ревизия карты сайта прежняя."""
+    revision = counters.feed_revision(SITEMAP_CHANNEL, sitemap_changes())
+    key = f'sitemap-index:{request.get_host()}:{revision}'
+    content = cache.get(key)
+    if content is None:
+        entries = []
+        for section in SECTIONS:
+            for number in chunk_numbers(section):
+                url = reverse('sitemap_chunk', args=[section, number])
+                entries.append(url_entry(
+                    'sitemap', request.build_absolute_uri(url), None
+                ))
+        content = (f'{XML_HEADER}<sitemapindex xmlns="{XMLNS}">\n'
+                   f'{"".join(entries)}</sitemapindex>\n')
+        cache.set(key, content, settings.SITEMAP_CACHE_TIMEOUT)
+    return HttpResponse(content, content_type=CONTENT_TYPE)
+
+
+def sitemap_chunk(request, section, number):
+    """Порция раздела из кэша, а после изменений - заново и потоком.
+
+    Построенная порция кладётся в кэш под текущей ревизией, когда поток
+    дописан до конца.
+    """
+    if section not in SECTIONS:
+        raise Http404
+    start, end = chunk_bounds(section, number)
+    revision = counters.feed_revision(chunk_channel(section, number),
+                                      chunk_changes(section, start, end))
+    # последняя порция, поделившись, меняет конец
+    key = (f'sitemap-chunk:{request.get_host()}:{section}:{number}:{end}:'
+           f'{revision}')
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type=CONTENT_TYPE)
+    rows = SECTIONS[section][2](start, end)
+
+    def stream():
+        parts = [f'{XML_HEADER}<urlset xmlns="{XMLNS}">\n']
+        yield parts[0]
+        for location, lastmod in rows:
+            parts.append(url_entry('url', request.build_absolute_uri(
+                location
+            ), lastmod))
+            yield parts[-1]
+        parts.append('</urlset>\n')
+        yield parts[-1]
+        cache.set(key, ''.join(parts), settings.SITEMAP_CACHE_TIMEOUT)
+    return StreamingHttpResponse(stream(), content_type=CONTENT_TYPE)
@@ -0,0 +1,63 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+from django.shortcuts import render
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .pagination import encode_cursor
+
+# Метка в шаблоне ленты, на место которой потоком выводятся карточки постов
+STREAM_MARKER = mark_safe("<!-- stream-posts -->")
+
+
+def render_feed(request, template_name, context, post_list, per_page,
+                fragment_url=None):
+    """Отрисовывает страницу ленты целиком или потоком.
+
+    В потоковом режиме (STREAMING_FEEDS) шапка страницы уходит клиенту
+    сразу, а посты выбираются и отрисовываются порциями по
+    STREAM_CHUNK_SIZE уже после отправки первых байтов.
+    Если передан fragment_url, обычная страница получает next_fragment -
+    адрес порции постов, следующей за последним постом страницы.
+    """
+    paginator = Paginator(post_list, per_page)
+    page_number = request.GET.get('page')
+    if not settings.STREAMING_FEEDS:
+        page = paginator.get_page(page_number)
+        context['page'] = page
+        if fragment_url and page.has_next():
+            last = page.object_list[len(page) - 1]
+            # ленты упорядочены по id (views.FEED_ORDERING)
+            cursor = encode_cursor([last.id])
+            context['next_fragment'] = f'{fragment_url}?cursor={cursor}'
+        return render(request, template_name, context)
+    context['stream_marker'] = STREAM_MARKER
+    head, tail = render_to_string(
+        template_name, context, request
+    ).split(STREAM_MARKER, 1)
+    return StreamingHttpResponse(
+        _stream_feed(request, head, tail, paginator, page_number)
+    )
+
+
+def _stream_feed(request, head, tail, paginator, page_number):
+    yield head
+    page = paginator.get_page(page_number)
+    item = get_template('includes/post_item.html')
+    chunk_size = settings.STREAM_CHUNK_SIZE
+    if hasattr(page.object_list, 'iterator'):
+        posts = page.object_list.iterator(chunk_size=chunk_size)
+    else:
+        # лента с нескольких шардов уже выбрана списком
+        posts = iter(page.object_list)
+    while True:
+        chunk = list(islice(posts, chunk_size))
+        if not chunk:
+            break
+        yield ''.join(item.render({'post': post, 'user': request.user})
+                      for post in chunk)
+    yield render_to_string('includes/paginator.html', {'page': page})
+    yield tail
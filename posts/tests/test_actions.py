@@ -0,0 +1,100 @@
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Post, User
+
+AJAX = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+
+class PartialActionsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        cls.post = Post.objects.create(text='Ж' * 50, author=cls.author)
+        cls.follow_url = reverse('profile_follow',
+                                 args=[cls.author.username])
+        cls.unfollow_url = reverse('profile_unfollow',
+                                   args=[cls.author.username])
+        cls.comment_url = reverse('add_comment',
+                                  args=[cls.author.username, cls.post.id])
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_follow_returns_state(self):
+        """Подписка из JS возвращает новое состояние и счётчики"""
+        response = self.authorized_client.post(self.follow_url, **AJAX)
+        self.assertEqual(response.json(), {'following': True,
+                                           'followers': 1,
+                                           'followings': 0})
+        response = self.authorized_client.post(self.unfollow_url, **AJAX)
+        self.assertEqual(response.json(), {'following': False,
+                                           'followers': 0,
+                                           'followings': 0})
+
+    def test_follow_without_js_redirects(self):
+        """Без JS подписка по-прежнему перенаправляет в профиль"""
+        response = self.authorized_client.post(self.follow_url)
+        self.assertRedirects(response, reverse('profile',
+                                               args=[self.author.username]))
+        self.assertTrue(Follow.objects.filter(user=self.reader,
+                                              author=self.author).exists())
+
+    def test_follow_by_get_redirects(self):
+        """Старые клиенты подписываются ссылкой и попадают в профиль"""
+        response = self.authorized_client.get(self.follow_url)
+        self.assertRedirects(response, reverse('profile',
+                                               args=[self.author.username]))
+        self.assertTrue(Follow.objects.filter(user=self.reader,
+                                              author=self.author).exists())
+        self.authorized_client.get(self.unfollow_url)
+        self.assertFalse(Follow.objects.filter(user=self.reader,
+                                               author=self.author).exists())
+
+    def test_follow_checks_csrf(self):
+        """Подписка без CSRF-токена отклоняется"""
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.reader)
+        response = client.post(self.follow_url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_comment_item_carries_path(self):
+        """Карточка комментария несёт путь, по которому JS вставляет ответ
+        в ветку родителя"""
+        response = self.authorized_client.post(
+            self.comment_url, {'text': 'комментарий с путём'}, **AJAX
+        )
+        comment = Comment.objects.get(text='комментарий с путём')
+        self.assertIn(f'data-path="{comment.path}"',
+                      response.content.decode())
+
+    def test_comment_returns_fragment(self):
+        """Комментарий из JS возвращает отрисованную карточку"""
+        response = self.authorized_client.post(
+            self.comment_url, {'text': 'новый комментарий'}, **AJAX
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTemplateUsed(response, 'includes/comment_item.html')
+        self.assertIn('новый комментарий', response.content.decode())
+        self.assertTrue(Comment.objects.filter(
+            text='новый комментарий').exists())
+
+    def test_comment_json_variant(self):
+        """JSON-вариант возвращает id и разметку комментария"""
+        response = self.authorized_client.post(
+            self.comment_url, {'text': 'ещё комментарий'},
+            HTTP_ACCEPT='application/json'
+        )
+        data = response.json()
+        self.assertEqual(Comment.objects.get(pk=data['id']).text,
+                         'ещё комментарий')
+        self.assertIn('ещё комментарий', data['html'])
+
+    def test_invalid_comment_returns_errors(self):
+        """Ошибки формы из JS приходят без отрисовки страницы"""
+        response = self.authorized_client.post(self.comment_url,
+                                               {'text': ''}, **AJAX)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('text', response.json()['errors'])
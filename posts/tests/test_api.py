@@ -0,0 +1,364 @@
+import json
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from posts import msgpack
+from posts.models import Comment, Follow, Group, Post, User
+
+API_POSTS = reverse('api_posts')
+API_FOLLOW_POSTS = reverse('api_follow_posts')
+
+
+def read_json(response):
+    return json.loads(b''.join(response.streaming_content))
+
+
+class PostsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title="Тест-название",
+                                         slug='test_slug',
+                                         description="Тест-описание")
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(5):
+            Post.objects.create(text=f'пост номер {i}', group=cls.group,
+                                author=cls.author)
+        Post.objects.create(text='чужой пост', author=cls.reader)
+        cls.post = Post.objects.filter(author=cls.author).first()
+        for i in range(3):
+            Comment.objects.create(post=cls.post, author=cls.reader,
+                                   text=f'комментарий {i}')
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_feeds(self):
+        """Ленты API отдают те же посты, что и страницы сайта"""
+        urls = [
+            [API_POSTS, self.guest_client, 6],
+            [reverse('api_group_posts', args=[self.group.slug]),
+             self.guest_client, 5],
+            [reverse('api_profile_posts', args=[self.reader.username]),
+             self.guest_client, 1],
+            [API_FOLLOW_POSTS, self.authorized_client, 5],
+        ]
+        for url, client, count in urls:
+            with self.subTest(url=url):
+                response = client.get(url)
+                self.assertEqual(response['Content-Type'],
+                                 'application/json')
+                self.assertEqual(len(read_json(response)['results']), count)
+
+    def test_sparse_fieldset(self):
+        """Параметр fields оставляет только запрошенные поля в порядке схемы"""
+        response = self.guest_client.get(API_POSTS,
+                                         {'fields': 'text,id,author'})
+        post = read_json(response)['results'][0]
+        self.assertEqual(list(post), ['id', 'text', 'author'])
+
+    def test_sparse_fieldset_skips_joins(self):
+        """Без полей автора и группы таблицы связей не читаются"""
+        with self.assertNumQueries(1):
+            read_json(self.guest_client.get(API_POSTS, {'fields': 'id'}))
+
+    def test_unknown_field(self):
+        """Неизвестное поле - ошибка 400"""
+        response = self.guest_client.get(API_POSTS, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cursor_pagination(self):
+        """Курсор ведёт по ленте без повторов"""
+        ids, cursor = [], None
+        while True:
+            params = {'limit': 4, 'fields': 'id'}
+            if cursor:
+                params['cursor'] = cursor
+            data = read_json(self.guest_client.get(API_POSTS, params))
+            ids.extend(post['id'] for post in data['results'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, list(Post.objects.values_list('id',
+                                                            flat=True)))
+
+    def test_follow_feed_requires_auth(self):
+        """Избранная лента без авторизации - ошибка 401"""
+        response = self.guest_client.get(API_FOLLOW_POSTS)
+        self.assertEqual(response.status_code, 401)
+
+    def test_post_with_comments(self):
+        """Пост отдаётся вместе с первой порцией комментариев"""
+        url = reverse('api_post', args=[self.post.id])
+        data = read_json(self.guest_client.get(url, {'limit': 2}))
+        self.assertEqual(data['post']['id'], self.post.id)
+        self.assertEqual([comment['text']
+                          for comment in data['comments']['results']],
+                         ['комментарий 0', 'комментарий 1'])
+        url = reverse('api_post_comments', args=[self.post.id])
+        rest = read_json(self.guest_client.get(
+            url, {'cursor': data['comments']['next_cursor']}
+        ))
+        self.assertEqual([comment['text'] for comment in rest['results']],
+                         ['комментарий 2'])
+
+    def test_comments_count_field(self):
+        """Число комментариев приходит полем comments_count"""
+        response = self.guest_client.get(API_POSTS, {
+            'fields': 'id,comments_count', 'ids': f'{self.post.id},0'
+        })
+        self.assertEqual(read_json(response)['results'],
+                         [{'id': self.post.id, 'comments_count': 3}])
+
+    def test_profile_counters(self):
+        """Профиль в API отдаёт счётчики автора"""
+        url = reverse('api_profile', args=[self.author.username])
+        data = self.authorized_client.get(url).json()
+        self.assertEqual(data['posts'], 5)
+        self.assertEqual(data['followers'], 1)
+        self.assertTrue(data['following'])
+
+
+class NewPostsApiTests(TransactionTestCase):
+    # версии и ревизии лент меняются после фиксации транзакции
+    def setUp(self):
+        self.author = User.objects.create_user(username='test_user')
+        self.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(text='пост', author=self.author)
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_not_modified(self):
+        """Пока новых постов нет, опрос получает пустой 304"""
+        url = reverse('api_posts_new')
+        version = self.authorized_client.get(url).json()['version']
+        response = self.authorized_client.get(url, {'since': version})
+        self.assertEqual(response.status_code, 304)
+        response = self.authorized_client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_counts_new_posts(self):
+        """Ответ сообщает число постов после версии клиента"""
+        urls = [reverse('api_posts_new'), reverse('api_follow_posts_new'),
+                reverse('api_profile_posts_new', args=['test_user'])]
+        versions = [self.authorized_client.get(url).json()['version']
+                    for url in urls]
+        Post.objects.create(text='ещё пост', author=self.author)
+        Post.objects.create(text='и ещё', author=self.author)
+        for url, version in zip(urls, versions):
+            with self.subTest(url=url):
+                data = self.authorized_client.get(
+                    url, {'since': version}
+                ).json()
+                self.assertEqual(data['new'], 2)
+
+    def test_warm_cache_skips_posts(self):
+        """С прогретым кэшем опрос общей ленты не обращается к базе"""
+        url = reverse('api_posts_new')
+        self.client.get(url, {'since': 0})
+        with self.assertNumQueries(0):
+            self.client.get(url, {'since': 0})
+
+    def test_version_never_decreases(self):
+        """Удаление постов и промах кэша не уменьшают версию"""
+        url = reverse('api_posts_new')
+        Post.objects.create(text='ещё пост', author=self.author)
+        version = self.authorized_client.get(url).json()['version']
+        Post.objects.all().delete()
+        cache.clear()
+        self.assertGreaterEqual(
+            self.authorized_client.get(url).json()['version'], version
+        )
+        Post.objects.create(text='после удаления', author=self.author)
+        data = self.authorized_client.get(url, {'since': version}).json()
+        self.assertEqual(data['new'], 1)
+
+    def test_edits_are_not_new(self):
+        """Правка старого поста не считается новым постом"""
+        url = reverse('api_posts_new')
+        version = self.authorized_client.get(url).json()['version']
+        post = Post.objects.get()
+        post.text = 'исправленный пост'
+        post.save()
+        data = self.authorized_client.get(url, {'since': version}).json()
+        self.assertEqual(data['new'], 0)
+
+    def test_post_moved_into_group(self):
+        """Пост, перенесённый в группу, новый для ленты группы"""
+        group = Group.objects.create(title='Группа', slug='group',
+                                     description='описание')
+        url = reverse('api_group_posts_new', args=[group.slug])
+        version = self.authorized_client.get(url).json()['version']
+        post = Post.objects.get()
+        post.group = group
+        post.save()
+        data = self.authorized_client.get(url, {'since': version}).json()
+        self.assertEqual(data['new'], 1)
+
+    def test_follow_changes_are_not_posts(self):
+        """Подписка и отписка не дают ложных новых постов"""
+        other = User.objects.create_user(username='other')
+        Post.objects.create(text='старый пост', author=other)
+        url = reverse('api_follow_posts_new')
+        version = self.authorized_client.get(url).json()['version']
+        Follow.objects.create(user=self.reader, author=other)
+        data = self.authorized_client.get(url, {'since': version}).json()
+        self.assertEqual(data['new'], 0)
+        self.assertGreater(data['version'], version)
+        Follow.objects.filter(author=other).delete()
+        Post.objects.create(text='новый пост', author=self.author)
+        data = self.authorized_client.get(url, {'since': version}).json()
+        self.assertEqual(data['new'], 1)
+
+
+class MsgpackApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        for i in range(3):
+            Post.objects.create(text=f'пост номер {i}', author=cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_round_trip(self):
+        """Значения всех поддерживаемых типов переживают кодирование"""
+        values = [None, True, False, 0, 127, 128, -1, -33, 2 ** 40,
+                  -2 ** 40, 1.5, '', 'текст', 'x' * 300, b'\x00\xff',
+                  list(range(20)), {'b': 1, 'a': [None, {'c': 'd'}]}]
+        for value in values:
+            with self.subTest(value=value):
+                self.assertEqual(msgpack.unpackb(msgpack.packb(value)),
+                                 value)
+
+    def test_negotiation(self):
+        """По Accept: application/msgpack лента приходит в MessagePack"""
+        as_json = read_json(self.authorized_client.get(API_POSTS))
+        response = self.authorized_client.get(
+            API_POSTS, HTTP_ACCEPT='application/msgpack'
+        )
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertIn('Accept', response['Vary'])
+        body = b''.join(response.streaming_content)
+        self.assertLess(len(body), len(json.dumps(as_json).encode()))
+        data = msgpack.unpackb(body)
+        self.assertEqual(data, as_json)
+        self.assertEqual(list(data['results'][0]),
+                         list(as_json['results'][0]))
+
+    def test_msgpack_batch(self):
+        """Пакет можно отправить и получить в MessagePack"""
+        profile = reverse('api_profile', args=[self.author.username])
+        response = self.authorized_client.post(
+            reverse('api_batch'),
+            msgpack.packb({'requests': [{'id': 'me', 'url': profile},
+                                        {'id': 'feed', 'url': API_POSTS}]}),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        data = msgpack.unpackb(b''.join(response.streaming_content))
+        me, feed = data['responses']
+        self.assertEqual(me['body']['posts'], 3)
+        self.assertEqual(len(feed['body']['results']), 3)
+
+
+class BatchApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(text='пост', author=cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def batch(self, requests):
+        response = self.authorized_client.post(
+            reverse('api_batch'), json.dumps({'requests': requests}),
+            content_type='application/json'
+        )
+        return response, read_json(response) if response.streaming else None
+
+    def test_batch_without_csrf_token(self):
+        """Пакет - только чтения, клиент без CSRF-токена его получает"""
+        client = Client(enforce_csrf_checks=True)
+        response = client.post(
+            reverse('api_batch'),
+            json.dumps({'requests': [{'id': 'posts', 'url': API_POSTS}]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(read_json(response)['responses'][0]['status'], 200)
+
+    def test_batch_returns_all_results(self):
+        """Пакет возвращает ответы всех подзапросов по порядку"""
+        profile = reverse('api_profile', args=[self.author.username])
+        response, data = self.batch([
+            {'id': 'feed', 'url': API_FOLLOW_POSTS},
+            {'id': 'me', 'url': profile},
+            {'id': 'counts',
+             'url': f'{API_POSTS}?fields=id,comments_count'},
+            {'id': 'missing', 'url': '/api/v1/users/nobody/'},
+        ])
+        responses = data['responses']
+        self.assertEqual([item['id'] for item in responses],
+                         ['feed', 'me', 'counts', 'missing'])
+        self.assertEqual(responses[0]['body']['results'][0]['id'],
+                         self.post.id)
+        self.assertEqual(responses[1]['body']['followers'], 1)
+        self.assertEqual(responses[3]['status'], 404)
+
+    def test_batch_shares_lookups(self):
+        """Повторные подзапросы и поиск автора не повторяют запросы к базе"""
+        profile = reverse('api_profile', args=[self.author.username])
+        posts = reverse('api_profile_posts', args=[self.author.username])
+        single = [{'url': profile}, {'url': posts}]
+        with CaptureQueriesContext(connection) as context:
+            self.batch(single)
+        once = len(context.captured_queries)
+        with CaptureQueriesContext(connection) as context:
+            self.batch(single * 3)
+        self.assertEqual(len(context.captured_queries), once)
+
+    def test_failed_subrequest(self):
+        """Ошибка одного подзапроса - ответ 500 в пакете, остальные
+        выполняются"""
+        profile = reverse('api_profile', args=[self.author.username])
+        with mock.patch('posts.serializers.serialize',
+                        side_effect=RuntimeError('сбой')), \
+                self.assertLogs('posts.api', 'ERROR'):
+            response, data = self.batch([{'id': 'feed', 'url': API_POSTS},
+                                         {'id': 'me', 'url': profile}])
+        responses = data['responses']
+        self.assertEqual([item['status'] for item in responses], [500, 200])
+        self.assertEqual(responses[1]['body']['followers'], 1)
+
+    def test_only_api_urls(self):
+        """Подзапросы к страницам сайта и к самому пакету запрещены"""
+        response, data = self.batch([{'url': '/'},
+                                     {'url': reverse('api_batch')}])
+        self.assertEqual([item['status'] for item in data['responses']],
+                         [400, 400])
+
+    def test_bad_payload(self):
+        """Неверное тело пакета - ошибка 400"""
+        response = self.authorized_client.post(
+            reverse('api_batch'), 'не json', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,201 @@
+import datetime as dt
+import json
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.ids import id_at
+from posts.models import (ArchivedComment, ArchivedPost, Comment, Group,
+                          Post, User)
+from posts.pagination import UnionFeed
+from posts.purge import get_backend
+
+
+def read_json(response):
+    return json.loads(b''.join(response.streaming_content))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(title="Тест-название",
+                                          slug='test_slug',
+                                          description="Тест-описание")
+        self.author = User.objects.create_user(username='test_user')
+        self.reader = User.objects.create_user(username='reader')
+        published = timezone.now() - dt.timedelta(days=400)
+        self.old_post = Post.objects.create(
+            id=id_at(published), text='старый пост', group=self.group,
+            author=self.author
+        )
+        Post.objects.filter(id=self.old_post.id).update(pub_date=published)
+        self.comment = Comment.objects.create(post=self.old_post,
+                                              author=self.reader,
+                                              text='комментарий')
+        self.reply = Comment.objects.create(post=self.old_post,
+                                            author=self.author,
+                                            parent=self.comment,
+                                            text='ответ')
+        self.new_post = Post.objects.create(text='свежий пост',
+                                            group=self.group,
+                                            author=self.author)
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def archive(self, **options):
+        call_command('archive_posts', stdout=StringIO(), **options)
+
+    def test_moves_old_posts_with_comments(self):
+        """Старые посты и их комментарии переезжают в архив с теми же id"""
+        self.archive(days=365)
+        self.assertFalse(Post.objects.filter(id=self.old_post.id).exists())
+        self.assertFalse(Comment.objects.filter(
+            post_id=self.old_post.id
+        ).exists())
+        archived = ArchivedPost.objects.get(id=self.old_post.id)
+        self.assertEqual(archived.text, 'старый пост')
+        self.assertEqual(archived.group, self.group)
+        reply = ArchivedComment.objects.get(id=self.reply.id)
+        self.assertEqual(reply.parent_id, self.comment.id)
+        self.assertEqual(reply.path, self.reply.path)
+        self.assertTrue(Post.objects.filter(id=self.new_post.id).exists())
+
+    def test_sync_clients_see_archived_posts_removed(self):
+        """Перенос в архив приходит клиентам синхронизации как удаление"""
+        url = reverse('api_group_changes', args=[self.group.slug])
+        token = self.client.get(url).json()['token']
+        self.archive(days=365)
+        data = self.client.get(url, {'token': token}).json()
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['deleted'], [self.old_post.id])
+        self.assertEqual(data['posts'], [])
+
+    def test_younger_posts_stay(self):
+        """Посты моложе --days остаются в рабочей таблице"""
+        self.archive(days=500)
+        self.assertTrue(Post.objects.filter(id=self.old_post.id).exists())
+        self.assertFalse(ArchivedPost.objects.exists())
+
+    def test_post_page_reads_archive(self):
+        """Страница архивного поста открывается с комментариями, но без
+        формы ответа"""
+        self.archive(days=365)
+        url = reverse('post', args=[self.author.username, self.old_post.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'старый пост')
+        self.assertContains(response, 'комментарий')
+        self.assertContains(response, 'ответ')
+        self.assertNotContains(response, reverse(
+            'add_comment', args=[self.author.username, self.old_post.id]
+        ))
+        self.client.post(url, {'text': 'в архив не попадёт'})
+        self.assertFalse(ArchivedComment.objects.filter(
+            text='в архив не попадёт'
+        ).exists())
+
+    def test_archived_post_is_read_only(self):
+        """Архивный пост нельзя комментировать"""
+        self.archive(days=365)
+        response = self.client.post(
+            reverse('add_comment',
+                    args=[self.author.username, self.old_post.id]),
+            {'text': 'новый'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_profile_lists_archive(self):
+        """Профиль показывает и рабочие, и архивные посты по порядку"""
+        self.archive(days=365)
+        response = self.client.get(reverse('profile',
+                                           args=[self.author.username]))
+        page = response.context['page']
+        self.assertEqual(page.paginator.count, 2)
+        self.assertEqual([post.id for post in page],
+                         [self.new_post.id, self.old_post.id])
+
+    def test_feeds_exclude_archive(self):
+        """Главная и лента группы показывают только рабочие посты"""
+        self.archive(days=365)
+        for url in (reverse('index'),
+                    reverse('group_posts', args=[self.group.slug])):
+            with self.subTest(url=url):
+                page = self.client.get(url).context['page']
+                self.assertEqual([post.id for post in page],
+                                 [self.new_post.id])
+
+    def test_profile_page_is_one_union_query(self):
+        """Страница профиля выбирается одним UNION ALL с OFFSET, а не
+        слиянием всех предыдущих страниц"""
+        published = timezone.now() - dt.timedelta(days=300)
+        for number in range(4):
+            Post.objects.create(id=id_at(published) + number,
+                                text=f'пост {number}', author=self.author)
+        self.archive(days=365)
+        feed = UnionFeed(
+            [Post.objects.filter(author=self.author),
+             ArchivedPost.objects.filter(author=self.author)],
+            ('-id',)
+        )
+        expected = sorted(
+            list(Post.objects.filter(author=self.author))
+            + list(ArchivedPost.objects.filter(author=self.author)),
+            key=lambda post: -post.id
+        )
+        self.assertEqual(feed.count(), 6)
+        with CaptureQueriesContext(connection) as queries:
+            page = feed[3:6]
+        self.assertEqual([post.id for post in page],
+                         [post.id for post in expected[3:6]])
+        self.assertTrue(page[-1].archived)
+        self.assertEqual(len(queries), 3)
+        self.assertIn('UNION ALL', queries[0]['sql'])
+
+    def test_api_reads_archive(self):
+        """API отдаёт архивный пост с комментариями и учитывает архив в
+        профиле"""
+        self.archive(days=365)
+        data = read_json(self.client.get(reverse('api_post',
+                                                 args=[self.old_post.id])))
+        self.assertEqual(data['post']['text'], 'старый пост')
+        self.assertEqual(data['post']['comments_count'], 2)
+        self.assertEqual([comment['text']
+                          for comment in data['comments']['results']],
+                         ['комментарий', 'ответ'])
+        comments = read_json(self.client.get(
+            reverse('api_post_comments', args=[self.old_post.id])
+        ))
+        self.assertEqual(len(comments['results']), 2)
+        posts = read_json(self.client.get(
+            reverse('api_profile_posts', args=[self.author.username])
+        ))['results']
+        self.assertEqual([post['id'] for post in posts],
+                         [self.new_post.id, self.old_post.id])
+        profile = self.client.get(reverse('api_profile',
+                                          args=[self.author.username]))
+        self.assertEqual(profile.json()['posts'], 2)
+
+
+@override_settings(PURGE_BACKEND='posts.purge.LocalPurgeBackend')
+class ArchiveCommitTests(TransactionTestCase):
+    def test_purge_waits_for_commit(self):
+        """Прокси сбрасывается только после фиксации переноса"""
+        author = User.objects.create_user(username='test_user')
+        published = timezone.now() - dt.timedelta(days=400)
+        Post.objects.create(id=id_at(published), pub_date=published,
+                            text='старый пост', author=author)
+        Post.objects.update(pub_date=published)
+        purged = get_backend('posts.purge.LocalPurgeBackend').purged
+        purged.clear()
+        with transaction.atomic():
+            call_command('archive_posts', days=365, stdout=StringIO())
+            self.assertEqual(list(purged), [])
+        self.assertEqual(len(purged), 1)
+        self.assertTrue(ArchivedPost.objects.exists())
@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+from django.db import connection, transaction
+from django.db.models.functions import Upper
+from django.db.transaction import TransactionManagementError
+from django.test import TransactionTestCase, override_settings
+
+from posts.backfill import (PROGRESS_TABLE, RunBackfill, backfill,
+                            ensure_progress_table, progress)
+from posts.models import Post, User
+
+LOCK_FILE = os.path.join(tempfile.gettempdir(), 'yatube-test-write.lock')
+
+
+@override_settings(WRITE_LOCK_FILE=LOCK_FILE, BACKFILL_PAUSE=0)
+class BackfillTests(TransactionTestCase):
+    def setUp(self):
+        ensure_progress_table('default')
+        with connection.cursor() as cursor:
+            # таблица прогресса - не модель, её не очищает flush
+            cursor.execute(f'DELETE FROM {PROGRESS_TABLE}')
+        author = User.objects.create_user(username='author')
+        self.posts = [Post.objects.create(text=f'post {i}', author=author)
+                      for i in range(7)]
+        self.chunks = []
+
+    def upper(self, chunk):
+        self.chunks.append(list(chunk.values_list('pk', flat=True)))
+        chunk.update(text=Upper('text'))
+
+    def test_fills_in_batches(self):
+        """Все строки обновляются пачками по порядку первичного ключа"""
+        self.assertEqual(backfill('upper', Post.objects.all(), self.upper,
+                                  batch_size=3), 7)
+        self.assertEqual([len(chunk) for chunk in self.chunks], [3, 3, 1])
+        self.assertEqual(sum(self.chunks, []),
+                         sorted(post.pk for post in self.posts))
+        self.assertFalse(Post.objects.exclude(text=Upper('text')).exists())
+        [state] = progress('default', 'upper')
+        self.assertEqual((state['done'], state['total']), (7, 7))
+        self.assertIsNotNone(state['finished'])
+
+    def test_resumes_after_failure(self):
+        """После сбоя заполнение продолжается с непройденной пачки"""
+        def failing(chunk):
+            if self.chunks:
+                raise RuntimeError('сбой')
+            self.upper(chunk)
+
+        with self.assertRaises(RuntimeError):
+            backfill('upper', Post.objects.all(), failing, batch_size=3)
+        # пачка со сбоем откатилась вместе с прогрессом
+        self.assertEqual(Post.objects.filter(text=Upper('text')).count(), 3)
+        self.assertEqual(backfill('upper', Post.objects.all(), self.upper,
+                                  batch_size=3), 4)
+        self.assertEqual(sorted(sum(self.chunks, [])),
+                         sorted(post.pk for post in self.posts))
+
+    def test_finished_backfill_skipped(self):
+        """Законченное заполнение повторно не запускается"""
+        backfill('upper', Post.objects.all(), self.upper)
+        self.assertEqual(backfill('upper', Post.objects.all(), self.upper),
+                         0)
+        self.assertEqual(len(self.chunks), 1)
+
+    def test_refuses_transaction(self):
+        """Внутри транзакции заполнение не запускается"""
+        with transaction.atomic():
+            with self.assertRaises(TransactionManagementError):
+                backfill('upper', Post.objects.all(), self.upper)
+
+    def test_operation_deconstructs_own_arguments(self):
+        """Операция миграции воссоздаётся из собственных аргументов"""
+        operation = RunBackfill('post_upper', 'posts.Post', self.upper,
+                                batch_size=3, pause=0)
+        name, args, kwargs = operation.deconstruct()
+        self.assertEqual(name, 'RunBackfill')
+        self.assertEqual(kwargs, {'name': 'post_upper',
+                                  'model': 'posts.Post',
+                                  'update': self.upper, 'batch_size': 3,
+                                  'pause': 0})
+        copy = RunBackfill(*args, **kwargs)
+        self.assertEqual(copy.deconstruct(), (name, args, kwargs))
+        self.assertEqual(copy.describe(), operation.describe())
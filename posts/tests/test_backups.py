@@ -0,0 +1,134 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from posts.models import ChangeLog, Post, User
+from posts.purge import ALL_KEY, get_backend
+from yatube import backups
+
+LOCK_FILE = os.path.join(tempfile.gettempdir(), 'yatube-test-write.lock')
+
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name in ('default-20240101-030000.sqlite3.gz',
+                     'default-20240102-030000.sqlite3',
+                     'shard1-20240103-030000.sqlite3.gz',
+                     'notes.txt'):
+            open(os.path.join(self.directory, name), 'w').close()
+
+    def test_snapshot_at(self):
+        """Выбирается последний снимок базы не позже момента"""
+        latest = backups.snapshot_at(self.directory, 'default')
+        self.assertEqual(os.path.basename(latest.path),
+                         'default-20240102-030000.sqlite3')
+        moment = backups.Snapshot.from_path(
+            'default-20240101-120000.sqlite3'
+        ).moment
+        early = backups.snapshot_at(self.directory, 'default', moment)
+        self.assertTrue(early.compressed)
+        self.assertIsNone(backups.snapshot_at(self.directory, 'shard2'))
+
+    def test_rotate(self):
+        """Ротация оставляет keep последних снимков только своей базы"""
+        removed = backups.rotate(self.directory, 'default', 1)
+        self.assertEqual(len(removed), 1)
+        self.assertEqual(len(backups.snapshots(self.directory)), 2)
+
+
+@override_settings(WRITE_LOCK_FILE=LOCK_FILE)
+class BackupTests(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        author = User.objects.create_user(username='author')
+        Post.objects.bulk_create(Post(text=f'пост {i}', author=author)
+                                 for i in range(5))
+
+    def take(self, compress=True):
+        connection.ensure_connection()
+        return backups.take(connection.connection, 'default',
+                            self.directory, pages=4, pause=0,
+                            compress=compress)
+
+    def test_snapshot_verified(self):
+        """Сжатый снимок проходит проверку и содержит все посты"""
+        snapshot = self.take()
+        self.assertTrue(snapshot.path.endswith('.sqlite3.gz'))
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(snapshot.path)])
+        problems, counts = backups.verify(snapshot)
+        self.assertEqual(problems, [])
+        self.assertEqual(counts['posts_post'], 5)
+
+    def test_writes_during_backup(self):
+        """Запись другого соединения во время копии базы в режиме WAL не
+        начинает копирование заново, снимок - на момент начала"""
+        path = os.path.join(self.directory, 'live.sqlite3')
+        source = sqlite3.connect(path)
+        self.addCleanup(source.close)
+        source.execute('PRAGMA journal_mode = wal')
+        source.execute('CREATE TABLE note (text TEXT)')
+        source.executemany('INSERT INTO note VALUES (?)',
+                           [('x' * 500,)] * 200)
+        source.commit()
+        writer = sqlite3.connect(path)
+        self.addCleanup(writer.close)
+        steps = []
+
+        def write(done, total):
+            steps.append(done)
+            if len(steps) < 50:
+                writer.execute("INSERT INTO note VALUES ('новая')")
+                writer.commit()
+
+        snapshot = backups.take(source, 'live', self.directory, pages=1,
+                                pause=0, compress=False, progress=write)
+        self.assertEqual(len(steps), 1)
+        problems, counts = backups.verify(snapshot)
+        self.assertEqual(problems, [])
+        self.assertEqual(counts['note'], 200)
+        self.assertEqual(
+            source.execute('SELECT COUNT(*) FROM note').fetchone()[0], 201
+        )
+
+    @override_settings(PURGE_BACKEND='posts.purge.LocalPurgeBackend',
+                       CACHE_GENERATION_CHECK_INTERVAL=0)
+    def test_restore(self):
+        """Восстановление возвращает содержимое базы на момент снимка,
+        меняет поколение кэша для всех процессов и сбрасывает прокси"""
+        self.take(compress=False)
+        Post.objects.all().delete()
+        latest = ChangeLog.objects.latest('id').id
+        # ключ, под которым другой процесс хранит версию ленты
+        key = cache.make_key('feed-version')
+        purged = get_backend('posts.purge.LocalPurgeBackend').purged
+        purged.clear()
+        call_command('restore_backup', '--input', self.directory,
+                     '--noinput', stdout=open(os.devnull, 'w'))
+        self.assertEqual(Post.objects.count(), 5)
+        self.assertNotEqual(cache.make_key('feed-version'), key)
+        self.assertEqual(list(purged), [[ALL_KEY]])
+        post = Post.objects.create(text='после восстановления',
+                                   author=User.objects.first())
+        self.assertGreater(
+            ChangeLog.objects.filter(post_id=post.id).get().id, latest
+        )
+
+    def test_broken_snapshot_rejected(self):
+        """Испорченный снимок не проходит проверку"""
+        path = os.path.join(self.directory, 'default-20240101-030000.sqlite3')
+        with open(path, 'w') as broken:
+            broken.write('не база')
+        with self.assertRaises(CommandError):
+            call_command('restore_backup', path, '--verify',
+                         stdout=open(os.devnull, 'w'))
@@ -0,0 +1,147 @@
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import MAX_COMMENT_DEPTH, Comment, Post, User
+from yatube.settings import COMMENT_THREAD_DEPTH, COMMENTS_ON_PAGE
+
+COMMENTS_COUNT = COMMENTS_ON_PAGE + 5
+
+
+class CommentsPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='IvanovI')
+        cls.post = Post.objects.create(text='Ж' * 50, author=cls.user)
+        for i in range(COMMENTS_COUNT):
+            commentator = User.objects.create_user(username=f'user_{i}')
+            Comment.objects.create(post=cls.post, author=commentator,
+                                   text=f'комментарий {i}')
+        cls.post_page = reverse('post', args=[cls.user.username,
+                                              cls.post.id])
+        cls.fragment_page = reverse('post_comments',
+                                    args=[cls.user.username, cls.post.id])
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_post_page_shows_first_comments(self):
+        """Страница поста показывает только первую порцию комментариев"""
+        response = self.guest_client.get(self.post_page)
+        comments = response.context['comments_page']
+        self.assertEqual(len(comments), COMMENTS_ON_PAGE)
+        self.assertTrue(comments.has_next)
+        self.assertEqual(comments.object_list[0].text, 'комментарий 0')
+
+    def test_fragment_returns_next_comments(self):
+        """Фрагмент по курсору отдаёт оставшиеся комментарии"""
+        first = self.guest_client.get(self.post_page).context['comments_page']
+        response = self.guest_client.get(
+            self.fragment_page, {'cursor': first.next_cursor}
+        )
+        comments = response.context['comments_page']
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertEqual(len(comments), COMMENTS_COUNT - COMMENTS_ON_PAGE)
+        self.assertFalse(comments.has_next)
+        self.assertNotIn(list(first)[-1], list(comments))
+
+    def test_authors_loaded_without_extra_queries(self):
+        """Авторы комментариев загружаются одним запросом с комментариями"""
+        # число запросов не зависит от количества комментариев и ответов
+        with self.assertNumQueries(6):
+            self.guest_client.get(self.fragment_page)
+
+    def test_broken_cursor_starts_from_beginning(self):
+        """Битый курсор не ломает страницу"""
+        response = self.guest_client.get(self.fragment_page,
+                                         {'cursor': 'не-курсор'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['comments_page']),
+                         COMMENTS_ON_PAGE)
+
+
+class CommentThreadsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='IvanovI')
+        cls.post = Post.objects.create(text='Ж' * 50, author=cls.user)
+        cls.root = Comment.objects.create(post=cls.post, author=cls.user,
+                                          text='корень')
+        # цепочка ответов на один уровень глубже, чем показывается сразу
+        cls.chain = []
+        parent = cls.root
+        for level in range(COMMENT_THREAD_DEPTH + 1):
+            parent = Comment.objects.create(post=cls.post, author=cls.user,
+                                            parent=parent,
+                                            text=f'ответ {level}')
+            cls.chain.append(parent)
+        cls.other = Comment.objects.create(post=cls.post, author=cls.user,
+                                           text='другая ветка')
+        cls.post_page = reverse('post', args=[cls.user.username,
+                                              cls.post.id])
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def test_path_and_depth(self):
+        """Путь ответа продолжает путь родителя"""
+        reply = self.chain[0]
+        self.assertEqual(reply.depth, 1)
+        self.assertTrue(reply.path.startswith(self.root.path))
+        self.assertEqual(Comment.objects.get(pk=reply.pk).path, reply.path)
+
+    def test_subtree_is_range_query(self):
+        """Поддерево выбирается по диапазону путей без чужих веток"""
+        subtree = list(Comment.objects.subtree(self.root.path))
+        self.assertEqual(subtree, [self.root] + self.chain)
+        limited = Comment.objects.subtree(self.root.path, max_depth=1)
+        self.assertEqual(list(limited), [self.root, self.chain[0]])
+
+    def test_reply_counts(self):
+        """Число ответов считается по каждой ветке"""
+        counts = Comment.objects.reply_counts([self.root.path,
+                                               self.other.path])
+        self.assertEqual(counts, {self.root.path: len(self.chain),
+                                  self.other.path: 0})
+
+    def test_post_page_collapses_deep_replies(self):
+        """На странице поста глубокие ответы свёрнуты"""
+        response = self.authorized_client.get(self.post_page)
+        root = list(response.context['comments'])[0]
+        self.assertEqual(root.thread, self.chain[:COMMENT_THREAD_DEPTH])
+        self.assertEqual(root.thread[-1].hidden_replies, 1)
+        self.assertEqual(root.replies_count, len(self.chain))
+
+    def test_hidden_replies_count_whole_subtree(self):
+        """Число скрытых ответов включает всё свёрнутое поддерево"""
+        Comment.objects.create(post=self.post, author=self.user,
+                               parent=self.chain[-1], text='ещё глубже')
+        response = self.authorized_client.get(self.post_page)
+        root = list(response.context['comments'])[0]
+        self.assertEqual(root.thread[-1].hidden_replies, 2)
+
+    def test_replies_fragment_loads_hidden_part(self):
+        """Свёрнутая часть ветки подгружается отдельным фрагментом"""
+        collapsed = self.chain[COMMENT_THREAD_DEPTH - 1]
+        url = reverse('comment_replies', args=[self.user.username,
+                                               self.post.id, collapsed.id])
+        response = self.authorized_client.get(url)
+        self.assertEqual(response.context['comment'].thread,
+                         [self.chain[-1]])
+
+    def test_add_reply(self):
+        """Ответ на комментарий попадает в его ветку"""
+        url = reverse('add_comment', args=[self.user.username, self.post.id])
+        self.authorized_client.post(url, {'text': 'ответ на другую ветку',
+                                          'parent': self.other.id})
+        reply = Comment.objects.get(text='ответ на другую ветку')
+        self.assertEqual(reply.parent, self.other)
+        self.assertTrue(reply.path.startswith(self.other.path))
+
+    def test_depth_is_limited(self):
+        """Ответ глубже предела прикрепляется к последнему уровню"""
+        parent = self.other
+        for level in range(MAX_COMMENT_DEPTH + 2):
+            parent = Comment.objects.create(post=self.post, author=self.user,
+                                            parent=parent, text=str(level))
+        self.assertEqual(parent.depth, MAX_COMMENT_DEPTH - 1)
@@ -0,0 +1,129 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import TransactionTestCase, override_settings
+
+from posts import events
+from posts.events import Broker, handle, latest_event_id
+from posts.models import Group, Post, User
+
+
+async def open_stream(broker, path, headers=''):
+    """Запускает сервер событий и открывает к нему соединение."""
+    server = await asyncio.start_server(
+        lambda reader, writer: handle(reader, writer, broker),
+        '127.0.0.1', 0
+    )
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: test\r\n{headers}\r\n'
+                 .encode())
+    return server, reader, writer
+
+
+async def read_block(reader):
+    """Читает заголовки ответа или одно событие до пустой строки."""
+    return (await asyncio.wait_for(reader.readuntil(b'\n\n'), 5)).decode()
+
+
+@override_settings(SSE_HEARTBEAT=5, SSE_QUEUE_SIZE=2)
+class EventsTests(TransactionTestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='test_user')
+        self.group = Group.objects.create(title="Тест-название",
+                                          slug='test_slug',
+                                          description="Тест-описание")
+
+    def test_slow_subscriber_is_dropped(self):
+        """Переполненная очередь сбрасывается и закрывает соединение"""
+        async def scenario():
+            broker = Broker()
+            subscriber = broker.subscribe(['index'], 2)
+            for event_id in range(3):
+                broker.publish(['index'], (event_id, 'post', '{}'))
+            return [subscriber.queue.get_nowait()
+                    for _ in range(subscriber.queue.qsize())]
+        self.assertEqual(asyncio.run(scenario()), [None])
+
+    def test_live_event(self):
+        """Событие канала приходит подписчику ленты"""
+        async def scenario():
+            broker = Broker()
+            server, reader, writer = await open_stream(broker, '/events/')
+            headers = await read_block(reader)
+            while not broker.channels:
+                await asyncio.sleep(0.01)
+            broker.publish(['index'], (10 ** 6, 'post', '{"id":1}'))
+            event = await read_block(reader)
+            writer.close()
+            server.close()
+            return headers, event
+        headers, event = asyncio.run(scenario())
+        self.assertIn('text/event-stream', headers)
+        self.assertEqual(event, 'id: 1000000\nevent: post\ndata: {"id":1}'
+                                '\n\n')
+
+    @override_settings(SSE_HEARTBEAT=0.05)
+    def test_heartbeat(self):
+        """Без событий соединение получает heartbeat-комментарии"""
+        async def scenario():
+            server, reader, writer = await open_stream(Broker(), '/events/')
+            await read_block(reader)
+            heartbeat = await read_block(reader)
+            writer.close()
+            server.close()
+            return heartbeat
+        self.assertEqual(asyncio.run(scenario()), ': ping\n\n')
+
+    def test_replay_after_last_event_id(self):
+        """После переподключения пропущенные посты группы дочитываются"""
+        last_id = latest_event_id()
+        Post.objects.create(text='другой пост', author=self.author)
+        post = Post.objects.create(text='пост', author=self.author,
+                                   group=self.group)
+
+        async def scenario():
+            server, reader, writer = await open_stream(
+                Broker(), '/events/group/test_slug/',
+                f'Last-Event-ID: {last_id}\r\n'
+            )
+            await read_block(reader)
+            event = await read_block(reader)
+            writer.close()
+            server.close()
+            return event
+        event_id, name, data, _ = asyncio.run(scenario()).splitlines()
+        self.assertEqual(name, 'event: post')
+        self.assertEqual(json.loads(data[len('data: '):])['id'], post.id)
+
+    def test_unknown_feed(self):
+        """Несуществующая лента - ответ 404"""
+        async def scenario():
+            server, reader, writer = await open_stream(
+                Broker(), '/events/group/missing/'
+            )
+            status = await asyncio.wait_for(reader.readline(), 5)
+            server.close()
+            return status
+        self.assertIn(b'404', asyncio.run(scenario()))
+
+    @override_settings(SSE_POLL_INTERVAL=0.01)
+    def test_poll_survives_errors(self):
+        """Ошибка чтения журнала не останавливает рассылку"""
+        load_events = mock.Mock(side_effect=[
+            RuntimeError('database is locked'),
+            [(['index'], (10 ** 6, 'post', '{}'))],
+        ] + [[]] * 1000)
+
+        async def scenario():
+            broker = Broker()
+            subscriber = broker.subscribe(['index'], 2)
+            poller = asyncio.ensure_future(events.poll(broker))
+            event = await asyncio.wait_for(subscriber.queue.get(), 5)
+            poller.cancel()
+            return event
+        with mock.patch.object(events, 'load_events', load_events), \
+                self.assertLogs('posts.events', 'ERROR'):
+            event = asyncio.run(scenario())
+        self.assertEqual(event[0], 10 ** 6)
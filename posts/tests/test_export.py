@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from posts.models import Comment, Group, Post, User
+
+
+class ExportStaticTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title="Тест-название",
+                                         slug='test_slug',
+                                         description="Тест-описание")
+        cls.author = User.objects.create_user(username='test_user')
+        cls.post = Post.objects.create(text='пост', group=cls.group,
+                                       author=cls.author)
+        cls.other = Post.objects.create(text='другой пост',
+                                        author=cls.author)
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_static', '--output', self.output, *args,
+                     stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def page(self, *parts):
+        return os.path.join(self.output, *parts, 'index.html')
+
+    def test_full_export(self):
+        """Выгружаются страницы групп, профилей и постов"""
+        self.export()
+        for path in [self.page('group', 'test_slug'),
+                     self.page('test_user'),
+                     self.page('test_user', str(self.post.id))]:
+            with self.subTest(path=path):
+                self.assertTrue(os.path.exists(path))
+        with open(self.page('test_user', str(self.post.id))) as page:
+            self.assertIn('пост', page.read())
+
+    def test_incremental_export(self):
+        """Инкрементальная выгрузка обновляет только затронутые страницы"""
+        self.export()
+        self.assertIn('Записано страниц: 0',
+                      self.export('--incremental'))
+        Comment.objects.create(post=self.other, author=self.author,
+                               text='комментарий')
+        self.assertIn('Записано страниц: 2', self.export('--incremental'))
+        with open(self.page('test_user', str(self.other.id))) as page:
+            self.assertIn('комментарий', page.read())
+
+    def test_deleted_post_page_removed(self):
+        """Страница удалённого поста удаляется при выгрузке"""
+        self.export()
+        path = self.page('test_user', str(self.other.id))
+        Post.objects.filter(pk=self.other.pk).delete()
+        self.assertIn('удалено: 1', self.export('--incremental'))
+        self.assertFalse(os.path.exists(path))
+
+    def test_renamed_group_page_removed(self):
+        """Страница группы по прежнему адресу удаляется после смены slug"""
+        self.export()
+        self.group.slug = 'new_slug'
+        self.group.save()
+        self.export('--incremental')
+        self.assertFalse(os.path.exists(self.page('group', 'test_slug')))
+        self.assertTrue(os.path.exists(self.page('group', 'new_slug')))
+
+    def test_renamed_user_pages_moved(self):
+        """Профиль и посты переименованного пользователя переезжают на
+        новые адреса"""
+        self.export()
+        self.author.username = 'renamed_user'
+        self.author.save()
+        self.export('--incremental')
+        self.assertFalse(os.path.exists(self.page('test_user')))
+        self.assertFalse(os.path.exists(
+            self.page('test_user', str(self.post.id))
+        ))
+        self.assertTrue(os.path.exists(
+            self.page('renamed_user', str(self.post.id))
+        ))
+
+    def test_deleted_user_pages_removed(self):
+        """Страницы удалённого пользователя удаляются"""
+        reader = User.objects.create_user(username='reader')
+        self.export()
+        self.assertTrue(os.path.exists(self.page('reader')))
+        reader.delete()
+        self.export('--incremental')
+        self.assertFalse(os.path.exists(self.page('reader')))
+
+    def test_failed_page_does_not_stop_export(self):
+        """Ошибка отрисовки страницы не прерывает выгрузку, а страница
+        пробуется снова при следующем запуске"""
+        with mock.patch('posts.views.render',
+                        side_effect=RuntimeError('сбой')):
+            self.export()
+        self.assertTrue(os.path.exists(self.page('test_user')))
+        path = self.page('test_user', str(self.other.id))
+        self.assertFalse(os.path.exists(path))
+        self.assertIn('Записано страниц: 2', self.export('--incremental'))
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,94 @@
+from django.core.cache import cache
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+
+
+@override_settings(FEED_ITEMS=3)
+class SyndicationFeedsTests(TransactionTestCase):
+    def setUp(self):
+        self.group = Group.objects.create(title="Тест-название",
+                                          slug='test_slug',
+                                          description="Тест-описание")
+        self.author = User.objects.create_user(username='test_user')
+        for i in range(5):
+            Post.objects.create(text=f'пост номер {i}', group=self.group,
+                                author=self.author)
+        cache.clear()
+        self.guest_client = Client()
+        self.group_rss = reverse('group_rss', args=[self.group.slug])
+
+    def test_feeds(self):
+        """Ленты групп и авторов отдают последние FEED_ITEMS постов"""
+        urls = {
+            self.group_rss: 'application/rss+xml',
+            reverse('group_atom', args=[self.group.slug]):
+                'application/atom+xml',
+            reverse('profile_rss', args=[self.author.username]):
+                'application/rss+xml',
+            reverse('profile_atom', args=[self.author.username]):
+                'application/atom+xml',
+        }
+        for url, content_type in urls.items():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTrue(response['Content-Type']
+                                .startswith(content_type))
+                content = response.content.decode()
+                self.assertIn('пост номер 4', content)
+                self.assertNotIn('пост номер 1', content)
+
+    def test_conditional_get(self):
+        """Повторный запрос с ETag или датой получает пустой 304"""
+        response = self.guest_client.get(self.group_rss)
+        conditions = [
+            {'HTTP_IF_NONE_MATCH': response['ETag']},
+            {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+        ]
+        for headers in conditions:
+            with self.subTest(headers=headers):
+                response = self.guest_client.get(self.group_rss, **headers)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    def test_cached_until_changed(self):
+        """Лента читается из кэша, пока посты группы не изменились"""
+        self.guest_client.get(self.group_rss)
+        with self.assertNumQueries(1):
+            self.guest_client.get(self.group_rss)
+        post = Post.objects.filter(group=self.group).first()
+        post.text = 'исправленный пост'
+        post.save()
+        response = self.guest_client.get(self.group_rss)
+        self.assertIn('исправленный пост', response.content.decode())
+
+    def test_revision_shared_between_processes(self):
+        """ETag - номер записи журнала: процесс с пустым кэшем отдаёт тот же
+        ETag, а после правки в другом процессе - новый"""
+        etag = self.guest_client.get(self.group_rss)['ETag']
+        # другой процесс: свой пустой кэш
+        cache.clear()
+        self.assertEqual(self.guest_client.get(self.group_rss)['ETag'],
+                         etag)
+        cache.clear()
+        Post.objects.create(text='новый пост', group=self.group,
+                            author=self.author)
+        cache.clear()
+        self.assertNotEqual(self.guest_client.get(self.group_rss)['ETag'],
+                            etag)
+
+    def test_group_and_author_names_update_feeds(self):
+        """Правка группы и имени автора меняет их ленты"""
+        self.guest_client.get(self.group_rss)
+        profile_rss = reverse('profile_rss', args=[self.author.username])
+        self.guest_client.get(profile_rss)
+        self.group.title = 'Новое название'
+        self.group.save()
+        self.author.first_name = 'Иван'
+        self.author.save()
+        self.assertIn('Новое название',
+                      self.guest_client.get(self.group_rss)
+                      .content.decode())
+        self.assertIn('Иван',
+                      self.guest_client.get(profile_rss).content.decode())
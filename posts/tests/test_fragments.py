@@ -0,0 +1,87 @@
+import re
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Follow, Post, User
+from yatube.settings import POSTS_ON_PAGE
+
+INDEX_FRAGMENT = reverse('index_fragment')
+FOLLOW_FRAGMENT = reverse('follow_fragment')
+POSTS_COUNT = POSTS_ON_PAGE * 2 + 3
+
+
+class FeedFragmentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(POSTS_COUNT):
+            Post.objects.create(text=f'пост номер {i}', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_fragments_walk_whole_feed(self):
+        """По курсорам фрагменты отдают ленту целиком без повторов"""
+        for url in (INDEX_FRAGMENT, FOLLOW_FRAGMENT):
+            with self.subTest(url=url):
+                seen, cursor = [], None
+                while True:
+                    params = {'cursor': cursor} if cursor else {}
+                    response = self.authorized_client.get(url, params)
+                    seen.extend(post.id for post in response.context['page'])
+                    cursor = response.get('X-Next-Cursor')
+                    if cursor is None:
+                        break
+                self.assertEqual(
+                    seen,
+                    list(Post.objects.values_list('id', flat=True))
+                )
+
+    def test_fragment_has_no_layout(self):
+        """Фрагмент содержит только карточки постов"""
+        response = self.guest_client.get(INDEX_FRAGMENT)
+        content = response.content.decode()
+        self.assertNotIn('<html', content)
+        self.assertEqual(content.count('card mb-3'), POSTS_ON_PAGE)
+
+    def test_json_variant(self):
+        """JSON-вариант отдаёт разметку и курсор следующей порции"""
+        response = self.guest_client.get(INDEX_FRAGMENT, {'format': 'json'})
+        data = response.json()
+        self.assertIn('пост номер', data['html'])
+        self.assertEqual(data['next_cursor'], response.context['page']
+                         .next_cursor)
+
+    def test_index_links_to_next_fragment(self):
+        """Страница ленты ссылается на порцию после своего последнего поста"""
+        response = self.guest_client.get(reverse('index'))
+        next_fragment = response.context['next_fragment']
+        self.assertTrue(next_fragment.startswith(INDEX_FRAGMENT))
+        fragment = self.guest_client.get(next_fragment)
+        first = fragment.context['page'].object_list[0]
+        self.assertEqual(first, Post.objects.all()[POSTS_ON_PAGE])
+
+    def test_cached_page_keeps_its_cursor(self):
+        """Закэшированная страница продолжается с её последнего поста, даже
+        когда вышли новые посты"""
+        content = self.guest_client.get(reverse('index')).content.decode()
+        Post.objects.create(text='новый пост', author=self.author)
+        cached = self.guest_client.get(reverse('index')).content.decode()
+        self.assertEqual(cached, content)
+        cursor = re.search(r'data-fragment="[^"]*cursor=([^"]+)"',
+                           cached).group(1)
+        fragment = self.guest_client.get(INDEX_FRAGMENT, {'cursor': cursor})
+        self.assertEqual(fragment.context['page'].object_list[0],
+                         Post.objects.all()[POSTS_ON_PAGE + 1])
+
+    def test_follow_fragment_requires_login(self):
+        """Фрагмент избранной ленты недоступен гостю"""
+        response = self.guest_client.get(FOLLOW_FRAGMENT)
+        self.assertEqual(response.status_code, 302)
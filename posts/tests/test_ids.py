@@ -0,0 +1,128 @@
+import datetime as dt
+import shutil
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from posts.ids import (MAX_SEQUENCE, SEQUENCE_BITS, IdGenerator, id_at,
+                       id_time, lease_node)
+from posts.models import Comment, Post, User
+
+
+class FakeClock:
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __call__(self):
+        return self.values.pop(0) if len(self.values) > 1 else self.values[0]
+
+
+class IdGeneratorTests(TestCase):
+    def test_ids_grow_with_time(self):
+        """id растут, несут номер узла и время выдачи"""
+        generator = IdGenerator(node=3)
+        ids = [generator() for _ in range(1000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all((pk >> SEQUENCE_BITS) & 31 == 3 for pk in ids))
+        self.assertLess(ids[-1], 2 ** 53)
+        self.assertAlmostEqual(id_time(ids[0]).timestamp(),
+                               timezone.now().timestamp(), delta=5)
+
+    def test_clock_going_back(self):
+        """Отставшие часы не ломают порядок id"""
+        start = int(timezone.now().timestamp() * 1000)
+        generator = IdGenerator(node=0, clock=FakeClock([start, start - 50]))
+        first, second = generator(), generator()
+        self.assertGreater(second, first)
+
+    def test_sequence_overflow_waits_for_next_ms(self):
+        """Исчерпав номера в миллисекунде, генератор берёт следующую"""
+        start = int(timezone.now().timestamp() * 1000)
+        clock = FakeClock([start] * (MAX_SEQUENCE + 2) + [start + 1])
+        generator = IdGenerator(node=0, clock=clock)
+        ids = [generator() for _ in range(MAX_SEQUENCE + 2)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(id_time(ids[-1]) - id_time(ids[0]),
+                         dt.timedelta(milliseconds=1))
+
+    def test_bad_node(self):
+        with self.assertRaises(ValueError):
+            IdGenerator(node=32)
+
+    def test_id_at(self):
+        """id_at - нижняя граница id, выданных после момента"""
+        moment = timezone.now() - dt.timedelta(days=1)
+        self.assertLessEqual(id_time(id_at(moment)), moment)
+        self.assertGreater(IdGenerator(node=0)(), id_at(moment))
+
+
+class NodeLeaseTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def lease(self, node=None):
+        node, lock = lease_node(self.directory, node)
+        self.addCleanup(lock.close)
+        return node
+
+    def test_processes_get_distinct_nodes(self):
+        """Каждый писатель получает свой свободный номер узла"""
+        self.assertEqual([self.lease() for _ in range(3)], [0, 1, 2])
+
+    def test_busy_node_refused(self):
+        """Второй писатель с тем же ID_NODE не запускается"""
+        self.assertEqual(self.lease(5), 5)
+        with self.assertRaises(ImproperlyConfigured):
+            self.lease(5)
+
+    def test_released_node_reused(self):
+        """Номер завершившегося писателя снова свободен"""
+        node, lock = lease_node(self.directory)
+        lock.close()
+        self.assertEqual(self.lease(), node)
+
+
+class SnowflakeModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test_user')
+
+    def test_new_objects_get_ids(self):
+        """Пост и комментарий получают id до вставки, без UPDATE"""
+        post = Post(text='пост', author=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            post.save()
+            comment = Comment(text='комментарий', author=self.user,
+                              post=post)
+            comment.save()
+        statements = [query['sql'].split()[0] for query in queries]
+        self.assertNotIn('UPDATE', statements)
+        self.assertNotIn('SELECT', statements)
+        self.assertGreater(comment.id, post.id)
+        self.assertTrue(comment.path)
+        self.assertEqual(Comment.objects.get(pk=comment.pk).path,
+                         comment.path)
+
+    def test_feed_order_is_id_order(self):
+        """Новые посты идут в ленте первыми"""
+        posts = [Post.objects.create(text=f'пост {i}', author=self.user)
+                 for i in range(5)]
+        self.assertEqual(list(Post.objects.all()), posts[::-1])
+
+    def test_bulk_create_comments(self):
+        """Пачка комментариев получает id и пути, ответы - под родителем"""
+        post = Post.objects.create(text='пост', author=self.user)
+        root = Comment(text='корень', author=self.user, post=post)
+        reply = Comment(text='ответ', author=self.user, post=post,
+                        parent=root)
+        Comment.objects.bulk_create([root, reply])
+        self.assertEqual(list(post.comments.order_by('path')),
+                         [root, reply])
+        saved = Comment.objects.get(pk=reply.pk)
+        self.assertTrue(saved.path.startswith(root.path))
+        self.assertEqual(saved.depth, 1)
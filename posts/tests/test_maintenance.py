@@ -0,0 +1,73 @@
+import datetime as dt
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from posts import maintenance
+from posts.models import Post, User
+
+LOCK_FILE = os.path.join(tempfile.gettempdir(), 'yatube-test-write.lock')
+
+
+def at(hour, minute=0, day=1):
+    return dt.datetime(2024, 1, day, hour, minute)
+
+
+class WindowTests(SimpleTestCase):
+    def test_in_window(self):
+        """Окно, в том числе через полночь, включает начало и не включает
+        конец"""
+        cases = (
+            (('03:00', '05:00'), at(3), True),
+            (('03:00', '05:00'), at(5), False),
+            (('03:00', '05:00'), at(12), False),
+            (('23:00', '02:00'), at(23, 30), True),
+            (('23:00', '02:00'), at(1), True),
+            (('23:00', '02:00'), at(12), False),
+        )
+        for window, moment, expected in cases:
+            with self.subTest(window=window, moment=moment):
+                self.assertEqual(maintenance.in_window(window, moment),
+                                 expected)
+
+    def test_window_bounds(self):
+        """Границы текущего окна, а вне окна - следующего"""
+        cases = (
+            (('03:00', '05:00'), at(4), (at(3), at(5))),
+            (('03:00', '05:00'), at(6), (at(3, day=2), at(5, day=2))),
+            (('23:00', '02:00'), at(1, day=2), (at(23), at(2, day=2))),
+            (('23:00', '02:00'), at(12), (at(23), at(2, day=2))),
+        )
+        for window, moment, expected in cases:
+            with self.subTest(window=window, moment=moment):
+                self.assertEqual(maintenance.window_bounds(window, moment),
+                                 expected)
+
+
+@override_settings(WRITE_LOCK_FILE=LOCK_FILE)
+class MaintenanceTests(TransactionTestCase):
+    def test_vacuum_returns_free_pages(self):
+        """Шаговый vacuum возвращает страницы, освободившиеся после
+        удаления"""
+        author = User.objects.create_user(username='author')
+        Post.objects.bulk_create(Post(text='x' * 2000, author=author)
+                                 for _ in range(200))
+        Post.objects.all().delete()
+        before = maintenance.stats('default')
+        self.assertEqual(before['auto_vacuum'], 'incremental')
+        self.assertGreater(before['free_pages'], 0)
+        freed = maintenance.incremental_vacuum('default', 5, 16)
+        self.assertEqual(freed, before['free_pages'])
+        after = maintenance.stats('default')
+        self.assertEqual(after['free_pages'], 0)
+        self.assertLess(after['pages'], before['pages'])
+
+    def test_healthy_database(self):
+        """Исправная база проходит проверку, обслуживание выводит отчёт"""
+        self.assertEqual(maintenance.integrity_problems('default'), [])
+        out = StringIO()
+        call_command('sqlite_maintenance', '--now', stdout=out)
+        self.assertIn('default: освобождено страниц', out.getvalue())
@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+
+from posts import plans
+from posts.models import ChangeLog, Comment, Post
+
+
+def finding(queryset, detail=None):
+    sql, params = queryset.query.sql_with_params()
+    sql = connection.ops.last_executed_query(connection.cursor(), sql,
+                                             params)
+    found = list(plans.findings('test', '/', 'default', sql,
+                                plans.explain('default', sql)))
+    if detail is not None:
+        table = queryset.model._meta.db_table
+        found.append(plans.Finding('test', '/', 'default', sql, table,
+                                   detail))
+    return found
+
+
+class PlanTests(TestCase):
+    def test_detects_scan_and_sort(self):
+        """Проход по таблице и сортировка во временном B-дереве - находки"""
+        details = [item.detail for item in
+                   finding(Post.objects.order_by('text'))]
+        self.assertIn('SCAN posts_post', details)
+        self.assertIn('USE TEMP B-TREE FOR ORDER BY', details)
+
+    def test_suggests_composite_index(self):
+        """Индекс предлагается по условиям равенства и сортировке"""
+        found = finding(Post.objects.filter(text='x').order_by('pub_date'))
+        self.assertEqual(plans.suggest_index(found[0]),
+                         (Post, ['text', 'pub_date']))
+
+    def test_existing_index_not_suggested(self):
+        """Если подходящий индекс уже есть, он не предлагается"""
+        found = finding(Comment.objects.filter(post_id=1).order_by('path'),
+                        detail='SCAN posts_comment')
+        self.assertIsNone(plans.suggest_index(found[-1]))
+
+    def test_key_ignores_sqlite_version_and_index_names(self):
+        """Ключ находки не зависит от вида строки плана в версии SQLite и от
+        сгенерированного имени индекса"""
+        keys = {
+            plans.finding_key(plans.Finding('index', '/', 'default', '',
+                                            'posts_post', detail))
+            for detail in (
+                'SCAN TABLE posts_post AS U0 USING COVERING INDEX '
+                'posts_post_group_id_c91a8485',
+                'SCAN posts_post USING COVERING INDEX posts_post_group_id',
+            )
+        }
+        self.assertEqual(keys, {'index: posts_post: SCAN posts_post '
+                                'USING COVERING INDEX'})
+
+    @override_settings(EDGE_CACHE_SECONDS=0)
+    def test_pages_match_baseline(self):
+        """Все страницы posts/urls.py открываются, а их планы не хуже
+        эталона"""
+        sample = plans.seed(users=3, posts=5, comments=2, follows=1)
+        client = Client()
+        client.force_login(sample['user'])
+        urls = list(plans.sample_urls(sample))
+        keys = {plans.finding_key(item)
+                for item in plans.collect(client, urls)}
+        baseline = plans.load_baseline(settings.QUERY_PLAN_BASELINE)
+        self.assertLessEqual(keys, baseline.keys())
+        self.assertEqual(plans.unexplained(baseline), [])
+
+    @override_settings(EDGE_CACHE_SECONDS=0)
+    def test_actions_are_posted(self):
+        """Комментарий, подписка и отписка отправляются POST-запросом и
+        доходят до записи, подписка - на другого автора"""
+        sample = plans.seed(users=3, posts=5, comments=2, follows=1)
+        client = Client()
+        client.force_login(sample['user'])
+        urls = [(name, url) for name, url in plans.sample_urls(sample)
+                if name in plans.ACTIONS]
+        seeded = ChangeLog.objects.latest('id').id
+        plans.collect(client, urls)
+        self.assertTrue(Comment.objects.filter(
+            text=plans.ACTIONS['add_comment'][0]['text']
+        ).exists())
+        self.assertEqual(
+            list(ChangeLog.objects.filter(user_id=sample['user'].id,
+                                          id__gt=seeded)
+                 .values_list('kind', flat=True)),
+            [ChangeLog.FOLLOW, ChangeLog.UNFOLLOW]
+        )
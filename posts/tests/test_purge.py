@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+from posts.purge import get_backend
+
+
+class EdgeCacheHeadersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title="Тест-название",
+                                         slug='test_slug',
+                                         description="Тест-описание")
+        cls.author = User.objects.create_user(username='test_user')
+        cls.post = Post.objects.create(text='пост', group=cls.group,
+                                       author=cls.author)
+
+    def setUp(self):
+        self.guest_client = Client()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.author)
+
+    def test_guest_pages_are_tagged(self):
+        """Страницы для гостей кэшируются прокси и помечены ключами"""
+        pages = {
+            reverse('index'): 'all index',
+            reverse('group_posts', args=[self.group.slug]):
+                f'all group-{self.group.id}',
+            reverse('profile', args=[self.author.username]):
+                f'all author-{self.author.id}',
+            reverse('post', args=[self.author.username, self.post.id]):
+                f'all author-{self.author.id} post-{self.post.id}',
+        }
+        for url, keys in pages.items():
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertEqual(response['Surrogate-Key'], keys)
+                self.assertIn('public', response['Cache-Control'])
+                self.assertIn('max-age=', response['Surrogate-Control'])
+
+    def test_user_pages_are_private(self):
+        """Страницы для пользователя прокси не кэширует"""
+        response = self.authorized_client.get(reverse('index'))
+        self.assertFalse(response.has_header('Surrogate-Key'))
+        self.assertIn('private', response['Cache-Control'])
+
+
+@override_settings(PURGE_BACKEND='posts.purge.LocalPurgeBackend')
+class PurgeDispatchTests(TransactionTestCase):
+    def setUp(self):
+        self.group = Group.objects.create(title="Тест-название",
+                                          slug='test_slug',
+                                          description="Тест-описание")
+        self.author = User.objects.create_user(username='test_user')
+        self.reader = User.objects.create_user(username='IvanovI')
+        self.post = Post.objects.create(text='пост', group=self.group,
+                                        author=self.author)
+        self.purged = get_backend('posts.purge.LocalPurgeBackend').purged
+        self.purged.clear()
+
+    def test_comment_purges_post_and_feeds(self):
+        """Новый комментарий сбрасывает страницу поста и ленты с ним"""
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='комментарий')
+        self.assertEqual(list(self.purged), [sorted([
+            f'author-{self.author.id}', f'group-{self.group.id}', 'index',
+            f'post-{self.post.id}',
+        ])])
+
+    def test_follow_purges_both_profiles(self):
+        """Подписка сбрасывает профили обеих сторон"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(list(self.purged), [sorted([
+            f'author-{self.author.id}', f'author-{self.reader.id}',
+        ])])
+
+    def test_purge_waits_for_commit(self):
+        """Сброс уходит только после фиксации транзакции"""
+        with transaction.atomic():
+            self.post.text = 'исправленный пост'
+            self.post.save()
+            self.assertEqual(list(self.purged), [])
+        self.assertEqual(len(self.purged), 1)
+
+    def test_history_is_bounded(self):
+        """Тестовый бэкенд хранит только последние сбросы"""
+        for _ in range(self.purged.maxlen + 10):
+            Follow.objects.create(user=self.reader, author=self.author)
+            Follow.objects.filter(user=self.reader).delete()
+        self.assertEqual(len(self.purged), self.purged.maxlen)
@@ -0,0 +1,123 @@
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.http import StreamingHttpResponse
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Post, User
+from yatube import replicas
+
+
+@override_settings(REPLICA_DATABASES=['replica'], REPLICA_MAX_LAG=5)
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='test_user')
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        replicas._copied_at.clear()
+
+    def tearDown(self):
+        replicas._copied_at.clear()
+
+    def set_lag(self, seconds):
+        # время снимка уже прочитано: реплику не трогаем
+        now = time.time()
+        replicas._copied_at['replica'] = (now, now - seconds)
+
+    def test_fresh_replica_chosen(self):
+        """Свежая реплика используется для чтения"""
+        self.set_lag(1)
+        self.assertEqual(replicas.choose_replica(self.factory.get('/')),
+                         'replica')
+
+    def test_lagging_replica_skipped(self):
+        """Отставшая реплика не используется"""
+        self.set_lag(60)
+        self.assertIsNone(replicas.choose_replica(self.factory.get('/')))
+
+    def test_streamed_response_reads_replica(self):
+        """Потоковый ответ выбирает данные с реплики и после возврата из
+        вьюхи"""
+        self.set_lag(1)
+        router = replicas.ReplicaRouter()
+
+        def chunks():
+            for _ in range(2):
+                yield router.db_for_read(Post) or 'default'
+
+        view = replicas.replica_reads(
+            lambda request: StreamingHttpResponse(chunks())
+        )
+        response = view(self.factory.get('/'))
+        self.assertIsNone(router.db_for_read(Post))
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'replicareplica')
+        self.assertIsNone(router.db_for_read(Post))
+
+    def test_pinned_user_reads_primary(self):
+        """После записи пользователь читает с основной базы"""
+        self.set_lag(1)
+        request = self.factory.get('/')
+        request.COOKIES[replicas.PIN_COOKIE] = str(time.time() + 10)
+        self.assertIsNone(replicas.choose_replica(request))
+        request.COOKIES[replicas.PIN_COOKIE] = str(time.time() - 10)
+        self.assertEqual(replicas.choose_replica(request), 'replica')
+
+    def test_write_pins_user(self):
+        """Запрос с записью ставит cookie чтения с основной базы"""
+        self.set_lag(60)
+        client = Client()
+        client.force_login(self.user)
+        response = client.get(reverse('index'))
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        response = client.post(reverse('new_post'), {'text': 'Новый пост'})
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertGreater(
+            float(response.cookies[replicas.PIN_COOKIE].value), time.time()
+        )
+
+    def test_login_does_not_pin(self):
+        """Вход пользователя (сессия, last_login) cookie не ставит"""
+        self.set_lag(60)
+        User.objects.create_user(username='reader', password='password')
+        response = Client().post(reverse('login'),
+                                 {'username': 'reader',
+                                  'password': 'password'})
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_no_pin_without_replicas(self):
+        """Без реплик cookie не ставится"""
+        client = Client()
+        client.force_login(self.user)
+        with self.settings(REPLICA_DATABASES=[]):
+            response = client.post(reverse('new_post'), {'text': 'Пост'})
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+
+class ReplicateTests(TestCase):
+    def test_replicate_copies_database(self):
+        """Реплика получает данные и время снимка"""
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'primary.sqlite3')
+            target = os.path.join(directory, 'replica.sqlite3')
+            db = sqlite3.connect(source)
+            db.execute('CREATE TABLE post (text TEXT)')
+            db.execute("INSERT INTO post VALUES ('пост')")
+            db.commit()
+            db.close()
+            before = time.time()
+            replicas.replicate(source, target)
+            db = sqlite3.connect(target)
+            self.assertEqual(db.execute('SELECT text FROM post').fetchall(),
+                             [('пост',)])
+            copied_at, = db.execute(
+                f'SELECT copied_at FROM {replicas.STATE_TABLE}'
+            ).fetchone()
+            db.close()
+            self.assertGreaterEqual(copied_at, before)
@@ -0,0 +1,279 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts import shards
+from posts.events import load_events
+from posts.management.commands.move_author import Command as MoveAuthor
+from posts.models import AuthorShard, ChangeLog, Comment, Group, Post, User
+from posts.purge import author_key, get_backend, post_key
+from posts.pagination import encode_cursor
+from posts.shards import (ShardedFeed, ShardRouter, copy_rows, shard_for,
+                          sharded)
+from posts.sitemaps import chunk_of
+from posts.writes import run_batch
+
+FEED_ORDERING = ('-id',)
+
+
+def read(response):
+    return b''.join(response.streaming_content).decode()
+
+
+class ShardedFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first = User.objects.create_user(username='first')
+        cls.second = User.objects.create_user(username='second')
+        for number in range(10):
+            author = cls.first if number % 3 else cls.second
+            Post.objects.create(text=f'пост {number}', author=author)
+
+    def setUp(self):
+        # шарды изображают срезы одной базы по автору
+        self.feed = ShardedFeed(
+            [Post.objects.filter(author=self.first),
+             Post.objects.filter(author=self.second)],
+            FEED_ORDERING
+        )
+        self.expected = list(Post.objects.order_by(*FEED_ORDERING))
+
+    def test_slices_merged_by_date(self):
+        """Срез ленты совпадает со срезом общей выборки"""
+        self.assertEqual(self.feed.count(), 10)
+        self.assertEqual(self.feed[0:4], self.expected[0:4])
+        self.assertEqual(self.feed[4:8], self.expected[4:8])
+        self.assertEqual(self.feed[3], self.expected[3])
+
+    def test_keyset_pages(self):
+        """Курсорные страницы обходят ленту без пропусков и повторов"""
+        page = self.feed.keyset_page(None, 4)
+        self.assertEqual(list(page), self.expected[:4])
+        last = self.expected[3]
+        self.assertEqual(page.next_cursor, encode_cursor([last.id]))
+        page = self.feed.keyset_page(page.next_cursor, 6)
+        self.assertEqual(list(page), self.expected[4:])
+        self.assertFalse(page.has_next)
+
+    def test_disabled_sharding_keeps_queryset(self):
+        """Без шардов лента остаётся обычным QuerySet"""
+        queryset = Post.objects.all()
+        self.assertIs(sharded(queryset, FEED_ORDERING), queryset)
+
+    def test_copy_rows_keeps_dates(self):
+        """Перенос строк сохраняет id и даты публикации"""
+        post = self.expected[-1]
+        Post.objects.filter(pk=post.pk).delete()
+        copy_rows(Post, [post], 'default')
+        self.assertEqual(Post.objects.get(pk=post.pk).pub_date,
+                         post.pub_date)
+
+
+class ShardRouterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.odd = User.objects.create_user(username='odd', id=11)
+        cls.even = User.objects.create_user(username='even', id=12)
+
+    def setUp(self):
+        # базы shard1 нет: роутер только выбирает её имя
+        shards = override_settings(SHARD_DATABASES=['default', 'shard1'])
+        shards.enable()
+        self.addCleanup(shards.disable)
+
+    def test_authors_spread_by_id(self):
+        """Авторы распределены по шардам по остатку от id"""
+        self.assertEqual(shard_for(self.odd.id), 'shard1')
+        self.assertEqual(shard_for(self.even.id), 'default')
+
+    def test_moved_author(self):
+        """Перенесённый автор живёт на шарде из AuthorShard"""
+        AuthorShard.objects.create(author=self.odd, alias='default')
+        self.assertEqual(shard_for(self.odd.id), 'default')
+
+    def test_new_rows_routed_to_author_shard(self):
+        """Новые пост и комментарий пишутся на шард автора поста"""
+        router = ShardRouter()
+        post = Post(text='пост', author=self.odd)
+        self.assertEqual(router.db_for_write(Post, instance=post), 'shard1')
+        post._state.db = 'shard1'
+        post._state.adding = False
+        comment = Comment(text='комментарий', author=self.even, post=post)
+        self.assertEqual(router.db_for_write(Comment, instance=comment),
+                         'shard1')
+        self.assertEqual(router.db_for_read(Post, instance=self.odd),
+                         'shard1')
+
+
+class ShardedReadsTests(TransactionTestCase):
+    """Чтения с настоящей второй базой: посты нечётного автора лежат на
+    shard1, чётного - в default."""
+
+    def setUp(self):
+        cache.clear()
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        connections.databases['shard1'] = dict(
+            connections.databases['default'], NAME=path
+        )
+        self.addCleanup(self.drop_shard)
+        shard_settings = override_settings(
+            SHARD_DATABASES=['default', 'shard1']
+        )
+        shard_settings.enable()
+        self.addCleanup(shard_settings.disable)
+        call_command('migrate', database='shard1', verbosity=0)
+        self.group = Group.objects.create(title='Тест-название',
+                                          slug='test_slug',
+                                          description='Тест-описание')
+        self.odd = User.objects.create_user(username='odd', id=11)
+        self.even = User.objects.create_user(username='even', id=12)
+        self.posts = [
+            Post.objects.create(text=f'пост {number}', group=self.group,
+                                author=self.odd if number % 2 else self.even)
+            for number in range(4)
+        ]
+        self.remote = self.posts[-1]
+        Comment.objects.create(post=self.remote, author=self.even,
+                               text='комментарий')
+
+    def drop_shard(self):
+        # потоки опроса шардов держат свои соединения со старым файлом
+        if shards._executor is not None:
+            shards._executor.shutdown()
+            shards._executor = None
+        connections['shard1'].close()
+        del connections.databases['shard1']
+        if hasattr(connections._connections, 'shard1'):
+            delattr(connections._connections, 'shard1')
+
+    def test_write_batch_covers_shards(self):
+        """Пачка очереди записи - транзакция и на шарде: упавшая запись
+        откатывается, побочные действия ждут фиксации"""
+        committed = []
+
+        def write(text):
+            Post.objects.create(text=text, author=self.odd)
+            transaction.on_commit(lambda: committed.append(text),
+                                  using='shard1')
+
+        def broken():
+            write('упавший')
+            raise ValueError
+
+        results = run_batch([(write, ('первый',), {}), (broken, (), {}),
+                             (lambda: list(committed), (), {})])
+        self.assertEqual([ok for ok, _ in results], [True, False, True])
+        self.assertEqual(results[2][1], [])
+        self.assertEqual(committed, ['первый'])
+        self.assertEqual(
+            set(Post.objects.using('shard1').values_list('text', flat=True)),
+            {'пост 1', 'пост 3', 'первый'}
+        )
+
+    def test_posts_split_between_databases(self):
+        """Посты действительно лежат в разных базах"""
+        self.assertEqual(self.remote._state.db, 'shard1')
+        self.assertEqual(Post.objects.using('default').count(), 2)
+        self.assertEqual(Post.objects.using('shard1').count(), 2)
+
+    def test_api_reads_all_shards(self):
+        """API отдаёт ленты, пост и комментарии с обоих шардов"""
+        expected = [post.id for post in reversed(self.posts)]
+        for url in [reverse('api_posts'),
+                    reverse('api_group_posts', args=[self.group.slug])]:
+            with self.subTest(url=url):
+                results = json.loads(read(self.client.get(url)))['results']
+                self.assertEqual([post['id'] for post in results],
+                                 expected)
+        data = json.loads(read(self.client.get(
+            reverse('api_post', args=[self.remote.id])
+        )))
+        self.assertEqual(data['post']['comments_count'], 1)
+        self.assertEqual(data['comments']['results'][0]['text'],
+                         'комментарий')
+        results = json.loads(read(self.client.get(
+            reverse('api_profile_posts', args=[self.odd.username])
+        )))['results']
+        self.assertEqual([post['id'] for post in results],
+                         [self.remote.id, self.posts[1].id])
+
+    def test_feeds_sitemaps_and_events_read_all_shards(self):
+        """RSS, карта сайта и события видят посты второго шарда"""
+        rss = self.client.get(reverse('group_rss', args=[self.group.slug]))
+        self.assertIn(f'/odd/{self.remote.id}/', rss.content.decode())
+        chunk = reverse('sitemap_chunk',
+                        args=['posts', chunk_of('posts', self.remote.id)])
+        self.assertIn(chunk, self.client.get(reverse('sitemap'))
+                      .content.decode())
+        self.assertIn(f'/odd/{self.remote.id}/',
+                      read(self.client.get(chunk)))
+        posts = [json.loads(data)['id']
+                 for _, (_, name, data) in load_events(0) if name == 'post']
+        self.assertIn(self.remote.id, posts)
+
+    def test_export_reads_all_shards(self):
+        """Статическая выгрузка сохраняет посты второго шарда"""
+        output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output)
+        call_command('export_static', '--output', output, stdout=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(
+            output, 'odd', str(self.remote.id), 'index.html'
+        )))
+
+    def move(self, username='odd', alias='default'):
+        call_command('move_author', username, alias, stdout=StringIO())
+
+    def odd_rows(self, alias):
+        return (set(Post.objects.using(alias).filter(author=self.odd)
+                    .values_list('id', flat=True)),
+                Comment.objects.using(alias).filter(post=self.remote).count())
+
+    @override_settings(PURGE_BACKEND='posts.purge.LocalPurgeBackend')
+    def test_move_author(self):
+        """Перенос автора: строки на новом шарде, запись в журнале и сброс
+        его страниц в прокси"""
+        expected = self.odd_rows('shard1')
+        self.move()
+        self.assertEqual(self.odd_rows('default'), expected)
+        self.assertEqual(self.odd_rows('shard1'), (set(), 0))
+        self.assertEqual(shard_for(self.odd.id), 'default')
+        self.assertTrue(ChangeLog.objects.filter(kind=ChangeLog.USER,
+                                                 author_id=self.odd.id)
+                        .exists())
+        purged = get_backend('posts.purge.LocalPurgeBackend').purged[-1]
+        self.assertIn(author_key(self.odd.id), purged)
+        self.assertIn(post_key(self.remote.id), purged)
+
+    def test_move_author_resumes(self):
+        """Перенос, прерванный после переключения шарда, повторный запуск
+        доводит до конца без повторного копирования"""
+        expected = self.odd_rows('shard1')
+        with mock.patch('posts.management.commands.move_author'
+                        '.delete_author_rows', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.move()
+        self.assertEqual(shard_for(self.odd.id), 'default')
+        self.move()
+        self.assertEqual(self.odd_rows('default'), expected)
+        self.assertEqual(self.odd_rows('shard1'), (set(), 0))
+
+    def test_move_author_keeps_source_without_copy(self):
+        """Если копии на новом шарде нет, исходные строки не удаляются и
+        автор остаётся на прежнем шарде"""
+        expected = self.odd_rows('shard1')
+        with mock.patch.object(MoveAuthor, 'copy'):
+            with self.assertRaises(CommandError):
+                self.move()
+        self.assertEqual(self.odd_rows('shard1'), expected)
+        self.assertEqual(shard_for(self.odd.id), 'shard1')
@@ -0,0 +1,125 @@
+import re
+
+from django.core.cache import cache
+from django.test import Client, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Group, Post, User
+from posts.sitemaps import chunk_of
+
+
+@override_settings(SITEMAP_CHUNK_SIZE=2)
+class SitemapTests(TransactionTestCase):
+    def setUp(self):
+        self.group = Group.objects.create(title="Тест-название",
+                                          slug='test_slug',
+                                          description="Тест-описание")
+        self.author = User.objects.create_user(username='test_user')
+        # пост с id, выданным ещё до posts.ids
+        self.old_post = Post.objects.create(
+            id=7, text='старый пост', group=self.group, author=self.author
+        )
+        self.posts = [Post.objects.create(text=f'пост номер {i}',
+                                          group=self.group,
+                                          author=self.author)
+                      for i in range(5)]
+        cache.clear()
+        self.guest_client = Client()
+
+    def chunk(self, section, number):
+        response = self.guest_client.get(
+            reverse('sitemap_chunk', args=[section, number])
+        )
+        if response.streaming:
+            return b''.join(response.streaming_content).decode()
+        return response.content.decode()
+
+    def index(self):
+        return self.guest_client.get(reverse('sitemap')).content.decode()
+
+    def test_index_lists_chunks(self):
+        """Индекс ссылается на все непустые порции разделов, в порции не
+        больше SITEMAP_CHUNK_SIZE адресов"""
+        content = self.index()
+        numbers = re.findall(r'sitemap-posts-(\d+)\.xml', content)
+        self.assertEqual(numbers, ['0', '1', '2'])
+        self.assertEqual(chunk_of('posts', self.old_post.id), 0)
+        for number in numbers:
+            with self.subTest(number=number):
+                self.assertEqual(self.chunk('posts', number)
+                                 .count('<url>'), 2)
+        self.assertIn(
+            f'sitemap-profiles-{chunk_of("profiles", self.author.id)}.xml',
+            content
+        )
+
+    def test_new_chunk_opens_when_last_is_full(self):
+        """Новая порция открывается, только когда последняя заполнена"""
+        self.index()
+        post = Post.objects.create(text='ещё пост', author=self.author)
+        content = self.index()
+        self.assertEqual(chunk_of('posts', post.id), 3)
+        self.assertIn('sitemap-posts-3.xml', content)
+        self.assertIn(reverse('post', args=[self.author.username, post.id]),
+                      self.chunk('posts', 3))
+        self.assertNotIn(str(post.id), self.chunk('posts', 2))
+
+    def test_index_cached_until_changed(self):
+        """Индекс читается из кэша, пока посты не изменились"""
+        content = self.index()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index(), content)
+        Post.objects.create(text='ещё пост', author=self.author)
+        self.assertNotEqual(self.index(), content)
+
+    def test_index_skips_empty_chunks(self):
+        """Порции пользователей без постов в индекс не попадают"""
+        for i in range(4):
+            User.objects.create_user(username=f'reader_{i}')
+        self.assertEqual(self.index().count('sitemap-profiles-'), 1)
+
+    def test_chunk_contains_its_posts(self):
+        """Порция содержит посты своего диапазона id с lastmod"""
+        self.index()
+        post = self.posts[0]
+        content = self.chunk('posts', chunk_of('posts', post.id))
+        self.assertIn(reverse('post', args=[self.author.username, post.id]),
+                      content)
+        self.assertIn('<lastmod>', content)
+        self.assertIn(reverse('profile', args=[self.author.username]),
+                      self.chunk('profiles',
+                                 chunk_of('profiles', self.author.id)))
+        self.assertIn(reverse('group_posts', args=[self.group.slug]),
+                      self.chunk('groups', chunk_of('groups',
+                                                    self.group.id)))
+
+    def test_only_changed_chunk_is_rebuilt(self):
+        """После правки поста строится заново только его порция"""
+        self.index()
+        first, last = self.old_post, self.posts[-1]
+        first_chunk = chunk_of('posts', first.id)
+        last_chunk = chunk_of('posts', last.id)
+        self.chunk('posts', first_chunk)
+        self.chunk('posts', last_chunk)
+        last.text = 'исправленный пост'
+        last.save()
+        with self.assertNumQueries(0):
+            self.chunk('posts', first_chunk)
+        # журнал правок, рабочие и архивные посты
+        with self.assertNumQueries(3):
+            self.chunk('posts', last_chunk)
+
+    def test_missing_chunk(self):
+        """Порции, которой нет, - ошибка 404"""
+        self.index()
+        response = self.guest_client.get(
+            reverse('sitemap_chunk', args=['posts', 9])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_section(self):
+        """Неизвестный раздел - ошибка 404"""
+        response = self.guest_client.get(
+            reverse('sitemap_chunk', args=['secret', 0])
+        )
+        self.assertEqual(response.status_code, 404)
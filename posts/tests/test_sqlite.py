@@ -0,0 +1,25 @@
+from django.db import connection
+from django.test import TestCase
+
+from yatube.sqlite import check_connections
+
+
+class SqliteTuningTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied(self):
+        """PRAGMA из настроек применены к соединению"""
+        pragmas = {'synchronous': 1, 'temp_store': 2, 'busy_timeout': 5000,
+                   'cache_size': -64 * 1024}
+        for name, value in pragmas.items():
+            with self.subTest(pragma=name):
+                self.assertEqual(self.pragma(name), value)
+
+    def test_healthy_connection_kept(self):
+        """Проверка перед запросом не закрывает рабочее соединение"""
+        raw = connection.connection
+        check_connections(sender=self.__class__)
+        self.assertIs(connection.connection, raw)
@@ -0,0 +1,55 @@
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Follow, Group, Post, User
+from posts.streaming import STREAM_MARKER
+from yatube.settings import POSTS_ON_PAGE
+
+
+@override_settings(STREAMING_FEEDS=True, STREAM_CHUNK_SIZE=3)
+class StreamingFeedsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title="Тест-название",
+                                         slug='test_slug',
+                                         description="Тест-описание")
+        cls.author = User.objects.create_user(username='test_user')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(POSTS_ON_PAGE + 2):
+            Post.objects.create(text=f'пост номер {i}', group=cls.group,
+                                author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_feeds_are_streamed(self):
+        """Ленты отдаются потоком: шапка, посты, паджинатор"""
+        urls = [reverse('index'),
+                reverse('group_posts', args=[self.group.slug]),
+                reverse('profile', args=[self.author.username]),
+                reverse('follow_index')]
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.authorized_client.get(url)
+                self.assertTrue(response.streaming)
+                chunks = [chunk.decode()
+                          for chunk in response.streaming_content]
+                self.assertIn('<nav', chunks[0])
+                self.assertNotIn('пост номер', chunks[0])
+                content = ''.join(chunks)
+                self.assertNotIn(STREAM_MARKER, content)
+                self.assertIn('пост номер 11', content)
+                self.assertIn('class="pagination"', content)
+
+    def test_page_is_streamed_in_chunks(self):
+        """Посты страницы выводятся порциями"""
+        response = self.authorized_client.get(reverse('index'))
+        chunks = list(response.streaming_content)
+        # шапка, четыре порции по три поста, паджинатор и хвост страницы
+        self.assertEqual(len(chunks), 7)
+        content = b''.join(chunks).decode()
+        self.assertEqual(content.count('card mb-3'), POSTS_ON_PAGE)
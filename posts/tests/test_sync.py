@@ -0,0 +1,111 @@
+import json
+
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import ChangeLog, Comment, Follow, Group, Post, User
+
+FOLLOW_CHANGES = reverse('api_follow_changes')
+
+
+class SyncApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(title="Тест-название",
+                                         slug='test_slug',
+                                         description="Тест-описание")
+        cls.other_group = Group.objects.create(title="Другая группа",
+                                               slug='other',
+                                               description="Тест-описание")
+        cls.author = User.objects.create_user(username='test_user')
+        cls.stranger = User.objects.create_user(username='stranger')
+        cls.reader = User.objects.create_user(username='IvanovI')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        cls.post = Post.objects.create(text='старый пост', group=cls.group,
+                                       author=cls.author)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+        self.group_changes = reverse('api_group_changes',
+                                     args=[self.group.slug])
+
+    def sync(self, url, token=None):
+        params = {'token': token} if token else {}
+        return json.loads(self.authorized_client.get(url, params).content)
+
+    def test_without_token_resets(self):
+        """Без токена клиент получает reset и текущий токен"""
+        data = self.sync(FOLLOW_CHANGES)
+        self.assertTrue(data['reset'])
+        self.assertEqual(self.sync(FOLLOW_CHANGES, data['token'])['posts'],
+                         [])
+
+    def test_posts_edits_and_deletions(self):
+        """Новые, изменённые и удалённые посты приходят одним ответом"""
+        token = self.sync(FOLLOW_CHANGES)['token']
+        new = Post.objects.create(text='новый пост', author=self.author)
+        Post.objects.create(text='чужой пост', author=self.stranger)
+        removed_id = Post.objects.create(text='удалю', author=self.author).id
+        self.post.text = 'исправленный пост'
+        self.post.save()
+        Post.objects.get(pk=removed_id).delete()
+        data = self.sync(FOLLOW_CHANGES, token)
+        self.assertFalse(data['reset'])
+        self.assertEqual([post['id'] for post in data['posts']],
+                         [new.id, self.post.id])
+        self.assertEqual(data['posts'][1]['text'], 'исправленный пост')
+        self.assertEqual(data['deleted'], [removed_id])
+        self.assertEqual(self.sync(FOLLOW_CHANGES, data['token'])['posts'],
+                         [])
+
+    def test_comment_counts(self):
+        """Новый комментарий меняет только счётчик комментариев поста"""
+        token = self.sync(self.group_changes)['token']
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='комментарий')
+        data = self.sync(self.group_changes, token)
+        self.assertEqual(data['posts'], [])
+        self.assertEqual(data['comment_counts'],
+                         [{'id': self.post.id, 'comments_count': 1}])
+
+    def test_post_leaves_group(self):
+        """Пост, перенесённый в другую группу, для старой группы удалён"""
+        token = self.sync(self.group_changes)['token']
+        self.post.group = self.other_group
+        self.post.save()
+        data = self.sync(self.group_changes, token)
+        self.assertEqual(data['deleted'], [self.post.id])
+        follow_data = self.sync(FOLLOW_CHANGES, token)
+        self.assertEqual(follow_data['deleted'], [])
+        self.assertEqual(follow_data['posts'][0]['group'], 'other')
+
+    def test_follow_and_unfollow(self):
+        """Подписка приносит последние посты автора, отписка - его имя"""
+        stranger_post = Post.objects.create(text='пост', author=self.stranger)
+        token = self.sync(FOLLOW_CHANGES)['token']
+        Follow.objects.create(user=self.reader, author=self.stranger)
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        data = self.sync(FOLLOW_CHANGES, token)
+        self.assertEqual(data['followed'], ['stranger'])
+        self.assertEqual(data['unfollowed'], ['test_user'])
+        self.assertEqual([post['id'] for post in data['posts']],
+                         [stranger_post.id])
+
+    def test_post_deletion_is_logged_once(self):
+        """Удаление поста с комментариями пишет в журнал одну запись"""
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='комментарий')
+        last = ChangeLog.objects.last().id
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(list(ChangeLog.objects.filter(id__gt=last)
+                              .values_list('kind', flat=True)),
+                         [ChangeLog.POST_DELETED])
+
+    def test_too_many_changes_resets(self):
+        """При переполнении окна изменений клиент получает reset"""
+        token = self.sync(FOLLOW_CHANGES)['token']
+        Post.objects.create(text='1', author=self.author)
+        Post.objects.create(text='2', author=self.author)
+        with self.settings(SYNC_MAX_CHANGES=1):
+            self.assertTrue(self.sync(FOLLOW_CHANGES, token)['reset'])
@@ -0,0 +1,186 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from posts.counters import INDEX_FEED, feed_revision
+from posts.models import ChangeLog, Follow, Post, User
+from posts.writes import (WriteTimeout, metrics, record, run_batch,
+                          submit)
+
+LOCK_FILE = os.path.join(tempfile.gettempdir(), 'yatube-test-write.lock')
+METRICS_FILE = os.path.join(tempfile.gettempdir(),
+                            'yatube-test-write-metrics.json')
+
+
+def reset_metrics():
+    if os.path.exists(METRICS_FILE):
+        os.remove(METRICS_FILE)
+
+
+@override_settings(WRITE_LOCK_FILE=LOCK_FILE, WRITE_METRICS_FILE=METRICS_FILE,
+                   WRITE_RETRY_DELAY=0)
+class WriteBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+
+    def test_busy_batch_retried(self):
+        """Пачка повторяется, если база занята"""
+        calls = []
+
+        def write():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return 'ok'
+
+        self.assertEqual(run_batch([(write, (), {})]), [(True, 'ok')])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(metrics()['retries'], 1)
+
+    def test_failed_write_does_not_break_batch(self):
+        """Ошибка одной записи не откатывает остальные записи пачки"""
+        def broken():
+            User.objects.create(username='broken')
+            raise ValueError
+
+        results = run_batch([
+            (User.objects.create, (), {'username': 'first'}),
+            (broken, (), {}),
+            (User.objects.create, (), {'username': 'second'}),
+        ])
+        self.assertEqual([ok for ok, _ in results], [True, False, True])
+        self.assertIsInstance(results[1][1], ValueError)
+        self.assertEqual(
+            set(User.objects.values_list('username', flat=True)),
+            {'first', 'second'}
+        )
+
+    def test_submit_inside_transaction_runs_inline(self):
+        """Внутри открытой транзакции запись выполняется сразу"""
+        user = submit(User.objects.create, username='inline')
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+        self.assertEqual(metrics()['writes'], 0)
+
+    def test_metrics_shared_between_processes(self):
+        """Метрики, записанные потоками процесса, видит write_stats в
+        другом процессе; наибольшее ожидание не теряется при гонке"""
+        def write(number):
+            for _ in range(20):
+                record({'lock_wait_max_ms': number}, lock_wait_ms=number)
+
+        threads = [threading.Thread(target=write, args=[number])
+                   for number in range(1, 6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics()['lock_wait_ms'], 20 * 15)
+        output = subprocess.run(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'),
+             'write_stats'],
+            env={**os.environ, 'WRITE_METRICS_FILE': METRICS_FILE},
+            stdout=subprocess.PIPE, check=True, universal_newlines=True
+        ).stdout
+        self.assertIn(f"{'lock_wait_ms':<18}{300:>12}", output)
+        self.assertIn(f"{'lock_wait_max_ms':<18}{5:>12}", output)
+
+
+@override_settings(WRITE_LOCK_FILE=LOCK_FILE, WRITE_METRICS_FILE=METRICS_FILE,
+                   WRITE_RETRY_DELAY=0)
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        self.author = User.objects.create_user(username='author')
+        self.readers = [User.objects.create_user(username=f'reader{i}')
+                        for i in range(10)]
+
+    def test_concurrent_writes_serialized(self):
+        """Параллельные подписки проходят через очередь без потерь"""
+        errors = []
+
+        def follow(user):
+            try:
+                submit(Follow.objects.get_or_create, user=user,
+                       author=self.author)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=follow, args=[user])
+                   for user in self.readers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Follow.objects.filter(author=self.author).count(),
+                         len(self.readers))
+        stats = metrics()
+        self.assertEqual(stats['writes'], len(self.readers))
+        self.assertLessEqual(stats['batches'], len(self.readers))
+
+    def test_view_write_goes_through_queue(self):
+        """Вьюха подписки пишет через очередь и видит результат"""
+        self.client.force_login(self.readers[0])
+        self.client.post(reverse('profile_follow',
+                                 args=[self.author.username]))
+        self.assertTrue(Follow.objects.filter(user=self.readers[0],
+                                              author=self.author).exists())
+        self.assertEqual(metrics()['writes'], 1)
+
+    def test_write_error_reaches_caller(self):
+        """Ошибка записи возвращается вызвавшему потоку"""
+        with self.assertRaises(ValueError):
+            submit(int, 'не число')
+
+    def test_retry_does_not_repeat_side_effects(self):
+        """Повтор пачки не поднимает ревизии лент второй раз"""
+        revision = feed_revision(INDEX_FEED)
+        calls = []
+
+        def write():
+            Post.objects.create(text='пост', author=self.author)
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+
+        run_batch([(write, (), {})])
+        self.assertEqual(len(calls), 2)
+        change = ChangeLog.objects.get(kind=ChangeLog.POST, id__gt=revision)
+        self.assertEqual(feed_revision(INDEX_FEED), change.id)
+
+    @override_settings(WRITE_RESULT_TIMEOUT=0.2)
+    def test_waiting_write_times_out(self):
+        """Запись, не дождавшаяся писателя, отменяется с WriteTimeout"""
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+
+        def block():
+            # вызвавший тоже не дождётся, но запись уже выполняется
+            with self.assertRaises(WriteTimeout):
+                submit(slow)
+
+        blocker = threading.Thread(target=block)
+        blocker.start()
+        started.wait(5)
+        with self.assertRaises(WriteTimeout):
+            submit(User.objects.create, username='late')
+        release.set()
+        blocker.join()
+        # писатель жив, отменённая запись не выполнена
+        time.sleep(0.1)
+        self.assertEqual(submit(int, '1'), 1)
+        self.assertFalse(User.objects.filter(username='late').exists())
@@ -1,19 +1,32 @@
 from django.urls import path
 
-from . import views
+from . import feeds, views
 
 urlpatterns = [
     path('404/', views.page_not_found),
     path('500/', views.server_error),
     path('new/', views.new_post, name='new_post'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('fragments/index/', views.index_fragment, name='index_fragment'),
+    path('fragments/follow/', views.follow_fragment,
+         name='follow_fragment'),
     path('group/<slug:slug>/', views.group_posts,
          name='group_posts'),
+    path('group/<slug:slug>/rss/', feeds.group_rss, name='group_rss'),
+    path('group/<slug:slug>/atom/', feeds.group_atom, name='group_atom'),
     path('<str:username>/', views.profile, name='profile'),
+    path('<str:username>/rss/', feeds.profile_rss, name='profile_rss'),
+    path('<str:username>/atom/', feeds.profile_atom, name='profile_atom'),
     path('<str:username>/<int:post_id>/edit/',
          views.post_edit, name='post_edit'),
     path('<str:username>/<int:post_id>/', views.post_view,
          name='post'),
+    path('<str:username>/<int:post_id>/comments/',
+         views.post_comments,
+         name='post_comments'),
+    path('<str:username>/<int:post_id>/comments/<int:comment_id>/replies/',
+         views.comment_replies,
+         name='comment_replies'),
     path('<str:username>/<int:post_id>/comment/',
          views.add_comment,
          name='add_comment'),
@@ -1,37 +1,156 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.db.models import Count
+from django.db.models.functions import Substr
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.urls import reverse
 
-from yatube.settings import POSTS_ON_PAGE, POSTS_ON_PROFILE_PAGE
+from yatube.replicas import replica_reads
+from yatube.settings import (COMMENT_THREAD_DEPTH, COMMENTS_ON_PAGE,
+                             POSTS_ON_PAGE, POSTS_ON_PROFILE_PAGE)
 
+from . import counters
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post, User
+from .models import (PATH_SEGMENT_LENGTH, ArchivedComment, ArchivedPost,
+                     Comment, Follow, Group, Post, User, path_upper_bound)
+from .pagination import UnionFeed, keyset_page
+from .purge import INDEX_KEY, author_key, group_key, post_key, tag
+from .shards import ShardedFeed, sharded, sharding_enabled, shards_of
+from .streaming import render_feed
+from .writes import submit
 
 NEW_POST_SUBMIT_TITLE = "Добавить запись"
 NEW_POST_SUBMIT_BUTTON = "Добавить"
 EDIT_POST_SUBMIT_TITLE = "Изменить запись"
 EDIT_POST_SUBMIT_BUTTON = "Сохранить"
+# id постов и комментариев растут со временем (posts.ids)
+COMMENTS_ORDERING = ("id",)
+FEED_ORDERING = ("-id",)
 
 
-def index(request):
-    post_list = Post.objects.all().select_related('group')
-    paginator = Paginator(post_list, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request,
-        'index.html',
-        {'page': page, }
+def feed_posts():
+    """Общая лента: посты вместе с авторами и группами для карточек."""
+    return Post.objects.select_related('author', 'group')
+
+
+def following_queryset(user):
+    """Посты авторов, на которых подписан user, и шарды, где они лежат
+    (None - без шардирования)."""
+    if not sharding_enabled():
+        return feed_posts().filter(author__following__user=user), None
+    # подписки лежат в default, посты - на шардах авторов
+    authors = list(user.follower.values_list('author_id', flat=True))
+    return feed_posts().filter(author_id__in=authors), shards_of(authors)
+
+
+def following_posts(user):
+    queryset, aliases = following_queryset(user)
+    return sharded(queryset, FEED_ORDERING, aliases)
+
+
+def wants_json(request):
+    return (request.GET.get('format') == 'json'
+            or 'application/json' in request.META.get('HTTP_ACCEPT', ''))
+
+
+def wants_fragment(request):
+    """Действие вызвано из JS и ждёт фрагмент вместо редиректа."""
+    return request.method == 'POST' and (request.is_ajax()
+                                         or wants_json(request))
+
+
+def attach_replies(post, comments):
+    """Подгружает к comments по COMMENT_THREAD_DEPTH уровней ответов.
+
+    Все ветки приходят одним диапазонным запросом по path в порядке обхода
+    дерева. Ответы нижнего уровня получают hidden_replies - число скрытых
+    под ними ответов, которые подгружаются по ссылке.
+    """
+    comments = list(comments)
+    if not comments:
+        return
+    paths = [comment.path for comment in comments]
+    depth = comments[0].depth
+    last_depth = depth + COMMENT_THREAD_DEPTH
+    in_threads = post.comments.filter(
+        path__gte=min(paths),
+        path__lt=path_upper_bound(max(paths)),
     )
+    replies = (in_threads.filter(depth__gt=depth, depth__lte=last_depth)
+               .select_related("author").order_by("path"))
+    # всё свёрнутое поддерево ответа нижнего уровня - общий префикс пути
+    # длиной в путь этого ответа
+    hidden = dict(in_threads.filter(depth__gt=last_depth)
+                  .annotate(thread=Substr("path", 1, (last_depth + 1)
+                                          * (PATH_SEGMENT_LENGTH + 1)))
+                  .order_by().values_list("thread")
+                  .annotate(Count("id")))
+    counts = post.comments.reply_counts(paths)
+    threads = {path: [] for path in paths}
+    prefix_length = len(paths[0])
+    for reply in replies:
+        thread = threads.get(reply.path[:prefix_length])
+        if thread is not None:
+            reply.hidden_replies = hidden.get(reply.path, 0)
+            thread.append(reply)
+    for comment in comments:
+        comment.thread = threads[comment.path]
+        comment.replies_count = counts[comment.path]
+
+
+def get_comments_page(post, cursor):
+    """Очередная порция веток комментариев поста вместе с их авторами."""
+    comments = post.comments.roots().select_related("author")
+    page = keyset_page(comments, COMMENTS_ORDERING, cursor, COMMENTS_ON_PAGE)
+    attach_replies(post, page.object_list)
+    return page
+
 
+def get_readable(models, username, related, **lookup):
+    """Объект автора username из рабочей таблицы, а если его нет - из архива.
 
+    models - пара (модель, архивная модель), related - аргументы
+    select_related, lookup - условия выборки.
+    """
+    for model in models:
+        # get() без сортировки: first() добавил бы ORDER BY к выборке по id
+        try:
+            return (model.objects.for_username(username)
+                    .select_related(*related).get(**lookup))
+        except model.DoesNotExist:
+            pass
+    raise Http404
+
+
+def get_parent_comment(request, post):
+    parent_id = request.POST.get("parent") or request.GET.get("parent")
+    if not parent_id or not parent_id.isdigit():
+        return None
+    return get_object_or_404(post.comments, id=parent_id)
+
+
+@replica_reads
+def index(request):
+    context = {'new_posts_url': reverse('api_posts_new'),
+               'feed_version': counters.index_version()}
+    return tag(render_feed(request, 'index.html', context,
+                           sharded(feed_posts(), FEED_ORDERING),
+                           POSTS_ON_PAGE, reverse('index_fragment')),
+               INDEX_KEY)
+
+
+@replica_reads
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(request, "group.html", {"group": group, "page": page})
+    post_list = sharded(feed_posts().filter(group=group), FEED_ORDERING)
+    context = {"group": group}
+    if settings.SSE_URL:
+        context["events_url"] = f"{settings.SSE_URL}group/{slug}/"
+    return tag(render_feed(request, "group.html", context,
+                           post_list, POSTS_ON_PAGE),
+               group_key(group.id))
 
 
 @login_required
@@ -44,59 +163,68 @@ def new_post(request):
                                    "submit": NEW_POST_SUBMIT_BUTTON})
     post = form.save(commit=False)
     post.author = request.user
-    form.save()
+    submit(form.save)
     return redirect("index")
 
 
+@replica_reads
 def profile(request, username):
     author = get_object_or_404(User, username=username)
     # posts = Post.objects.filter(author=author)
-    posts = author.posts.all()
-    paginator = Paginator(posts, POSTS_ON_PROFILE_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    # рабочие и архивные посты автора лежат на одном шарде
+    posts = UnionFeed(
+        [feed_posts().on_shard_of(author.id).filter(author=author),
+         (ArchivedPost.objects.on_shard_of(author.id).filter(author=author)
+          .select_related("author", "group"))],
+        FEED_ORDERING
+    )
     following = (request.user.is_authenticated
                  and Follow.objects.filter(user=request.user,
                                            author=author).exists())
     followers = author.following.all()
     followings = author.follower.all()
-    return render(request, 'profile.html', {'author': author,
-                                            'page': page,
-                                            'following': following,
-                                            'followers': followers,
-                                            'followings': followings
-                                            }
-                  )
+    response = render_feed(request, 'profile.html',
+                           {'author': author,
+                            'following': following,
+                            'followers': followers,
+                            'followings': followings},
+                           posts, POSTS_ON_PROFILE_PAGE)
+    return tag(response, author_key(author.id))
 
 
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_readable((Post, ArchivedPost), username, ("author", "group"),
+                        id=post_id)
     form = CommentForm(request.POST or None)
-    if form.is_valid():
+    # архивный пост только читается
+    if form.is_valid() and not post.archived:
         new_comment = form.save(commit=False)
         new_comment.author = request.user
         new_comment.post = post
-        new_comment.save()
-    comments = post.comments.all()
+        submit(new_comment.save)
+    comments_page = get_comments_page(post, request.GET.get("cursor"))
     context = {
         'post': post,
         'author': post.author,
         'form': form,
-        'comments': comments,
+        'comments': comments_page.object_list,
+        'comments_page': comments_page,
     }
-    return render(request, 'post.html', context)
+    return tag(render(request, 'post.html', context),
+               post_key(post.id), author_key(post.author_id))
 
 
 @login_required
 def post_edit(request, username, post_id):
     if username != request.user.username:
         return redirect('post', username=username, post_id=post_id)
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    post = get_object_or_404(Post.objects.for_username(username),
+                             pk=post_id)
     form = PostForm(instance=post,
                     data=request.POST or None,
                     files=request.FILES or None)
     if form.is_valid():
-        form.save()
+        submit(form.save)
         return redirect('post', username=username, post_id=post_id)
     return render(request, 'new.html', {'form': form,
                                         'post': post,
@@ -106,22 +234,58 @@ def post_edit(request, username, post_id):
 
 @login_required
 def add_comment(request, username, post_id):
-    post = get_object_or_404(Post, author__username=username, id=post_id)
+    post = get_object_or_404(Post.objects.for_username(username),
+                             id=post_id)
+    parent = get_parent_comment(request, post)
     form = CommentForm(request.POST or None)
+    if not form.is_valid() and wants_fragment(request):
+        return JsonResponse({'errors': form.errors}, status=400)
     if not form.is_valid():
-        comments = Comment.objects.filter(post_id=post_id)
+        comments_page = get_comments_page(post, request.GET.get("cursor"))
         return render(
             request, "comments.html", {"form": form,
-                                       "comments": comments
+                                       "post": post,
+                                       "parent": parent,
+                                       "comments": comments_page.object_list,
+                                       "comments_page": comments_page
                                        }
         )
     comment = form.save(commit=False)
     comment.author = request.user
     comment.post = post
-    form.save()
+    comment.parent = parent
+    submit(form.save)
+    if wants_fragment(request):
+        html = render_to_string('includes/comment_item.html',
+                                {'post': post, 'comment': comment}, request)
+        if wants_json(request):
+            return JsonResponse({'id': comment.id, 'html': html}, status=201)
+        return HttpResponse(html, status=201)
     return redirect('post', username=username, post_id=post_id)
 
 
+def post_comments(request, username, post_id):
+    """Фрагмент со следующей порцией комментариев для кнопки «Показать ещё»."""
+    post = get_readable((Post, ArchivedPost), username, ("author",),
+                        id=post_id)
+    comments_page = get_comments_page(post, request.GET.get("cursor"))
+    return tag(render(request, "includes/comment_list.html",
+                      {"post": post,
+                       "comments": comments_page.object_list,
+                       "comments_page": comments_page}),
+               post_key(post.id))
+
+
+def comment_replies(request, username, post_id, comment_id):
+    """Фрагмент со свёрнутой частью ветки под комментарием comment_id."""
+    comment = get_readable((Comment, ArchivedComment), username,
+                           ("post__author",), id=comment_id, post_id=post_id)
+    attach_replies(comment.post, [comment])
+    return tag(render(request, "includes/comment_replies.html",
+                      {"post": comment.post, "comment": comment}),
+               post_key(post_id))
+
+
 def page_not_found(request, exception):
     return render(
         request,
@@ -136,24 +300,69 @@ def server_error(request):
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
-    return render(
-        request,
-        'follow.html',
-        {'page': page,
-         }
-    )
+    authors = request.user.follower.values_list('author_id', flat=True)
+    context = {'new_posts_url': reverse('api_follow_posts_new'),
+               'feed_version': counters.feeds_version(
+                   counters.follow_feeds(request.user.id, authors))}
+    return render_feed(request, 'follow.html', context,
+                       following_posts(request.user), POSTS_ON_PAGE,
+                       reverse('follow_fragment'))
+
+
+def render_feed_fragment(request, post_list):
+    """Следующая порция карточек ленты после курсора для бесконечной ленты.
+
+    HTML-вариант передаёт курсор в заголовке X-Next-Cursor, JSON-вариант
+    (?format=json или Accept: application/json) - в поле next_cursor.
+    """
+    cursor = request.GET.get('cursor')
+    if isinstance(post_list, ShardedFeed):
+        page = post_list.keyset_page(cursor, POSTS_ON_PAGE)
+    else:
+        page = keyset_page(post_list, FEED_ORDERING, cursor, POSTS_ON_PAGE)
+    html = render_to_string('includes/post_list.html', {'page': page},
+                            request)
+    if wants_json(request):
+        return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+    response = HttpResponse(html)
+    if page.has_next:
+        response['X-Next-Cursor'] = page.next_cursor
+    return response
+
+
+@replica_reads
+def index_fragment(request):
+    return tag(render_feed_fragment(request,
+                                    sharded(feed_posts(), FEED_ORDERING)),
+               INDEX_KEY)
+
+
+@login_required
+@replica_reads
+def follow_fragment(request):
+    return render_feed_fragment(request, following_posts(request.user))
+
+
+def follow_state(request, author):
+    """Ответ на подписку из JS: новое состояние и счётчики профиля."""
+    return JsonResponse({
+        'following': Follow.objects.filter(user=request.user,
+                                           author=author).exists(),
+        'followers': author.following.count(),
+        'followings': author.follower.count(),
+    })
 
 
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        Follow.objects.get_or_create(user=request.user, author=author)
+        submit(Follow.objects.get_or_create, user=request.user,
+               author=author)
+    if wants_fragment(request):
+        return follow_state(request, author)
     return redirect('profile', username=username)
 
 
@@ -161,6 +370,9 @@ def profile_follow(request, username):
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author:
-        get_object_or_404(Follow, user=request.user,
-                          author=author).delete()
+        follow = get_object_or_404(Follow, user=request.user,
+                                   author=author)
+        submit(follow.delete)
+    if wants_fragment(request):
+        return follow_state(request, author)
     return redirect('profile', username=username)
@@ -0,0 +1,245 @@
+"""Очередь записи в SQLite.
+
+SQLite допускает одного писателя, поэтому записи из вьюх идут через
+WriteQueue: поток-писатель процесса забирает из ограниченной очереди до
+WRITE_BATCH_SIZE записей и выполняет их одной транзакцией, каждую в своей
+точке сохранения. Писателей разных процессов разводит файловая
+блокировка, а если база всё же занята (SQLITE_BUSY), транзакция
+повторяется после паузы со случайным разбросом. Время ожидания
+блокировки, повторы и размеры пачек копятся в файле WRITE_METRICS_FILE,
+общем для всех процессов (manage.py write_stats).
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import (OperationalError, close_old_connections, connections,
+                       transaction)
+
+from yatube.replicas import mark_write
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - нет на Windows
+    fcntl = None
+
+METRICS = ('batches', 'writes', 'retries', 'lock_wait_ms',
+           'lock_wait_max_ms')
+
+
+class WriteQueueFull(Exception):
+    """Очередь записи не освободилась за WRITE_QUEUE_TIMEOUT."""
+
+
+class WriteTimeout(Exception):
+    """Запись не выполнена за WRITE_RESULT_TIMEOUT."""
+
+
+def is_busy(error):
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+@contextmanager
+def metrics_file(operation):
+    """Файл метрик под файловой блокировкой operation (LOCK_SH/LOCK_EX)."""
+    descriptor = os.open(settings.WRITE_METRICS_FILE,
+                         os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(descriptor, 'r+') as file:
+        if fcntl is not None:
+            fcntl.flock(file, getattr(fcntl, operation))
+        try:
+            yield file
+        finally:
+            # записанное попадает в файл до снятия блокировки
+            file.flush()
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def read_metrics(file):
+    file.seek(0)
+    try:
+        return json.loads(file.read() or '{}')
+    except ValueError:
+        # файл испорчен: счёт начинается заново
+        return {}
+
+
+def record(maximums=None, **counts):
+    """Прибавляет counts к счётчикам и поднимает наибольшие значения
+    maximums; чтение и запись файла идут под одной блокировкой, так что
+    процессы не теряют обновлений друг друга."""
+    with metrics_file('LOCK_EX') as file:
+        stats = read_metrics(file)
+        for name, value in counts.items():
+            stats[name] = stats.get(name, 0) + value
+        for name, value in (maximums or {}).items():
+            stats[name] = max(stats.get(name, 0), value)
+        file.seek(0)
+        file.truncate()
+        json.dump(stats, file)
+
+
+def metrics():
+    with metrics_file('LOCK_SH') as file:
+        stats = read_metrics(file)
+    return {name: stats.get(name, 0) for name in METRICS}
+
+
+@contextmanager
+def writer_lock():
+    """Блокировка писателя на все процессы, работающие с этой базой."""
+    if fcntl is None:
+        yield
+        return
+    with open(settings.WRITE_LOCK_FILE, 'a') as lock:
+        start = time.monotonic()
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        waited = int((time.monotonic() - start) * 1000)
+        record({'lock_wait_max_ms': waited}, lock_wait_ms=waited)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def atomic(aliases):
+    """transaction.atomic сразу во всех базах aliases: записи постов и
+    комментариев роутер шардов отправляет в базу автора."""
+    stack = ExitStack()
+    for alias in aliases:
+        stack.enter_context(transaction.atomic(using=alias))
+    return stack
+
+
+def run_item(func, args, kwargs, aliases):
+    """Одна запись в своих точках сохранения: (успех, результат/ошибка)."""
+    try:
+        with atomic(aliases):
+            return True, func(*args, **kwargs)
+    except OperationalError as error:
+        if is_busy(error):
+            raise
+        return False, error
+    except Exception as error:
+        return False, error
+
+
+def run_batch(items, aliases=None):
+    """Выполняет записи [(func, args, kwargs)] одной транзакцией в каждой
+    из баз aliases (по умолчанию SHARD_DATABASES).
+
+    Ошибка одной записи откатывает только её точки сохранения. Транзакции
+    баз фиксируются по очереди, так что сбой посреди фиксации может
+    оставить пачку записанной не во всех базах. При
+    SQLITE_BUSY вся пачка повторяется до WRITE_RETRIES раз с паузой
+    random(0, WRITE_RETRY_DELAY * 2 ** попытка). Побочные действия записей
+    (кэш, сброс прокси) откладываются через transaction.on_commit, так что
+    повтор их не дублирует.
+    """
+    aliases = aliases or settings.SHARD_DATABASES
+    for attempt in range(settings.WRITE_RETRIES + 1):
+        try:
+            with writer_lock(), atomic(aliases):
+                return [run_item(*item, aliases) for item in items]
+        except OperationalError as error:
+            if not is_busy(error) or attempt == settings.WRITE_RETRIES:
+                raise
+            record(retries=1)
+            time.sleep(random.uniform(
+                0, settings.WRITE_RETRY_DELAY * 2 ** attempt
+            ))
+
+
+class WriteQueue:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            if self.queue is None:
+                self.queue = queue.Queue(settings.WRITE_QUEUE_SIZE)
+            self.thread = threading.Thread(target=self.work, daemon=True,
+                                           name='write-queue')
+            self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Выполняет func(*args, **kwargs) в потоке-писателе и ждёт итога.
+
+        Внутри уже открытой транзакции (ATOMIC_REQUESTS, тесты) запись
+        выполняется сразу: вынести её из транзакции нельзя. Если итога нет
+        за WRITE_RESULT_TIMEOUT, ещё не начатая запись отменяется, а
+        вызвавший получает WriteTimeout.
+        """
+        mark_write()
+        if (not settings.WRITE_QUEUE_ENABLED
+                or any(connections[alias].in_atomic_block
+                       for alias in settings.SHARD_DATABASES)):
+            return func(*args, **kwargs)
+        self.start()
+        future = Future()
+        try:
+            self.queue.put((func, args, kwargs, future),
+                           timeout=settings.WRITE_QUEUE_TIMEOUT)
+        except queue.Full:
+            raise WriteQueueFull
+        try:
+            return future.result(timeout=settings.WRITE_RESULT_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            # писатель мог упасть: следующая запись запустит новый
+            self.start()
+            raise WriteTimeout
+
+    def work(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < settings.WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.run(batch)
+            except BaseException as error:
+                # поток не должен умереть с ждущими записями
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                if not isinstance(error, Exception):
+                    raise
+
+    def run(self, batch):
+        # записи, которые вызвавший уже перестал ждать, не выполняются
+        batch = [item for item in batch
+                 if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        close_old_connections()
+        try:
+            results = run_batch([item[:3] for item in batch])
+        except Exception as error:
+            for *_, future in batch:
+                future.set_exception(error)
+            return
+        record(batches=1, writes=len(batch))
+        for (*_, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+writes = WriteQueue()
+submit = writes.submit
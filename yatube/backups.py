@@ -0,0 +1,254 @@
+"""Резервные копии баз SQLite на ходу.
+
+Копия снимается online backup API SQLite. В режиме WAL база копируется
+одним шагом, в одной читающей транзакции: чтение в WAL не задерживает
+запись, поэтому new_post и другие записи идут, пока копируется
+многогигабайтная база, а снимок соответствует началу копирования. По
+шагам копировать в WAL нельзя: любая запись другого соединения между
+шагами начинает копирование заново, и под постоянной записью оно не
+кончается. Без WAL чтение блокирует запись, поэтому копия снимается
+шагами по BACKUP_STEP_PAGES страниц с паузой BACKUP_STEP_PAUSE, и
+запись между шагами так же начинает её заново.
+
+Снимок пишется во временный файл, проверяется (quick_check) и только
+потом переименовывается в BACKUP_DIR/<база>-<время UTC>.sqlite3, при
+BACKUP_COMPRESS - сжатым в .gz. Недописанных и битых снимков в каталоге
+не бывает. Хранятся BACKUP_KEEP последних снимков каждой базы.
+
+Восстановление - тот же backup API в обратную сторону, в открытое
+соединение с базой: другие процессы увидят новое содержимое целиком
+после своей текущей транзакции. Закэшированное ими (версии и ревизии
+лент, отрисованные страницы) описывает прежнее содержимое, поэтому
+восстановление записывает в базу новое поколение кэша (GENERATION_TABLE),
+а cache_key добавляет поколение к каждому ключу: не позже чем через
+CACHE_GENERATION_CHECK_INTERVAL секунд все процессы перестают видеть
+старые записи кэша.
+"""
+import datetime as dt
+import gzip
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+SNAPSHOT_NAME = re.compile(
+    r'^(?P<alias>\w+)-(?P<moment>\d{8}-\d{6})\.sqlite3(?P<gz>\.gz)?$'
+)
+MOMENT_FORMAT = '%Y%m%d-%H%M%S'
+GENERATION_TABLE = 'cache_generation'
+
+# (когда проверяли, поколение) на процесс
+_generation = (0, 0)
+
+
+class Snapshot:
+    """Файл снимка базы alias, снятого в момент moment (UTC)."""
+
+    def __init__(self, path, alias, moment, compressed):
+        self.path = path
+        self.alias = alias
+        self.moment = moment
+        self.compressed = compressed
+
+    @classmethod
+    def from_path(cls, path):
+        match = SNAPSHOT_NAME.match(os.path.basename(path))
+        if match is None:
+            return None
+        moment = dt.datetime.strptime(match.group('moment'),
+                                      MOMENT_FORMAT).replace(
+                                          tzinfo=dt.timezone.utc)
+        return cls(path, match.group('alias'), moment,
+                   bool(match.group('gz')))
+
+    def __repr__(self):
+        return f'<Snapshot {os.path.basename(self.path)}>'
+
+
+def snapshots(directory, alias=None):
+    """Снимки каталога (базы alias) от старых к новым."""
+    if not os.path.isdir(directory):
+        return []
+    found = (Snapshot.from_path(os.path.join(directory, name))
+             for name in os.listdir(directory))
+    return sorted((snapshot for snapshot in found
+                   if snapshot and alias in (None, snapshot.alias)),
+                  key=lambda snapshot: snapshot.moment)
+
+
+def snapshot_at(directory, alias, moment=None):
+    """Последний снимок базы alias не позже moment (или просто последний)."""
+    found = [snapshot for snapshot in snapshots(directory, alias)
+             if moment is None or snapshot.moment <= moment]
+    return found[-1] if found else None
+
+
+def check(connection):
+    """Ошибки quick_check копии; пустой список, если копия цела."""
+    return [row[0] for row in connection.execute('PRAGMA quick_check')
+            if row[0] != 'ok']
+
+
+def journal_mode(connection):
+    return connection.execute('PRAGMA journal_mode').fetchone()[0].lower()
+
+
+def copy(source, target, pages, pause, progress=None):
+    """Копирует базу соединения source в соединение target: в режиме WAL
+    одним шагом, иначе шагами по pages страниц."""
+    if journal_mode(source) == 'wal':
+        pages = -1
+    source.backup(target, pages=pages, sleep=pause,
+                  progress=progress and (
+                      lambda status, remaining, total:
+                      progress(total - remaining, total)
+                  ))
+
+
+def take(source, alias, directory, pages, pause, compress=False,
+         progress=None):
+    """Снимает копию с sqlite3-соединения source в каталог directory.
+
+    Возвращает Snapshot. Битая копия не сохраняется: ValueError.
+    """
+    os.makedirs(directory, exist_ok=True)
+    moment = dt.datetime.now(dt.timezone.utc)
+    name = f'{alias}-{moment.strftime(MOMENT_FORMAT)}.sqlite3'
+    handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    os.close(handle)
+    try:
+        target = sqlite3.connect(temporary)
+        try:
+            copy(source, target, pages, pause, progress)
+            # снимок - один файл, без журнала WAL рядом
+            target.execute('PRAGMA journal_mode = delete')
+            problems = check(target)
+        finally:
+            target.close()
+        if problems:
+            raise ValueError(f'Копия {alias} повреждена: {problems}')
+        if compress:
+            name += '.gz'
+            with open(temporary, 'rb') as raw, \
+                    gzip.open(f'{temporary}.gz', 'wb') as packed:
+                shutil.copyfileobj(raw, packed)
+            os.replace(f'{temporary}.gz', temporary)
+        with open(temporary, 'rb') as written:
+            os.fsync(written.fileno())
+        path = os.path.join(directory, name)
+        os.replace(temporary, path)
+    finally:
+        for leftover in (temporary, f'{temporary}.gz'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return Snapshot(path, alias, moment.replace(microsecond=0), compress)
+
+
+def rotate(directory, alias, keep):
+    """Удаляет снимки базы alias, кроме keep последних; возвращает
+    удалённые."""
+    old = snapshots(directory, alias)[:-keep] if keep else []
+    for snapshot in old:
+        os.remove(snapshot.path)
+    return old
+
+
+@contextmanager
+def opened(snapshot):
+    """sqlite3-соединение со снимком, сжатый распаковывается во временный
+    файл."""
+    if not snapshot.compressed:
+        connection = sqlite3.connect(snapshot.path)
+        try:
+            yield connection
+        finally:
+            connection.close()
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'snapshot.sqlite3')
+        with gzip.open(snapshot.path, 'rb') as packed, \
+                open(path, 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        connection = sqlite3.connect(path)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+def verify(snapshot):
+    """Полная проверка снимка: (ошибки integrity_check, {таблица: строк})."""
+    with opened(snapshot) as connection:
+        problems = [row[0] for row in
+                    connection.execute('PRAGMA integrity_check')
+                    if row[0] != 'ok']
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        counts = {table: connection.execute(
+            f'SELECT COUNT(*) FROM "{table}"'
+        ).fetchone()[0] for table in tables}
+    return problems, counts
+
+
+def restore(snapshot, target, pages, pause, progress=None):
+    """Заливает снимок в sqlite3-соединение target с рабочей базой."""
+    with opened(snapshot) as source:
+        problems = check(source)
+        if problems:
+            raise ValueError(f'Снимок {snapshot.path} повреждён: '
+                             f'{problems}')
+        copy(source, target, pages, pause, progress)
+
+
+def write_generation(connection):
+    """Записывает в sqlite3-соединение новое поколение кэша - время в
+    миллисекундах, больше любого прежнего."""
+    connection.execute(f'CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} '
+                       f'(generation INTEGER NOT NULL)')
+    connection.execute(f'DELETE FROM {GENERATION_TABLE}')
+    connection.execute(f'INSERT INTO {GENERATION_TABLE} VALUES (?)',
+                       (int(time.time() * 1000),))
+    connection.commit()
+
+
+def read_generation(alias):
+    """Поколение кэша базы alias, 0 - базу ещё не восстанавливали.
+
+    Читается прямо через sqlite3-соединение Django: в счётчики запросов
+    и журнал SQL это чтение не попадает.
+    """
+    connection = connections[alias]
+    connection.ensure_connection()
+    try:
+        row = connection.connection.execute(
+            f'SELECT generation FROM {GENERATION_TABLE}'
+        ).fetchone()
+    except sqlite3.Error:
+        return 0
+    return row[0] if row else 0
+
+
+def cache_generation():
+    """Наибольшее поколение кэша баз SHARD_DATABASES, перечитывается не
+    чаще раза в CACHE_GENERATION_CHECK_INTERVAL."""
+    global _generation
+    now = time.monotonic()
+    checked, generation = _generation
+    if now - checked >= settings.CACHE_GENERATION_CHECK_INTERVAL:
+        generation = max(read_generation(alias)
+                         for alias in settings.SHARD_DATABASES)
+        _generation = (now, generation)
+    return generation
+
+
+def cache_key(key, key_prefix, version):
+    """KEY_FUNCTION кэша: ключ Django с поколением кэша."""
+    return f'{key_prefix}:{version}:{cache_generation()}:{key}'
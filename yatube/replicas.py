@@ -0,0 +1,167 @@
+"""Чтение лент и профилей с реплик.
+
+Реплики из REPLICA_DATABASES - копии основной базы, которые обновляет
+manage.py replicate. Вьюхи, обёрнутые в replica_reads, читают с реплики,
+остальные запросы и все записи идут в default. Реплика не используется:
+
+* если она отстала больше чем на REPLICA_MAX_LAG секунд;
+* для пользователя, который недавно что-то записал в модели приложений
+  из REPLICA_PIN_APPS (пост, комментарий, подписка): ReplicaPinMiddleware
+  ставит ему cookie, и ещё REPLICA_PIN_SECONDS секунд он читает с
+  основной базы и видит свои изменения.
+"""
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+PIN_COOKIE = 'primary_until'
+STATE_TABLE = 'replication_state'
+
+_state = threading.local()
+# alias -> (когда проверяли, время снимка реплики)
+_copied_at = {}
+
+
+def mark_write():
+    """Отмечает, что текущий запрос пишет в базу."""
+    _state.wrote = True
+
+
+def read_copied_at(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'SELECT copied_at FROM {STATE_TABLE}')
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return row[0] if row else None
+
+
+def replica_lag(alias):
+    """Сколько секунд назад снята копия; бесконечность, если неизвестно.
+
+    Время снимка перечитывается не чаще раза в REPLICA_LAG_CHECK_INTERVAL.
+    """
+    now = time.time()
+    checked, copied_at = _copied_at.get(alias, (0, None))
+    if now - checked >= settings.REPLICA_LAG_CHECK_INTERVAL:
+        copied_at = read_copied_at(alias)
+        _copied_at[alias] = (now, copied_at)
+    return float('inf') if copied_at is None else now - copied_at
+
+
+def is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def choose_replica(request):
+    """Реплика для чтения или None, если читать надо с основной базы."""
+    if is_pinned(request):
+        return None
+    replicas = [alias for alias in settings.REPLICA_DATABASES
+                if replica_lag(alias) <= settings.REPLICA_MAX_LAG]
+    return random.choice(replicas) if replicas else None
+
+
+def read_from(alias, content):
+    """Выдаёт куски content, читая их с базы alias.
+
+    Потоковый ответ выбирает данные уже после возврата из вьюхи, поэтому
+    реплика выбирается на каждый шаг генератора заново.
+    """
+    content = iter(content)
+    while True:
+        _state.replica = alias
+        try:
+            chunk = next(content)
+        except StopIteration:
+            return
+        finally:
+            _state.replica = None
+        yield chunk
+
+
+def replica_reads(view):
+    """Чтения вьюхи идут на реплику, если она подходит, в том числе при
+    выводе потокового ответа."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = _state.replica = choose_replica(request)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _state.replica = None
+        if alias is not None and response.streaming:
+            response.streaming_content = read_from(
+                alias, response.streaming_content
+            )
+        return response
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None)
+
+    def db_for_write(self, model, **hints):
+        # сессии и last_login пишутся почти в каждом запросе, но на то,
+        # что пользователь читает, не влияют
+        if model._meta.app_label in settings.REPLICA_PIN_APPS:
+            mark_write()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # на репликах те же данные, что и в основной базе
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_DATABASES
+
+
+class ReplicaPinMiddleware:
+    """Закрепляет за записавшим пользователем чтение с основной базы."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.wrote = False
+        response = self.get_response(request)
+        if _state.wrote and settings.REPLICA_DATABASES:
+            pin_until = time.time() + settings.REPLICA_PIN_SECONDS
+            response.set_cookie(PIN_COOKIE, f'{pin_until:.3f}',
+                                max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True)
+        return response
+
+
+def replicate(source, target):
+    """Копирует базу source в реплику target через online backup SQLite.
+
+    Читатели реплики на время копирования ждут блокировку (busy_timeout),
+    но видят либо старую, либо новую копию целиком. В реплику
+    записывается время начала снимка - по нему считается отставание.
+    """
+    copied_at = time.time()
+    source_db = sqlite3.connect(source)
+    target_db = sqlite3.connect(target)
+    try:
+        source_db.backup(target_db)
+        target_db.execute(f'CREATE TABLE IF NOT EXISTS {STATE_TABLE} '
+                          f'(copied_at REAL NOT NULL)')
+        target_db.execute(f'DELETE FROM {STATE_TABLE}')
+        target_db.execute(f'INSERT INTO {STATE_TABLE} VALUES (?)',
+                          (copied_at,))
+        target_db.commit()
+    finally:
+        target_db.close()
+        source_db.close()
+    return copied_at
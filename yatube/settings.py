@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -56,6 +57,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.purge.EdgeCacheMiddleware',
+    'yatube.replicas.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,9 +99,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # соединение живёт между запросами, перед запросом проверяется
+        # (yatube.sqlite.check_connections)
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
     }
 }
 
+# PRAGMA для каждого нового соединения SQLite (yatube.sqlite): WAL не
+# блокирует чтение записью, synchronous=normal в WAL безопасен при сбое
+# процесса, mmap и кэш страниц - в байтах и КиБ (минус - в КиБ)
+SQLITE_PRAGMAS = {
+    # в новой базе свободные страницы возвращаются шагами (manage.py
+    # sqlite_maintenance); действует, только пока в базе нет таблиц, и
+    # поэтому идёт раньше journal_mode, который уже пишет заголовок файла
+    'auto_vacuum': 'incremental',
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -163,8 +185,12 @@ EMAIL_USE_TLS = True
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        # поколение кэша меняет manage.py restore_backup (yatube.backups)
+        'KEY_FUNCTION': 'yatube.backups.cache_key',
     }
 }
+# как часто процесс перечитывает поколение кэша из базы, в секундах
+CACHE_GENERATION_CHECK_INTERVAL = 1
 
 # для django toolbar
 INTERNAL_IPS = [
@@ -173,3 +199,130 @@ INTERNAL_IPS = [
 # константа для количества постов на странице для Paginator
 POSTS_ON_PAGE = 10
 POSTS_ON_PROFILE_PAGE = 4
+# количество комментариев, подгружаемых за один раз
+COMMENTS_ON_PAGE = 20
+# сколько уровней ответов показывать сразу, глубже - по ссылке
+COMMENT_THREAD_DEPTH = 3
+# потоковая отдача лент: шапка сразу, посты - порциями по STREAM_CHUNK_SIZE
+STREAMING_FEEDS = False
+STREAM_CHUNK_SIZE = 5
+# наибольшее число записей, которое API отдаёт за один запрос
+API_MAX_LIMIT = 100
+# наибольшее число подзапросов в одном пакетном запросе API
+API_BATCH_LIMIT = 20
+# больше изменений за раз синхронизация не отдаёт - клиент перечитает ленту
+SYNC_MAX_CHANGES = 500
+# сколько секунд процесс держит в своём кэше версию ленты для опроса
+# новых постов: версию, поднятую другим процессом, он увидит не позже
+FEED_VERSION_TIMEOUT = 5
+# живые обновления лент: адрес сервера событий (manage.py runsse) за
+# прокси, пустая строка - выключены
+SSE_URL = ""
+# пауза между heartbeat-комментариями и срок на отправку данных клиенту
+SSE_HEARTBEAT = 15
+# как часто сервер событий читает журнал изменений, в секундах
+SSE_POLL_INTERVAL = 1
+# сколько событий ждёт отправки медленному клиенту до его отключения
+SSE_QUEUE_SIZE = 100
+# сколько последних постов попадает в RSS/Atom-ленты
+FEED_ITEMS = 20
+# сколько хранится в кэше отрисованная лента; изменение постов ленты
+# сбрасывает кэш раньше
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+# сколько объектов в порции карты сайта (протокол допускает до 50 000
+# адресов) и срок хранения порции и индекса в кэше
+SITEMAP_CHUNK_SIZE = 10000
+SITEMAP_CACHE_TIMEOUT = 60 * 60 * 24
+# каталог для статических копий страниц (manage.py export_static)
+STATIC_EXPORT_ROOT = os.path.join(BASE_DIR, "export")
+# кэширующий прокси: сколько он хранит страницы для гостей и чем
+# сбрасывать их при изменениях (posts.purge.HttpPurgeBackend шлёт PURGE
+# на PURGE_URL, DummyPurgeBackend - без прокси)
+EDGE_CACHE_SECONDS = 60 * 60
+PURGE_BACKEND = "posts.purge.DummyPurgeBackend"
+PURGE_URL = "http://127.0.0.1:6081/"
+PURGE_TIMEOUT = 2
+# очередь записи (posts.writes): записи из вьюх выполняет один поток на
+# процесс, пачками до WRITE_BATCH_SIZE в одной транзакции; False - сразу
+WRITE_QUEUE_ENABLED = True
+WRITE_QUEUE_SIZE = 1000
+# сколько запрос ждёт места в переполненной очереди, в секундах
+WRITE_QUEUE_TIMEOUT = 10
+WRITE_BATCH_SIZE = 50
+# сколько запрос ждёт выполнения своей записи, в секундах
+WRITE_RESULT_TIMEOUT = 30
+# повторы пачки при "database is locked": пауза до
+# WRITE_RETRY_DELAY * 2 ** попытка секунд со случайным разбросом
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.05
+# файл блокировки, через который писатели разных процессов ждут друг друга;
+# лежит в каталоге для временных файлов, а не рядом с кодом
+WRITE_LOCK_FILE = os.getenv(
+    "WRITE_LOCK_FILE",
+    os.path.join(tempfile.gettempdir(), "yatube-db.sqlite3.lock"),
+)
+# метрики очереди записи всех процессов (manage.py write_stats)
+WRITE_METRICS_FILE = os.getenv(
+    "WRITE_METRICS_FILE",
+    os.path.join(tempfile.gettempdir(), "yatube-write-metrics.json"),
+)
+# реплика для чтения лент и профилей (yatube.replicas): путь к копии
+# основной базы в DB_REPLICA, копию обновляет manage.py replicate
+if os.getenv('DB_REPLICA'):
+    DATABASES['replica'] = dict(DATABASES['default'],
+                                NAME=os.getenv('DB_REPLICA'),
+                                TEST={'MIRROR': 'default'})
+REPLICA_DATABASES = ['replica'] if 'replica' in DATABASES else []
+DATABASE_ROUTERS = ['posts.shards.ShardRouter',
+                    'yatube.replicas.ReplicaRouter']
+# реплика, отставшая больше чем на столько секунд, не используется
+REPLICA_MAX_LAG = 5
+# как часто перечитывать время снимка реплики, в секундах
+REPLICA_LAG_CHECK_INTERVAL = 1
+# сколько секунд после записи пользователь читает с основной базы
+REPLICA_PIN_SECONDS = 10
+# запись в модели каких приложений закрепляет пользователя за основной базой
+REPLICA_PIN_APPS = ("posts",)
+# шарды постов и комментариев (posts.shards): пути к дополнительным
+# базам через запятую в DB_SHARDS, первый шард - default
+for number, path in enumerate(
+        filter(None, os.getenv('DB_SHARDS', '').split(',')), 1):
+    DATABASES[f'shard{number}'] = dict(DATABASES['default'], NAME=path)
+SHARD_DATABASES = ['default'] + [alias for alias in DATABASES
+                                 if alias.startswith('shard')]
+# сколько потоков опрашивают шарды параллельно
+SHARD_WORKERS = 8
+# номер узла в id постов и комментариев (posts.ids), от 0 до 31: без
+# ID_NODE процесс арендует свободный номер через файл блокировки в
+# ID_LOCK_DIR, с ID_NODE - именно этот и не запустится, если номер занят
+ID_NODE = int(os.getenv('ID_NODE')) if os.getenv('ID_NODE') else None
+ID_LOCK_DIR = os.getenv('ID_LOCK_DIR', tempfile.gettempdir())
+# через сколько дней пост с комментариями уходит в архив (archive_posts)
+ARCHIVE_AFTER_DAYS = 365
+# сколько постов archive_posts переносит одной транзакцией
+ARCHIVE_BATCH_SIZE = 500
+# эталон находок manage.py advise_indexes --check: проходы по таблицам и
+# временные B-деревья, с которыми мы согласились
+QUERY_PLAN_BASELINE = os.path.join(BASE_DIR, "posts", "query_plans.json")
+# сколько строк пачечное заполнение (posts.backfill) обновляет одной
+# транзакцией и сколько секунд ждёт между пачками, пропуская записи сайта
+BACKFILL_BATCH_SIZE = 1000
+BACKFILL_PAUSE = 0.05
+# окно низкой нагрузки для manage.py sqlite_maintenance, местное время;
+# окно может переходить через полночь
+SQLITE_MAINTENANCE_WINDOW = ("03:00", "05:00")
+# сколько секунд за проход возвращать свободные страницы и по сколько
+# страниц за шаг (одна короткая транзакция)
+SQLITE_VACUUM_SECONDS = 60
+SQLITE_VACUUM_STEP_PAGES = 256
+# сколько строк индекса ANALYZE просматривает для статистики
+SQLITE_ANALYSIS_LIMIT = 1000
+# снимки manage.py backup_db (yatube.backups): каталог, сколько хранить
+# на базу и сжимать ли gzip
+BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(BASE_DIR, 'backups'))
+BACKUP_KEEP = 7
+BACKUP_COMPRESS = True
+# без WAL копирование по стольку страниц за шаг с паузой в секундах между
+# шагами (базу в режиме WAL yatube.backups копирует одним шагом)
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_PAUSE = 0.01
@@ -0,0 +1,38 @@
+"""Настройка соединений SQLite.
+
+PRAGMA из SQLITE_PRAGMAS выполняются для каждого нового соединения через
+сигнал connection_created. Постоянные соединения (CONN_MAX_AGE) перед
+каждым запросом проверяются простым запросом: сломанное соединение
+закрывается, и Django откроет новое.
+"""
+import sqlite3
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragma_statements(pragmas):
+    return [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(settings.SQLITE_PRAGMAS):
+            cursor.execute(statement)
+
+
+@receiver(request_started)
+def check_connections(sender, **kwargs):
+    for connection in connections.all():
+        if connection.vendor != 'sqlite' or connection.connection is None:
+            continue
+        try:
+            connection.connection.execute('SELECT 1').fetchone()
+        except sqlite3.Error:
+            connection.close()
@@ -19,6 +19,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from posts import sitemaps
+
 handler404 = "posts.views.page_not_found"  # noqa
 handler500 = "posts.views.server_error"  # noqa
 
@@ -27,6 +29,10 @@ urlpatterns = [
     path("about/", include("about.urls")),
     path("auth/", include("django.contrib.auth.urls")),
     path("admin/", admin.site.urls),
+    path("api/v1/", include("posts.api_urls")),
+    path("sitemap.xml", sitemaps.sitemap_index, name="sitemap"),
+    path("sitemap-<str:section>-<int:number>.xml", sitemaps.sitemap_chunk,
+         name="sitemap_chunk"),
     path("", include("posts.urls")),
 ]
 